@@ -5,16 +5,28 @@ from flask import Flask
 from flask_cors import CORS
 
 # Blueprints
+from app.api.batch import bp as batch_bp
 from app.api.firewalls import bp as firewalls_bp
+from app.api.jobs import bp as jobs_bp
 from app.api.policies import bp as policies_bp
 from app.api.rules import bp as rules_bp
+from app.api.templates import bp as templates_bp
+from app.cli import init_cli
+from app.compression import init_compression
 from app.db import init_db
+from app.jobs import init_jobs
 from app.logger import configure_logging
+from app.metrics import metrics
+from app.ratelimit import init_rate_limiting
 
 # Import definitions
+from app.schemas.batch import definitions as batch_definitions
 from app.schemas.firewall import definitions as firewall_definitions
+from app.schemas.job import definitions as job_definitions
 from app.schemas.policy import definitions as policy_definitions
 from app.schemas.rule import definitions as rule_definitions
+from app.schemas.template import definitions as template_definitions
+from app.services.rule_stats import init_hit_flusher
 
 
 def create_app(test_config=None):
@@ -22,7 +34,14 @@ def create_app(test_config=None):
     app = Flask(__name__)
 
     default_sqlite = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///fireflow.db")
-    app.config.from_mapping({"SQLALCHEMY_DATABASE_URI": default_sqlite})
+    # Extra firewall shards, comma separated; the primary database is shard 0
+    shard_uris = os.getenv("SHARD_DATABASE_URIS")
+    app.config.from_mapping(
+        {
+            "SQLALCHEMY_DATABASE_URI": default_sqlite,
+            "SHARD_DATABASE_URIS": shard_uris.split(",") if shard_uris else [],
+        }
+    )
 
     if test_config:
         app.config.update(test_config)
@@ -33,13 +52,31 @@ def create_app(test_config=None):
     # Database
     init_db(app)
 
+    # Background jobs
+    init_jobs(app)
+
+    # Periodic flushing of rule hit counters
+    init_hit_flusher(app)
+
     # CORS
     CORS(app)
 
+    # Response compression
+    init_compression(app)
+
+    # Rate limiting and admission control
+    init_rate_limiting(app)
+
     # Register Blueprints
     app.register_blueprint(firewalls_bp)
     app.register_blueprint(policies_bp)
     app.register_blueprint(rules_bp)
+    app.register_blueprint(templates_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(batch_bp)
+
+    # CLI commands
+    init_cli(app)
 
     # Swagger
     swagger = Swagger(app)
@@ -54,6 +91,9 @@ def create_app(test_config=None):
             **firewall_definitions,
             **policy_definitions,
             **rule_definitions,
+            **template_definitions,
+            **job_definitions,
+            **batch_definitions,
         },
     }
 
@@ -62,4 +102,8 @@ def create_app(test_config=None):
         app.logger.info("Root endpoint accessed")
         return {"message": "FireFlow API", "docs": "/apidocs"}
 
+    @app.route("/metrics")
+    def metrics_view():
+        return metrics.snapshot()
+
     return app
@@ -0,0 +1,45 @@
+"""
+Blueprint for the multi-operation batch endpoint.
+"""
+
+from flask import Blueprint, jsonify, request
+
+from app.db import get_db
+from app.idempotency import idempotent
+from app.services import batch as batch_service
+
+bp = Blueprint("batch", __name__, url_prefix="/api")
+
+
+@bp.route("/batch", methods=["POST"])
+@idempotent
+def run_batch():
+    """
+    Run an ordered list of operations in one transaction
+    ---
+    tags:
+      - Batch
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          $ref: '#/definitions/BatchIn'
+    responses:
+      200:
+        description: The result of every operation, in order
+        schema:
+          $ref: '#/definitions/BatchOut'
+      400:
+        description: An operation failed; nothing was committed
+    """
+    db = get_db()
+    body = request.get_json()
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list):
+        return jsonify({"error": "operations must be a list"}), 400
+    try:
+        results = batch_service.run_batch(db, operations)
+    except batch_service.BatchError as e:
+        return jsonify({"error": str(e), "index": e.index, "op": e.op}), 400
+    return jsonify({"results": results}), 200
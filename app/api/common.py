@@ -0,0 +1,94 @@
+"""
+Request helpers shared by the API blueprints.
+"""
+
+from flask import Response, current_app, jsonify, request, url_for
+
+from app.coalesce import read_flight
+from app.jobs import get_runner
+from app.services.fields import FieldSpec, parse_fields
+
+ON_DUPLICATE_MODES = ("reject", "report")
+
+
+def get_on_duplicate() -> str:
+    """Read the ``on_duplicate`` query parameter, raising ValueError if invalid."""
+    mode = request.args.get("on_duplicate", "reject")
+    if mode not in ON_DUPLICATE_MODES:
+        raise ValueError("on_duplicate must be 'reject' or 'report'")
+    return mode
+
+
+def get_fields(model) -> FieldSpec | None:
+    """
+    Read the ``fields`` query parameter against an output schema, raising
+    ValueError on unknown fields. None means every field.
+    """
+    return parse_fields(request.args.get("fields"), model)
+
+
+def to_columnar(rows: list[dict]) -> dict:
+    """
+    Turn a list of objects into one array per field.
+    Nested lists of objects are converted the same way.
+    """
+    columns: dict[str, list] = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, [])
+    for key, values in columns.items():
+        for row in rows:
+            value = row.get(key)
+            if isinstance(value, list) and value and isinstance(value[0], dict):
+                value = to_columnar(value)
+            values.append(value)
+    return columns
+
+
+def shape_rows(rows: list[dict]):
+    """
+    Apply the ``shape`` query parameter to a listing: "rows" (default) keeps
+    a list of objects, "columnar" returns arrays per field.
+    """
+    shape = request.args.get("shape", "rows")
+    if shape == "rows":
+        return rows
+    if shape == "columnar":
+        return to_columnar(rows)
+    raise ValueError("shape must be 'rows' or 'columnar'")
+
+
+def coalesced_json(version, produce) -> Response:
+    """
+    Serve a JSON GET through single-flight coalescing.
+    Concurrent requests for the same route, arguments, query string and
+    ``version`` share one call to ``produce()``, which returns
+    ``(payload, status)``, and one serialized byte buffer.
+    """
+    key = (
+        request.endpoint,
+        tuple(sorted(request.view_args.items())),
+        request.query_string,
+        version,
+    )
+
+    def run():
+        payload, status = produce()
+        return current_app.json.dumps(payload).encode() + b"\n", status
+
+    (body, status), _ = read_flight.do(key, run)
+    return Response(body, status=status, mimetype="application/json")
+
+
+def wants_async() -> bool:
+    """Whether the ``async`` query parameter asks to run the request as a job."""
+    return request.args.get("async", "false").lower() in ("1", "true")
+
+
+def accepted(kind: str, params: dict) -> Response:
+    """Submit a background job and answer 202 Accepted pointing at it."""
+    job = get_runner().submit(kind, params)
+    response = jsonify(job.dict())
+    response.status_code = 202
+    response.headers["Location"] = url_for("jobs.get_job", job_id=job.id)
+    return response
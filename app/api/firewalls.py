@@ -2,16 +2,69 @@
 Blueprint for Firewall API endpoints.
 """
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 
+from app.api.common import accepted, get_fields, wants_async
 from app.db import get_db
+from app.idempotency import idempotent
+from app.jobs import task
+from app.schemas.firewall import (
+    EvaluationIn,
+    FirewallOut,
+    FirewallStatsOut,
+    SimulationIn,
+)
 from app.services import firewall as firewall_service
+from app.services import firewall_stats as firewall_stats_service
+from app.services import simulation as simulation_service
+from app.services import verdict as verdict_service
 
 bp = Blueprint("firewalls", __name__, url_prefix="/api/firewalls")
 
+MAX_PAGE_SIZE = 1000
+
+
+def _page_size(value: str | None) -> int | None:
+    if value is None:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def _batch_summary(results: list[dict]) -> dict:
+    summary = {
+        status: sum(r["status"] == status for r in results)
+        for status in ("created", "updated", "error")
+    }
+    return {"results": results, **summary}
+
+
+@task("firewalls.batch_upsert")
+def _batch_upsert_job(db, job, items: list[dict]) -> dict:
+    return _batch_summary(
+        firewall_service.upsert_firewalls(db, items, progress=job.progress)
+    )
+
+
+@task("firewalls.simulate")
+def _simulate_job(db, job, fw_id: int, changes: list[dict], flows: list[dict]) -> dict:
+    return simulation_service.simulate(db, fw_id, changes, flows, progress=job.progress)
+
+
+@task("firewalls.delete")
+def _delete_job(db, job, fw_id: int) -> dict:
+    deleted = firewall_service.delete_firewall(db, fw_id, progress=job.progress)
+    return {"deleted": fw_id if deleted else None}
+
 
 # Routes
 @bp.route("/", methods=["POST"])
+@idempotent
 def create_firewall():
     """
     Create a new firewall
@@ -39,13 +92,83 @@ def create_firewall():
     return jsonify(fw.dict()), 201
 
 
+@bp.route("/:batch", methods=["POST"])
+@idempotent
+def batch_upsert_firewalls():
+    """
+    Create or update many firewalls by name in one transaction
+    ---
+    tags:
+      - Firewalls
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/FirewallIn'
+      - name: async
+        in: query
+        required: false
+        type: boolean
+        description: Run as a background job and answer 202 with the job.
+    responses:
+      200:
+        description: Per-item results with status created, updated or error
+      202:
+        description: Background job accepted
+        schema:
+          $ref: '#/definitions/JobOut'
+      400:
+        description: Body is not a list
+    """
+    db = get_db()
+    body = request.get_json()
+    if not isinstance(body, list):
+        return jsonify({"error": "body must be a list of firewalls"}), 400
+    if wants_async():
+        return accepted("firewalls.batch_upsert", {"items": body})
+    results = firewall_service.upsert_firewalls(db, body)
+    return jsonify(_batch_summary(results)), 200
+
+
 @bp.route("/", methods=["GET"])
 def list_firewalls():
     """
-    List all firewalls
+    List firewalls, with optional search and keyset pagination
     ---
     tags:
       - Firewalls
+    parameters:
+      - name: q
+        in: query
+        required: false
+        type: string
+        description: Full-text search over name and description.
+      - name: name_prefix
+        in: query
+        required: false
+        type: string
+      - name: sort
+        in: query
+        required: false
+        type: string
+        enum: [id, -id, name, -name]
+      - name: limit
+        in: query
+        required: false
+        type: integer
+        description: Page size (max 1000). The next page cursor is returned in the X-Next-Cursor header.
+      - name: cursor
+        in: query
+        required: false
+        type: string
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return, dotted for nested objects (e.g. id,name,policies.rules.action).
     responses:
       200:
         description: List of firewalls
@@ -53,10 +176,62 @@ def list_firewalls():
           type: array
           items:
             $ref: '#/definitions/FirewallOut'
+      400:
+        description: Invalid query parameters
     """
     db = get_db()
-    fws = firewall_service.list_firewalls(db)
-    return jsonify([fw.dict() for fw in fws]), 200
+    sort = request.args.get("sort", "id")
+    try:
+        limit = _page_size(request.args.get("limit"))
+        fields = get_fields(FirewallOut)
+        fws = firewall_service.list_firewalls(
+            db,
+            q=request.args.get("q"),
+            name_prefix=request.args.get("name_prefix"),
+            sort=sort,
+            limit=limit,
+            cursor=request.args.get("cursor"),
+            fields=fields,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify([fw.dict(exclude_unset=fields is not None) for fw in fws])
+    if limit and len(fws) == limit:
+        response.headers["X-Next-Cursor"] = firewall_service.encode_cursor(
+            fws[-1], sort
+        )
+    return response, 200
+
+
+@bp.route("/stats", methods=["GET"])
+def list_firewall_stats():
+    """
+    Get policy and rule counts of every firewall
+    ---
+    tags:
+      - Firewalls
+    parameters:
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return (e.g. firewall_id,rules).
+    responses:
+      200:
+        description: Counts per firewall, ordered by ID
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/FirewallStatsOut'
+      400:
+        description: Unknown field
+    """
+    db = get_db()
+    try:
+        fields = get_fields(FirewallStatsOut)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(firewall_stats_service.list_firewall_stats(db, fields)), 200
 
 
 @bp.route("/<int:fw_id>", methods=["GET"])
@@ -71,19 +246,30 @@ def get_firewall(fw_id: int):
         in: path
         required: true
         type: integer
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return, dotted for nested objects (e.g. id,name,policies.id).
     responses:
       200:
         description: Firewall found
         schema:
           $ref: '#/definitions/FirewallOut'
+      400:
+        description: Unknown field
       404:
         description: Firewall not found
     """
     db = get_db()
-    fw = firewall_service.get_firewall(db, fw_id)
+    try:
+        fields = get_fields(FirewallOut)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fw = firewall_service.get_firewall(db, fw_id, fields)
     if not fw:
         return jsonify({"error": "not found"}), 404
-    return jsonify(fw.dict()), 200
+    return jsonify(fw.dict(exclude_unset=fields is not None)), 200
 
 
 @bp.route("/<int:fw_id>", methods=["PUT"])
@@ -133,14 +319,139 @@ def delete_firewall(fw_id: int):
         in: path
         required: true
         type: integer
+      - name: async
+        in: query
+        required: false
+        type: boolean
+        description: Run as a background job and answer 202 with the job.
     responses:
       200:
         description: Firewall deleted
+      202:
+        description: Background job accepted
+        schema:
+          $ref: '#/definitions/JobOut'
       404:
         description: Firewall not found
     """
     db = get_db()
+    if wants_async():
+        if firewall_service.firewall_version(db, fw_id) is None:
+            return jsonify({"error": "not found"}), 404
+        return accepted("firewalls.delete", {"fw_id": fw_id})
     deleted = firewall_service.delete_firewall(db, fw_id)
     if not deleted:
         return jsonify({"error": "not found"}), 404
     return jsonify({"deleted": fw_id}), 200
+
+
+@bp.route("/<int:fw_id>/simulate", methods=["POST"])
+def simulate_firewall(fw_id: int):
+    """
+    Report which flows would change verdict under proposed rule changes
+    ---
+    tags:
+      - Firewalls
+    parameters:
+      - name: fw_id
+        in: path
+        required: true
+        type: integer
+      - name: body
+        in: body
+        required: true
+        schema:
+          $ref: '#/definitions/SimulationIn'
+      - name: async
+        in: query
+        required: false
+        type: boolean
+        description: Run as a background job and answer 202 with the job.
+    responses:
+      200:
+        description: Flow counts, verdict transitions and per-flow deltas
+      202:
+        description: Background job accepted
+        schema:
+          $ref: '#/definitions/JobOut'
+      400:
+        description: Invalid changes or flows
+      404:
+        description: Firewall not found
+    """
+    db = get_db()
+    try:
+        body = SimulationIn.model_validate(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    changes = [change.model_dump() for change in body.changes]
+    flows = [flow.model_dump() for flow in body.flows]
+    if firewall_service.firewall_version(db, fw_id) is None:
+        return jsonify({"error": "not found"}), 404
+    if wants_async():
+        return accepted(
+            "firewalls.simulate", {"fw_id": fw_id, "changes": changes, "flows": flows}
+        )
+    try:
+        result = simulation_service.simulate(db, fw_id, changes, flows)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result), 200
+
+
+@bp.route("/<int:fw_id>/evaluate", methods=["POST"])
+def evaluate_flows(fw_id: int):
+    """
+    Evaluate flows against a firewall's rules, through the verdict cache
+    ---
+    tags:
+      - Firewalls
+    parameters:
+      - name: fw_id
+        in: path
+        required: true
+        type: integer
+      - name: body
+        in: body
+        required: true
+        schema:
+          $ref: '#/definitions/EvaluationIn'
+    responses:
+      200:
+        description: One verdict per flow, in order. Flows matching no rule get the default deny.
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/Verdict'
+      400:
+        description: Invalid flows
+      404:
+        description: Firewall not found
+    """
+    db = get_db()
+    try:
+        body = EvaluationIn.model_validate(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    flows = [flow.model_dump() for flow in body.flows]
+    # Matched rules are counted as hits, written by this worker's flusher
+    current_app.extensions["hit_flusher"].start()
+    try:
+        verdicts = verdict_service.evaluate_flows(db, fw_id, flows)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(verdicts), 200
+
+
+@bp.route("/verdict-cache", methods=["GET"])
+def verdict_cache_stats():
+    """
+    Get the size and hit ratio of the flow verdict cache of this worker
+    ---
+    tags:
+      - Firewalls
+    responses:
+      200:
+        description: Size, limits, hit/miss/eviction/expiration counts and hit ratio
+    """
+    return jsonify(verdict_service.verdict_cache.stats()), 200
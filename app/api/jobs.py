@@ -0,0 +1,77 @@
+"""
+Blueprint for background job endpoints.
+"""
+
+from flask import Blueprint, jsonify
+
+from app.api.common import get_fields
+from app.db import get_db
+from app.jobs import get_runner
+from app.schemas.job import JobOut
+
+bp = Blueprint("jobs", __name__, url_prefix="/api/jobs")
+
+
+@bp.route("/<int:job_id>", methods=["GET"])
+def get_job(job_id: int):
+    """
+    Get the status, progress and result of a background job
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: job_id
+        in: path
+        required: true
+        type: integer
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return (e.g. status,done,total).
+    responses:
+      200:
+        description: Job found
+        schema:
+          $ref: '#/definitions/JobOut'
+      400:
+        description: Unknown field
+      404:
+        description: Job not found
+    """
+    db = get_db()
+    try:
+        fields = get_fields(JobOut)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = get_runner().get(db, job_id, fields)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job.dict(exclude_unset=fields is not None)), 200
+
+
+@bp.route("/<int:job_id>/cancel", methods=["POST"])
+def cancel_job(job_id: int):
+    """
+    Cancel a background job
+    ---
+    tags:
+      - Jobs
+    parameters:
+      - name: job_id
+        in: path
+        required: true
+        type: integer
+    responses:
+      200:
+        description: Queued jobs are cancelled, running jobs stop and roll back at their next progress report
+        schema:
+          $ref: '#/definitions/JobOut'
+      404:
+        description: Job not found
+    """
+    db = get_db()
+    job = get_runner().cancel(db, job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job.dict()), 200
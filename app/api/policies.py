@@ -4,13 +4,37 @@ Blueprint for Filtering Policy API endpoints.
 
 from flask import Blueprint, jsonify, request
 
+from app.api.common import (
+    accepted,
+    coalesced_json,
+    get_fields,
+    get_on_duplicate,
+    shape_rows,
+    wants_async,
+)
 from app.db import get_db
+from app.idempotency import idempotent
+from app.jobs import task
+from app.schemas.policy import PolicyIn, PolicyOut
+from app.services import firewall as firewall_service
+from app.services import optimizer as optimizer_service
 from app.services import policy as policy_service
+from app.services import rule as rule_service
+from app.services import template as template_service
+from app.services.canonical import DuplicateRuleError
 
 bp = Blueprint("policies", __name__, url_prefix="/api/policies")
 
 
+@task("policies.optimize")
+def _optimize_job(db, job, policy_id: int, apply: bool) -> dict:
+    return optimizer_service.optimize_policy(
+        db, policy_id, apply=apply, progress=job.progress
+    )
+
+
 @bp.route("/firewall/<int:fw_id>", methods=["POST"])
+@idempotent
 def add_policy(fw_id: int):
     """
     Add a new policy to a firewall
@@ -27,22 +51,90 @@ def add_policy(fw_id: int):
         required: true
         schema:
           $ref: '#/definitions/PolicyIn'
+      - name: on_duplicate
+        in: query
+        required: false
+        type: string
+        enum: [reject, report]
+        description: Reject duplicate rules with 409 (default) or skip and count them.
     responses:
       201:
         description: Policy created
         schema:
           $ref: '#/definitions/PolicyOut'
+      400:
+        description: Invalid policy or rules
       404:
         description: Firewall not found
+      409:
+        description: Duplicate rules in request
     """
     db = get_db()
-    body = request.get_json()
+    try:
+        on_duplicate = get_on_duplicate()
+        body = PolicyIn.model_validate(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rules = [rule.model_dump() for rule in body.rules or []]
     try:
         policy = policy_service.add_policy(
             db,
             fw_id=fw_id,
-            name=body["name"],
-            rules=body.get("rules", []),
+            name=body.name,
+            rules=rules,
+            on_duplicate=on_duplicate,
+        )
+    except DuplicateRuleError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    if on_duplicate == "report":
+        return (
+            jsonify({**policy.dict(), "duplicates": len(rules) - len(policy.rules)}),
+            201,
+        )
+    return jsonify(policy.dict()), 201
+
+
+@bp.route("/firewall/<int:fw_id>/template/<int:template_id>", methods=["POST"])
+@idempotent
+def attach_template(fw_id: int, template_id: int):
+    """
+    Attach a policy template to a firewall by reference
+    ---
+    tags:
+      - Policies
+    parameters:
+      - name: fw_id
+        in: path
+        required: true
+        type: integer
+      - name: template_id
+        in: path
+        required: true
+        type: integer
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            name:
+              type: string
+              description: Policy name, defaults to the template name
+    responses:
+      201:
+        description: Policy created, sharing the template's rules
+        schema:
+          $ref: '#/definitions/PolicyOut'
+      404:
+        description: Firewall or template not found
+    """
+    db = get_db()
+    body = request.get_json(silent=True) or {}
+    try:
+        policy = template_service.attach_template(
+            db, fw_id, template_id, name=body.get("name")
         )
     except ValueError as e:
         return jsonify({"error": str(e)}), 404
@@ -61,6 +153,17 @@ def list_policies(fw_id: int):
         in: path
         required: true
         type: integer
+      - name: shape
+        in: query
+        required: false
+        type: string
+        enum: [rows, columnar]
+        description: Return a list of objects (default) or one array per field.
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return, dotted for nested objects (e.g. id,name,rules.action).
     responses:
       200:
         description: List of policies
@@ -68,15 +171,29 @@ def list_policies(fw_id: int):
           type: array
           items:
             $ref: '#/definitions/PolicyOut'
+      400:
+        description: Unknown field or shape
       404:
         description: Firewall not found
     """
     db = get_db()
     try:
-        policies = policy_service.list_policies(db, fw_id)
+        fields = get_fields(PolicyOut)
     except ValueError as e:
-        return jsonify({"error": str(e)}), 404
-    return jsonify([p.dict() for p in policies]), 200
+        return jsonify({"error": str(e)}), 400
+
+    def produce():
+        try:
+            policies = policy_service.list_policies(db, fw_id, fields)
+        except ValueError as e:
+            return {"error": str(e)}, 404
+        try:
+            rows = [p.dict(exclude_unset=fields is not None) for p in policies]
+            return shape_rows(rows), 200
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+    return coalesced_json(firewall_service.firewall_version(db, fw_id), produce)
 
 
 @bp.route("/<int:policy_id>", methods=["DELETE"])
@@ -102,3 +219,55 @@ def delete_policy(policy_id: int):
     if not deleted:
         return jsonify({"error": "not found"}), 404
     return jsonify({"deleted": policy_id}), 200
+
+
+@bp.route("/<int:policy_id>/optimize", methods=["POST"])
+def optimize_policy(policy_id: int):
+    """
+    Merge adjacent and overlapping rule prefixes of a policy
+    ---
+    tags:
+      - Policies
+    parameters:
+      - name: policy_id
+        in: path
+        required: true
+        type: integer
+      - name: mode
+        in: query
+        required: false
+        type: string
+        enum: [dry-run, apply]
+        description: Only report the optimized rules (default) or apply them.
+      - name: async
+        in: query
+        required: false
+        type: boolean
+        description: Run as a background job and answer 202 with the job.
+    responses:
+      200:
+        description: Rule counts before and after, and the optimized rules
+      202:
+        description: Background job accepted
+        schema:
+          $ref: '#/definitions/JobOut'
+      400:
+        description: Invalid mode
+      404:
+        description: Policy not found
+    """
+    db = get_db()
+    mode = request.args.get("mode", "dry-run")
+    if mode not in ("dry-run", "apply"):
+        return jsonify({"error": "mode must be 'dry-run' or 'apply'"}), 400
+    if wants_async():
+        if rule_service.policy_firewall_version(db, policy_id) is None:
+            return jsonify({"error": "Policy not found"}), 404
+        return accepted(
+            "policies.optimize", {"policy_id": policy_id, "apply": mode == "apply"}
+        )
+    try:
+        result = optimizer_service.optimize_policy(db, policy_id, apply=mode == "apply")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(result), 200
@@ -2,15 +2,49 @@
 Blueprint for Firewall Rule API endpoints.
 """
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 
+from app.api.common import (
+    accepted,
+    coalesced_json,
+    get_fields,
+    get_on_duplicate,
+    shape_rows,
+    wants_async,
+)
 from app.db import get_db
+from app.idempotency import idempotent
+from app.jobs import task
+from app.schemas.rule import HitsIn, RuleIn, RuleOut, RuleStatsOut
 from app.services import rule as rule_service
+from app.services import rule_stats as rule_stats_service
+from app.services.canonical import DuplicateRuleError
 
 bp = Blueprint("rules", __name__, url_prefix="/api/rules")
 
 
+@task("rules.delete")
+def _delete_rules_job(
+    db, job, policy_id: int, rule_ids: list[int] | None, all_rules: bool = False
+) -> dict:
+    return {
+        "deleted": rule_service.delete_rules(
+            db, policy_id, rule_ids, all_rules, progress=job.progress
+        )
+    }
+
+
+@task("rules.replace")
+def _replace_rules_job(
+    db, job, policy_id: int, rules: list[dict], on_duplicate: str
+) -> dict:
+    return rule_service.replace_rules(
+        db, policy_id, rules, on_duplicate, progress=job.progress
+    )
+
+
 @bp.route("/policy/<int:policy_id>", methods=["POST"])
+@idempotent
 def add_rule(policy_id: int):
     """
     Add a new rule to a policy
@@ -27,25 +61,45 @@ def add_rule(policy_id: int):
         required: true
         schema:
           $ref: '#/definitions/RuleIn'
+      - name: on_duplicate
+        in: query
+        required: false
+        type: string
+        enum: [reject, report]
+        description: Reject duplicates with 409 (default) or report the existing rule.
     responses:
+      200:
+        description: Duplicate reported, existing rule returned
       201:
         description: Rule created
         schema:
           $ref: '#/definitions/RuleOut'
+      400:
+        description: Invalid rule
       404:
         description: Policy not found
+      409:
+        description: Rule already exists in policy
     """
     db = get_db()
-    body = request.get_json()
+    try:
+        on_duplicate = get_on_duplicate()
+        body = RuleIn.model_validate(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     try:
         rule = rule_service.add_rule(
             db,
             policy_id=policy_id,
-            action=body["action"],
-            src=body.get("src"),
-            dst=body.get("dst"),
-            protocol=body.get("protocol"),
+            action=body.action,
+            src=body.src,
+            dst=body.dst,
+            protocol=body.protocol,
         )
+    except DuplicateRuleError as e:
+        if on_duplicate == "report":
+            return jsonify({"duplicate": True, "rule": e.rule.dict()}), 200
+        return jsonify({"error": str(e), "rule": e.rule.dict()}), 409
     except ValueError as e:
         return jsonify({"error": str(e)}), 404
     return jsonify(rule.dict()), 201
@@ -63,6 +117,23 @@ def list_rules(policy_id: int):
         in: path
         required: true
         type: integer
+      - name: include
+        in: query
+        required: false
+        type: string
+        enum: [stats]
+        description: Add hit counters to every rule (RuleStatsOut).
+      - name: shape
+        in: query
+        required: false
+        type: string
+        enum: [rows, columnar]
+        description: Return a list of objects (default) or one array per field.
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return, dotted for nested objects (e.g. id,action,hits).
     responses:
       200:
         description: List of rules
@@ -70,15 +141,175 @@ def list_rules(policy_id: int):
           type: array
           items:
             $ref: '#/definitions/RuleOut'
+      400:
+        description: Unknown field or shape
+      404:
+        description: Policy not found
+    """
+    db = get_db()
+    include_stats = request.args.get("include") == "stats"
+    try:
+        fields = get_fields(RuleStatsOut if include_stats else RuleOut)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def produce():
+        try:
+            if include_stats:
+                rules = rule_stats_service.list_rules_with_stats(
+                    db, policy_id, fields=fields
+                )
+            else:
+                rules = rule_service.list_rules(db, policy_id, fields)
+        except ValueError as e:
+            return {"error": str(e)}, 404
+        try:
+            rows = [r.dict(exclude_unset=fields is not None) for r in rules]
+            return shape_rows(rows), 200
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+    if include_stats:
+        # Hit counts change without a firewall version bump
+        body, status = produce()
+        return jsonify(body), status
+    return coalesced_json(rule_service.policy_firewall_version(db, policy_id), produce)
+
+
+@bp.route("/policy/<int:policy_id>", methods=["DELETE"])
+def delete_rules(policy_id: int):
+    """
+    Delete several rules of a policy at once
+    ---
+    tags:
+      - Rules
+    parameters:
+      - name: policy_id
+        in: path
+        required: true
+        type: integer
+      - name: ids
+        in: query
+        required: false
+        type: string
+        description: Comma-separated rule IDs. Required unless all is true.
+      - name: all
+        in: query
+        required: false
+        type: boolean
+        description: Delete every rule of the policy. Not allowed with ids.
+      - name: async
+        in: query
+        required: false
+        type: boolean
+        description: Run as a background job and answer 202 with the job.
+    responses:
+      200:
+        description: Number of deleted rules
+      202:
+        description: Background job accepted
+        schema:
+          $ref: '#/definitions/JobOut'
+      400:
+        description: Invalid rule IDs, or neither or both of ids and all given
       404:
         description: Policy not found
     """
     db = get_db()
+    raw_ids = request.args.get("ids")
+    all_rules = request.args.get("all", "").lower() in ("1", "true")
+    if (raw_ids is None) != all_rules:
+        return jsonify({"error": "Pass either ids or all=true"}), 400
+    rule_ids = None
+    if raw_ids is not None:
+        try:
+            rule_ids = [int(i) for i in raw_ids.split(",") if i.strip()]
+        except ValueError:
+            return (
+                jsonify({"error": "ids must be a comma-separated list of integers"}),
+                400,
+            )
+    if wants_async():
+        if rule_service.policy_firewall_version(db, policy_id) is None:
+            return jsonify({"error": "Policy not found"}), 404
+        return accepted(
+            "rules.delete",
+            {"policy_id": policy_id, "rule_ids": rule_ids, "all_rules": all_rules},
+        )
     try:
-        rules = rule_service.list_rules(db, policy_id)
+        deleted = rule_service.delete_rules(db, policy_id, rule_ids, all_rules)
     except ValueError as e:
         return jsonify({"error": str(e)}), 404
-    return jsonify([r.dict() for r in rules]), 200
+    return jsonify({"deleted": deleted}), 200
+
+
+@bp.route("/policy/<int:policy_id>", methods=["PUT"])
+def replace_rules(policy_id: int):
+    """
+    Atomically replace all rules of a policy
+    ---
+    tags:
+      - Rules
+    parameters:
+      - name: policy_id
+        in: path
+        required: true
+        type: integer
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/RuleIn'
+      - name: on_duplicate
+        in: query
+        required: false
+        type: string
+        enum: [reject, report]
+        description: Reject duplicates with 409 (default) or skip and count them.
+      - name: async
+        in: query
+        required: false
+        type: boolean
+        description: Run as a background job and answer 202 with the job.
+    responses:
+      200:
+        description: Number of deleted, created and skipped duplicate rules
+      202:
+        description: Background job accepted
+        schema:
+          $ref: '#/definitions/JobOut'
+      400:
+        description: Invalid rules
+      404:
+        description: Policy not found
+      409:
+        description: Duplicate rules in request
+    """
+    db = get_db()
+    body = request.get_json()
+    if not isinstance(body, list):
+        return jsonify({"error": "body must be a list of rules"}), 400
+    try:
+        on_duplicate = get_on_duplicate()
+        rules = [RuleIn.model_validate(r).model_dump() for r in body]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if wants_async():
+        if rule_service.policy_firewall_version(db, policy_id) is None:
+            return jsonify({"error": "Policy not found"}), 404
+        return accepted(
+            "rules.replace",
+            {"policy_id": policy_id, "rules": rules, "on_duplicate": on_duplicate},
+        )
+    try:
+        result = rule_service.replace_rules(db, policy_id, rules, on_duplicate)
+    except DuplicateRuleError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(result), 200
 
 
 @bp.route("/<int:rule_id>", methods=["DELETE"])
@@ -96,11 +327,67 @@ def delete_rule(rule_id: int):
     responses:
       200:
         description: Rule deleted
+      400:
+        description: Template rule, delete it through its policy
       404:
         description: Rule not found
     """
     db = get_db()
-    deleted = rule_service.delete_rule(db, rule_id)
+    try:
+        deleted = rule_service.delete_rule(db, rule_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     if not deleted:
         return jsonify({"error": "not found"}), 404
     return jsonify({"deleted": rule_id}), 200
+
+
+@bp.route("/hits", methods=["POST"])
+@idempotent
+def ingest_hits():
+    """
+    Ingest a batch of rule hit counts
+    ---
+    tags:
+      - Rules
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          $ref: '#/definitions/HitsIn'
+      - name: flush
+        in: query
+        required: false
+        type: boolean
+        description: Write pending counts to the database immediately.
+    responses:
+      202:
+        description: Hits accepted
+      400:
+        description: Invalid hit counts or template rule IDs
+    """
+    db = get_db()
+    try:
+        body = HitsIn.model_validate(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Started in the worker process, where the counts are recorded
+    current_app.extensions["hit_flusher"].start()
+    try:
+        flushed = rule_stats_service.ingest_hits(db, body.hits)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.args.get("flush", "").lower() in ("1", "true") and not flushed:
+        rule_stats_service.flush_hits(db)
+        flushed = True
+    return (
+        jsonify(
+            {
+                "accepted": sum(body.hits.values()),
+                "rules": len(body.hits),
+                "flushed": flushed,
+            }
+        ),
+        202,
+    )
@@ -0,0 +1,210 @@
+"""
+Blueprint for Policy Template API endpoints.
+"""
+
+from flask import Blueprint, jsonify, request
+
+from app.api.common import get_fields, get_on_duplicate
+from app.db import get_db
+from app.idempotency import idempotent
+from app.schemas.rule import RuleIn
+from app.schemas.template import TemplateIn, TemplateOut
+from app.services import template as template_service
+from app.services.canonical import DuplicateRuleError
+
+bp = Blueprint("templates", __name__, url_prefix="/api/templates")
+
+
+@bp.route("/", methods=["POST"])
+@idempotent
+def create_template():
+    """
+    Create a new policy template
+    ---
+    tags:
+      - Templates
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          $ref: '#/definitions/TemplateIn'
+    responses:
+      201:
+        description: Template created
+        schema:
+          $ref: '#/definitions/TemplateOut'
+      400:
+        description: Invalid template or rules, or template name already exists
+      409:
+        description: Duplicate rules in request
+    """
+    db = get_db()
+    try:
+        on_duplicate = get_on_duplicate()
+        body = TemplateIn.model_validate(request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        template = template_service.create_template(
+            db,
+            name=body.name,
+            rules=[rule.model_dump() for rule in body.rules or []],
+            on_duplicate=on_duplicate,
+        )
+    except DuplicateRuleError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(template.dict()), 201
+
+
+@bp.route("/", methods=["GET"])
+def list_templates():
+    """
+    List all policy templates
+    ---
+    tags:
+      - Templates
+    parameters:
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return, dotted for nested objects (e.g. id,name,rules.action).
+    responses:
+      200:
+        description: List of templates
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/TemplateOut'
+      400:
+        description: Unknown field
+    """
+    db = get_db()
+    try:
+        fields = get_fields(TemplateOut)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    templates = template_service.list_templates(db, fields)
+    return jsonify([t.dict(exclude_unset=fields is not None) for t in templates]), 200
+
+
+@bp.route("/<int:template_id>", methods=["GET"])
+def get_template(template_id: int):
+    """
+    Get a policy template by ID
+    ---
+    tags:
+      - Templates
+    parameters:
+      - name: template_id
+        in: path
+        required: true
+        type: integer
+      - name: fields
+        in: query
+        required: false
+        type: string
+        description: Comma-separated fields to return, dotted for nested objects (e.g. id,version).
+    responses:
+      200:
+        description: Template found
+        schema:
+          $ref: '#/definitions/TemplateOut'
+      400:
+        description: Unknown field
+      404:
+        description: Template not found
+    """
+    db = get_db()
+    try:
+        fields = get_fields(TemplateOut)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    template = template_service.get_template(db, template_id, fields)
+    if not template:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(template.dict(exclude_unset=fields is not None)), 200
+
+
+@bp.route("/<int:template_id>/rules", methods=["PUT"])
+def update_template_rules(template_id: int):
+    """
+    Replace the rules of a policy template, creating a new version
+    ---
+    tags:
+      - Templates
+    parameters:
+      - name: template_id
+        in: path
+        required: true
+        type: integer
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: array
+          items:
+            $ref: '#/definitions/RuleIn'
+    responses:
+      200:
+        description: Template updated
+        schema:
+          $ref: '#/definitions/TemplateOut'
+      400:
+        description: Invalid rules
+      404:
+        description: Template not found
+      409:
+        description: Duplicate rules in request
+    """
+    db = get_db()
+    body = request.get_json()
+    if not isinstance(body, list):
+        return jsonify({"error": "body must be a list of rules"}), 400
+    try:
+        on_duplicate = get_on_duplicate()
+        rules = [RuleIn.model_validate(r).model_dump() for r in body]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        template = template_service.update_template_rules(
+            db, template_id, rules, on_duplicate
+        )
+    except DuplicateRuleError as e:
+        return jsonify({"error": str(e)}), 409
+    if not template:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(template.dict()), 200
+
+
+@bp.route("/<int:template_id>", methods=["DELETE"])
+def delete_template(template_id: int):
+    """
+    Delete a policy template
+    ---
+    tags:
+      - Templates
+    parameters:
+      - name: template_id
+        in: path
+        required: true
+        type: integer
+    responses:
+      200:
+        description: Template deleted
+      404:
+        description: Template not found
+      409:
+        description: Template is still attached to policies
+    """
+    db = get_db()
+    try:
+        deleted = template_service.delete_template(db, template_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if not deleted:
+        return jsonify({"error": "not found"}), 404
+    return jsonify({"deleted": template_id}), 200
@@ -0,0 +1,102 @@
+"""
+Flask CLI commands moving FireFlow data between environments:
+``flask data dump``, ``flask data restore`` and ``flask data snapshot``,
+and upgrading databases of earlier releases: ``flask schema upgrade``.
+"""
+
+import click
+from flask.cli import AppGroup
+
+from app.db import db, get_db, upgrade_schema
+from app.services import archive as archive_service
+from app.services.firewall_stats import rebuild_firewall_stats
+
+data_cli = AppGroup("data", help="Back up, restore and snapshot firewall data.")
+schema_cli = AppGroup("schema", help="Upgrade databases of earlier releases.")
+
+
+def _summary(counts: dict[str, int]) -> str:
+    return ", ".join(f"{name}={n}" for name, n in counts.items() if n)
+
+
+@data_cli.command("dump")
+@click.argument("archive", type=click.File("wb"))
+@click.option(
+    "--chunk-size",
+    default=archive_service.CHUNK_SIZE,
+    show_default=True,
+    help="Rows per archive chunk.",
+)
+@click.option(
+    "--level",
+    type=click.IntRange(1, 9),
+    default=archive_service.COMPRESS_LEVEL,
+    show_default=True,
+    help="gzip compression level.",
+)
+def dump(archive, chunk_size: int, level: int):
+    """Stream all firewalls, policies, rules and templates to ARCHIVE ("-" for stdout)."""
+    counts = archive_service.dump_archive(get_db(), archive, chunk_size, level)
+    click.echo(f"Dumped {_summary(counts)}", err=True)
+
+
+@data_cli.command("restore")
+@click.argument("archive", type=click.File("rb"))
+@click.option("--replace", is_flag=True, help="Delete existing data before loading.")
+def restore(archive, replace: bool):
+    """Bulk-load ARCHIVE ("-" for stdin) into the database."""
+    try:
+        counts = archive_service.restore_archive(get_db(), archive, replace)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {_summary(counts)}", err=True)
+
+
+@data_cli.command("snapshot")
+@click.argument("path", type=click.Path(dir_okay=False))
+def snapshot(path: str):
+    """Copy the live SQLite database(s) to PATH with the online backup API."""
+    try:
+        written = archive_service.snapshot(get_db(), path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Snapshot written to {', '.join(written)}", err=True)
+
+
+@schema_cli.command("upgrade")
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    help="Only report the changes, including the rules that would be deleted.",
+)
+def upgrade(dry_run: bool):
+    """Add missing columns and hash existing rules, deleting duplicates."""
+    try:
+        plan = upgrade_schema(db.engine, dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not plan["columns"]:
+        click.echo("Schema is up to date")
+        return
+    add, hash_, delete = (
+        ("Would add", "Would hash", "Would delete")
+        if dry_run
+        else ("Added", "Hashed", "Deleted")
+    )
+    click.echo(f"{add} columns: {', '.join(plan['columns'])}")
+    if plan["hashed"]:
+        click.echo(f"{hash_} {plan['hashed']} rules")
+    for rule_id, policy_id, kept in plan["duplicates"]:
+        click.echo(
+            f"{delete} rule id={rule_id} of policy id={policy_id}: "
+            f"duplicate of rule id={kept}"
+        )
+    if not dry_run:
+        rebuild_firewall_stats(get_db())
+        click.echo("Rebuilt firewall stats")
+
+
+def init_cli(app) -> None:
+    """Register the data and schema commands on the app's CLI."""
+    app.cli.add_command(data_cli)
+    app.cli.add_command(schema_cli)
@@ -0,0 +1,63 @@
+"""
+Single-flight request coalescing.
+Concurrent callers asking for the same key share one execution: the first
+caller runs the work, the others wait for its result. Nothing is cached
+once the call completes, so keys must include a version to stay fresh.
+"""
+
+import threading
+
+from app.metrics import metrics
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key within this process."""
+
+    def __init__(self, name: str = "coalesce"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict = {}
+
+    def do(self, key, fn):
+        """
+        Run ``fn()`` once for all concurrent callers with the same ``key``.
+        Returns ``(result, shared)`` where ``shared`` is True for callers
+        that reused another caller's result. Exceptions are re-raised in
+        every waiting caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f"{self.name}.shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.incr(f"{self.name}.executed")
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+read_flight = SingleFlight("coalesce")
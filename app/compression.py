@@ -0,0 +1,147 @@
+"""
+Response compression negotiated through Accept-Encoding.
+gzip is always available; brotli and zstd are used when the ``brotli`` and
+``zstandard`` packages are installed. Buffered responses below
+COMPRESS_MIN_SIZE bytes are sent as-is; streamed responses are compressed
+chunk by chunk.
+"""
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/csv"}
+
+
+class _GzipStream:
+    def __init__(self, level: int):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class _BrotliStream:
+    def __init__(self, level: int):
+        self._obj = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class _ZstdStream:
+    def __init__(self, level: int):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+def available_encodings() -> dict:
+    """Supported encodings mapped to stream factories, in server preference order."""
+    encodings = {}
+    if zstandard is not None:
+        encodings["zstd"] = _ZstdStream
+    if brotli is not None:
+        encodings["br"] = _BrotliStream
+    encodings["gzip"] = _GzipStream
+    return encodings
+
+
+def negotiate(accept_encoding: str | None, encodings: dict) -> str | None:
+    """
+    Pick the encoding with the highest client q-value, breaking ties with
+    the server preference order. Returns None for identity.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compress a whole buffer with the given encoding."""
+    stream = available_encodings()[encoding](level)
+    return stream.compress(data) + stream.finish()
+
+
+def _compress_iter(chunks, stream):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = stream.compress(chunk)
+        if out:
+            yield out
+    yield stream.finish()
+
+
+def init_compression(app):
+    """Register response compression on the Flask app."""
+    app.config.setdefault("COMPRESS_ENABLED", True)
+    app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+    app.config.setdefault("COMPRESS_LEVEL", 6)
+    encodings = available_encodings()
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            not app.config["COMPRESS_ENABLED"]
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate(request.headers.get("Accept-Encoding"), encodings)
+        if encoding is None:
+            return response
+
+        level = app.config["COMPRESS_LEVEL"]
+        if response.is_streamed:
+            response.response = _compress_iter(
+                response.response, encodings[encoding](level)
+            )
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+                return response
+            response.set_data(compress(data, encoding, level))
+        response.headers["Content-Encoding"] = encoding
+        return response
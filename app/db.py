@@ -1,15 +1,182 @@
+import logging
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, delete, event, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+
+from app.sharding import (
+    PRIMARY,
+    ShardedFlaskSession,
+    configure_shards,
+    prepare_shard,
+)
+
+logger = logging.getLogger(__name__)
+
+db = SQLAlchemy(session_options={"class_": ShardedFlaskSession})
+
+# Columns added to tables that existed in earlier releases: create_all only
+# creates missing tables, so ``flask schema upgrade`` adds these to existing ones
+ADDED_COLUMNS = {
+    ("rules", "hash"): "VARCHAR(32) NOT NULL DEFAULT ''",
+    ("firewalls", "version"): "INTEGER NOT NULL DEFAULT 1",
+    ("policies", "template_id"): (
+        "INTEGER REFERENCES policy_templates (id) ON DELETE RESTRICT"
+    ),
+}
 
-db = SQLAlchemy()
+
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Enforce foreign keys on SQLite so ON DELETE CASCADE runs in the database."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
 
 def init_db(app):
-    """Initialize the database with the Flask app."""
+    """Initialize the database, and its shards, with the Flask app."""
+    shards = configure_shards(app)
     db.init_app(app)
     with app.app_context():
+        existing = inspect(db.engine).get_table_names()
         db.create_all()
+        for shard, engine in {PRIMARY: db.engine, **shards}.items():
+            prepare_shard(engine, db.metadata, shard)
+        pending = pending_columns(db.engine)
+        if pending:
+            # Upgrades may delete rules, so they only run when asked to
+            logger.warning(
+                f"Database schema is out of date, missing "
+                f"{', '.join(f'{t}.{c}' for t, c in pending)}: "
+                f"run `flask schema upgrade`"
+            )
+        elif "firewalls" in existing and "firewall_stats" not in existing:
+            # Backfill the summary counts of a database created before them
+            from app.services.firewall_stats import rebuild_firewall_stats
+
+            rebuild_firewall_stats(db.session)
+
+
+def pending_columns(engine) -> list[tuple[str, str]]:
+    """The (table, column) pairs of ADDED_COLUMNS missing from the database."""
+    inspector = inspect(engine)
+    tables = inspector.get_table_names()
+    return [
+        (table, column)
+        for table, column in ADDED_COLUMNS
+        if table in tables
+        and column not in {c["name"] for c in inspector.get_columns(table)}
+    ]
+
+
+def _hash_rules(conn) -> tuple[list[dict], list[tuple[int, int, int]]]:
+    """
+    Canonical columns of every rule, and the rules repeating an earlier rule
+    of their policy as (rule id, policy id, kept rule id). Raises ValueError
+    listing the rules whose action is not allow or deny.
+    """
+    from app.models.rule import Rule
+    from app.services.canonical import canonicalize_rule
+
+    rules = Rule.__table__
+    kept, rows, duplicates, invalid = {}, [], [], []
+    for r in conn.execute(
+        select(
+            rules.c.id,
+            rules.c.policy_id,
+            rules.c.action,
+            rules.c.src,
+            rules.c.dst,
+            rules.c.protocol,
+        ).order_by(rules.c.id)
+    ):
+        try:
+            row = canonicalize_rule(r.action, r.src, r.dst, r.protocol)
+        except ValueError:
+            invalid.append(r.id)
+            continue
+        key = (r.policy_id, row["hash"])
+        if key in kept:
+            duplicates.append((r.id, r.policy_id, kept[key]))
+            continue
+        kept[key] = r.id
+        rows.append({"rule_id": r.id, **row})
+    if invalid:
+        raise ValueError(f"Rules with an action other than allow or deny: {invalid}")
+    return rows, duplicates
+
+
+def upgrade_schema(engine, dry_run: bool = False) -> dict:
+    """
+    Upgrade a database created by an earlier release, in one transaction.
+    Adds the missing ADDED_COLUMNS with the indexes on those columns alone.
+    When rules get their hash column, existing rules are rewritten in
+    canonical form with their content hash and the unique (policy_id, hash)
+    index is created; a rule repeating an earlier rule of its policy can never
+    match first, so it is deleted. Rules with an invalid action raise
+    ValueError and nothing is changed. With ``dry_run`` nothing is written.
+    Returns the columns added, the number of rules hashed and the deleted
+    duplicates as (rule id, policy id, kept rule id).
+    """
+    from app.models.rule import Rule
+
+    missing = pending_columns(engine)
+    plan = {
+        "columns": [f"{table}.{column}" for table, column in missing],
+        "hashed": 0,
+        "duplicates": [],
+    }
+    if not missing:
+        return plan
+    with engine.begin() as conn:
+        rows = []
+        if ("rules", "hash") in missing:
+            rows, plan["duplicates"] = _hash_rules(conn)
+            plan["hashed"] = len(rows)
+        if dry_run:
+            return plan
+        for table, column in missing:
+            conn.exec_driver_sql(
+                f"ALTER TABLE {table} ADD COLUMN {column} "
+                f"{ADDED_COLUMNS[table, column]}"
+            )
+            for index in db.metadata.tables[table].indexes:
+                if [c.name for c in index.columns] == [column]:
+                    index.create(conn, checkfirst=True)
+            logger.info(f"Added column {table}.{column}")
+        if ("rules", "hash") in missing:
+            rules = Rule.__table__
+            if rows:
+                conn.execute(
+                    update(rules).where(rules.c.id == bindparam("rule_id")), rows
+                )
+            if plan["duplicates"]:
+                ids = [rule_id for rule_id, _, _ in plan["duplicates"]]
+                conn.execute(delete(rules).where(rules.c.id.in_(ids)))
+                logger.warning(f"Deleted {len(ids)} duplicate rules: ids={ids}")
+            for index in rules.indexes:
+                index.create(conn, checkfirst=True)
+            logger.info(f"Hashed {len(rows)} existing rules")
+    return plan
 
 
 def get_db():
     """Return the current SQLAlchemy session."""
     return db.session
+
+
+def dialect_insert(session, table):
+    """
+    Return an INSERT construct supporting ``on_conflict_do_*`` for the dialect
+    the session is bound to (SQLite or PostgreSQL).
+    """
+    name = session.get_bind().dialect.name
+    if name == "sqlite":
+        return sqlite.insert(table)
+    if name == "postgresql":
+        return postgresql.insert(table)
+    raise NotImplementedError(f"Upsert not supported on dialect '{name}'")
@@ -0,0 +1,161 @@
+"""
+Idempotency-Key support for create endpoints.
+A request carrying a key first reserves it by inserting its record, whose
+primary key makes the reservation unique, and only then runs the write. The
+successful response is stored in the record; retries carrying the same key
+and request are answered from it with one primary-key lookup, without
+running the write again, and retries arriving while the first request still
+runs get 409. Records expire after IDEMPOTENCY_TTL seconds and expired rows
+are evicted through the expires_at index.
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import Response, current_app, jsonify, request
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.db import get_db
+from app.models.idempotency import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+HEADER = "Idempotency-Key"
+DEFAULT_TTL = 24 * 3600
+# Seconds a reservation holds its key, so a request that never finishes
+# (e.g. its worker crashed) does not block retries until the TTL
+DEFAULT_LOCK_TIMEOUT = 300
+# Seconds a retry of a request still in progress is asked to wait
+RETRY_AFTER = 1
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _fingerprint() -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.full_path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _lookup(db, key: str):
+    """The unexpired record of a key, as a row outside the identity map."""
+    return db.execute(
+        select(IdempotencyRecord.__table__).where(
+            IdempotencyRecord.key == key, IdempotencyRecord.expires_at > _now()
+        )
+    ).first()
+
+
+def _answer(record, key: str, fingerprint: str) -> Response:
+    """
+    Answer a request whose key is recorded, or was reserved by a request
+    whose record is already gone again (None).
+    """
+    if record is not None and record.fingerprint != fingerprint:
+        logger.warning(f"Idempotency key reused for another request: {key}")
+        response = jsonify({"error": f"{HEADER} was used for a different request"})
+        response.status_code = 422
+        return response
+    if record is None or record.status is None:
+        logger.warning(f"Request with idempotency key {key} is still in progress")
+        response = jsonify(
+            {"error": f"A request with this {HEADER} is still in progress"}
+        )
+        response.status_code = 409
+        response.headers["Retry-After"] = str(RETRY_AFTER)
+        return response
+    logger.info(f"Replaying stored response for idempotency key {key}")
+    response = Response(record.body, status=record.status, mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _reserve(db, key: str, fingerprint: str) -> bool:
+    """
+    Insert the in-progress record of a key, evicting expired records first.
+    Returns False if a concurrent request reserved the key first.
+    """
+    now = _now()
+    timeout = current_app.config.get("IDEMPOTENCY_LOCK_TIMEOUT", DEFAULT_LOCK_TIMEOUT)
+    db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expires_at <= now))
+    try:
+        db.execute(
+            insert(IdempotencyRecord).values(
+                key=key,
+                method=request.method,
+                path=request.path,
+                fingerprint=fingerprint,
+                created_at=now,
+                expires_at=now + timedelta(seconds=timeout),
+            )
+        )
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+
+def _complete(db, key: str, response: Response) -> None:
+    """Store a successful response in the reservation of its key."""
+    ttl = current_app.config.get("IDEMPOTENCY_TTL", DEFAULT_TTL)
+    db.execute(
+        update(IdempotencyRecord)
+        .where(IdempotencyRecord.key == key)
+        .values(
+            status=response.status_code,
+            body=response.get_data(),
+            expires_at=_now() + timedelta(seconds=ttl),
+        )
+    )
+    db.commit()
+
+
+def _release(db, key: str) -> None:
+    """Drop the reservation of a request that failed, so it can be retried."""
+    db.rollback()
+    db.execute(
+        delete(IdempotencyRecord).where(
+            IdempotencyRecord.key == key, IdempotencyRecord.status.is_(None)
+        )
+    )
+    db.commit()
+
+
+def idempotent(view):
+    """Honor the Idempotency-Key header on a create endpoint."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": f"{HEADER} must be at most 255 characters"}), 400
+
+        db = get_db()
+        fingerprint = _fingerprint()
+        record = _lookup(db, key)
+        if record is not None or not _reserve(db, key, fingerprint):
+            # Recorded, or reserved by a concurrent request after the lookup
+            return _answer(record or _lookup(db, key), key, fingerprint)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            _release(db, key)
+            raise
+        if 200 <= response.status_code < 300:
+            _complete(db, key, response)
+        else:
+            _release(db, key)
+        return response
+
+    return wrapper
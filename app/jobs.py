@@ -0,0 +1,307 @@
+"""
+In-process background jobs for long-running operations.
+Jobs are recorded in the durable ``jobs`` table and run on a thread pool in
+their own app context and session, so the request that submits one returns
+202 Accepted immediately. Progress of a running job is tracked in memory by
+the process running it; state transitions are persisted. Cancellation is
+requested through the table and observed by the job at its next progress
+report. Jobs left queued or running by a process that no longer exists are
+marked failed on startup.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from app.db import db, get_db
+from app.models.job import Job
+from app.schemas.job import JobOut
+from app.services.fields import FieldSpec
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+# Seconds between checks of a running job's cancellation flag
+CANCEL_POLL_INTERVAL = 1.0
+
+WORKER = f"{socket.gethostname()}:{os.getpid()}"
+_STARTED_AT = datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Task functions by job kind, see task()
+TASKS: dict = {}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _load_result(job: Job):
+    return json.loads(job.result) if job.result is not None else None
+
+
+def task(kind: str):
+    """
+    Register ``fn(db, job, **params)`` as the task run for jobs of ``kind``.
+    ``job`` is a JobContext; the return value must be JSON serializable and
+    becomes the job result.
+    """
+
+    def decorator(fn):
+        TASKS[kind] = fn
+        return fn
+
+    return decorator
+
+
+class JobCancelled(Exception):
+    """Raised from JobContext.progress once cancellation was requested."""
+
+
+class JobContext:
+    """Handle passed to a running task to report progress."""
+
+    def __init__(self, runner: "JobRunner", job_id: int, poll: bool = True):
+        self.runner = runner
+        self.job_id = job_id
+        self.poll = poll
+        self._checked = time.monotonic()
+
+    def progress(self, done: int, total: int | None = None) -> None:
+        """Record progress; raises JobCancelled if the job was cancelled."""
+        self.runner._progress[self.job_id] = (done, total)
+        if self.job_id in self.runner._cancelled:
+            raise JobCancelled()
+        # Cancellations requested through another process show up in the table
+        now = time.monotonic()
+        if self.poll and now - self._checked >= CANCEL_POLL_INTERVAL:
+            self._checked = now
+            if self.runner.cancel_requested(self.job_id):
+                raise JobCancelled()
+
+
+class JobRunner:
+    """Runs jobs of an app on a thread pool, or inline when JOBS_SYNC is set."""
+
+    def __init__(self, app, workers: int = 2):
+        self.app = app
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._progress: dict[int, tuple[int, int | None]] = {}
+        self._cancelled: set[int] = set()
+
+    def submit(self, kind: str, params: dict) -> JobOut:
+        """Record a queued job and schedule it. Returns the job as queued."""
+        if kind not in TASKS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        db = get_db()
+        job = Job(
+            kind=kind,
+            status="queued",
+            params=json.dumps(params),
+            worker=WORKER,
+            created_at=_now(),
+        )
+        db.add(job)
+        db.commit()
+        out = self._to_out(job)
+        logger.info(f"Job queued: id={job.id}, kind={kind}")
+        if self.app.config.get("JOBS_SYNC", False):
+            self._run(job.id, poll=False)
+        else:
+            self._pool().submit(self._run_in_context, job.id)
+        return out
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="job"
+                )
+            return self._executor
+
+    def _run_in_context(self, job_id: int) -> None:
+        with self.app.app_context():
+            try:
+                self._run(job_id)
+            except Exception:
+                logger.exception(f"Job runner failed: id={job_id}")
+
+    def _run(self, job_id: int, poll: bool = True) -> None:
+        db = get_db()
+        # Claim the job unless it was cancelled while queued
+        claimed = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", started_at=_now())
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return
+        job = db.get(Job, job_id)
+        kind, params = job.kind, json.loads(job.params)
+        logger.info(f"Job started: id={job_id}, kind={kind}")
+
+        values = {"status": "succeeded"}
+        try:
+            result = TASKS[kind](db, JobContext(self, job_id, poll), **params)
+            values["result"] = json.dumps(result)
+        except JobCancelled:
+            db.rollback()
+            values["status"] = "cancelled"
+        except Exception as e:
+            db.rollback()
+            logger.exception(f"Job failed: id={job_id}, kind={kind}")
+            values.update(status="failed", error=str(e))
+
+        done, total = self._progress.pop(job_id, (0, None))
+        self._cancelled.discard(job_id)
+        db.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(done=done, total=total, finished_at=_now(), **values)
+        )
+        db.commit()
+        logger.info(f"Job {values['status']}: id={job_id}, kind={kind}")
+
+    def cancel_requested(self, job_id: int) -> bool:
+        # Read on a separate connection so the job's own transaction is untouched
+        with db.engine.connect() as conn:
+            return bool(
+                conn.scalar(select(Job.cancel_requested).where(Job.id == job_id))
+            )
+
+    def cancel(self, db, job_id: int) -> JobOut | None:
+        """
+        Cancel a job: queued jobs never start, running jobs stop at their
+        next progress report and roll back. Finished jobs are left as is.
+        """
+        job = db.get(Job, job_id)
+        if job is None:
+            return None
+        if job.status in ACTIVE_STATUSES:
+            db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "queued")
+                .values(status="cancelled", finished_at=_now())
+            )
+            db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == "running")
+                .values(cancel_requested=True)
+            )
+            db.commit()
+            db.refresh(job)
+            if job.status == "running" and job.worker == WORKER:
+                self._cancelled.add(job_id)
+            logger.info(f"Job cancellation requested: id={job_id}")
+        return self._to_out(job)
+
+    def get(self, db, job_id: int, fields: FieldSpec | None = None) -> JobOut | None:
+        """
+        A job with the live progress of this process if it is running here,
+        limited to ``fields`` if given.
+        """
+        job = db.get(Job, job_id)
+        if job is None:
+            return None
+        db.refresh(job)
+        return self._to_out(job, fields)
+
+    def _to_out(self, job: Job, fields: FieldSpec | None = None) -> JobOut:
+        done, total = job.done, job.total
+        if job.status == "running":
+            done, total = self._progress.get(job.id, (done, total))
+        values = {
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "done": done or 0,
+            "total": total,
+            "error": job.error,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+        if fields is not None:
+            # The result is only decoded when requested
+            values = {name: values[name] for name in fields if name != "result"}
+            if "result" in fields:
+                values["result"] = _load_result(job)
+            return JobOut.model_construct(_fields_set=set(fields), **values)
+        return JobOut(**values, result=_load_result(job))
+
+    def recover(self) -> int:
+        """
+        Mark jobs left queued or running by a dead process on this host as
+        failed. Jobs claiming this process's own PID but created before it
+        started are from a previous process that had the same PID. Returns
+        the number of jobs marked.
+        """
+        db = get_db()
+        host = socket.gethostname()
+        orphaned = []
+        for job_id, worker, created_at in db.execute(
+            select(Job.id, Job.worker, Job.created_at).where(
+                Job.status.in_(ACTIVE_STATUSES)
+            )
+        ):
+            job_host, _, pid = worker.rpartition(":")
+            if job_host != host:
+                continue
+            if int(pid) == os.getpid():
+                if created_at < _STARTED_AT:
+                    orphaned.append(job_id)
+            elif not _alive(int(pid)):
+                orphaned.append(job_id)
+        if orphaned:
+            db.execute(
+                update(Job)
+                .where(Job.id.in_(orphaned), Job.status.in_(ACTIVE_STATUSES))
+                .values(
+                    status="failed",
+                    error="Interrupted: the worker process exited",
+                    finished_at=_now(),
+                )
+            )
+            logger.warning(f"Marked {len(orphaned)} interrupted jobs as failed")
+        db.commit()
+        return len(orphaned)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def init_jobs(app) -> JobRunner:
+    """Attach a job runner to the app and fail jobs interrupted by a restart."""
+    runner = JobRunner(app, workers=app.config.get("JOBS_WORKERS", 2))
+    app.extensions["jobs"] = runner
+    with app.app_context():
+        runner.recover()
+    return runner
+
+
+def get_runner() -> JobRunner:
+    """The job runner of the current app."""
+    return current_app.extensions["jobs"]
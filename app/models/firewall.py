@@ -1,15 +1,72 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import DDL, Column, Integer, String, Text, event
 from sqlalchemy.orm import relationship
 
 from app.db import db
+from app.sharding import ShardedId
 
 
 class Firewall(db.Model):
     __tablename__ = "firewalls"
-    id = Column(Integer, primary_key=True)
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(ShardedId, primary_key=True)
     name = Column(String(128), unique=True, nullable=False)
     description = Column(Text)
+    # Bumped whenever the firewall, its policies or their rules change
+    version = Column(Integer, nullable=False, default=1)
 
     policies = relationship(
-        "FilteringPolicy", back_populates="firewall", cascade="all, delete-orphan"
+        "FilteringPolicy",
+        back_populates="firewall",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
+
+
+def _sqlite_has_fts5(ddl, target, bind, **kw):
+    """Only create the FTS index when the SQLite build ships FTS5."""
+    options = bind.exec_driver_sql("PRAGMA compile_options").scalars().all()
+    return "ENABLE_FTS5" in options
+
+
+# Full-text index on name/description: an external-content FTS5 table kept in
+# sync by triggers on SQLite, a trigram GIN index on PostgreSQL.
+_SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS firewalls_fts USING fts5("
+    "name, description, content='firewalls', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS firewalls_fts_ai AFTER INSERT ON firewalls BEGIN "
+    "INSERT INTO firewalls_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS firewalls_fts_ad AFTER DELETE ON firewalls BEGIN "
+    "INSERT INTO firewalls_fts(firewalls_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    # Only on the indexed columns: version bumps on every rule write
+    "CREATE TRIGGER IF NOT EXISTS firewalls_fts_au "
+    "AFTER UPDATE OF name, description ON firewalls BEGIN "
+    "INSERT INTO firewalls_fts(firewalls_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO firewalls_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+]
+_POSTGRES_TRGM = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_firewalls_description_trgm "
+    "ON firewalls USING gin (description gin_trgm_ops)",
+]
+
+for _statement in _SQLITE_FTS:
+    event.listen(
+        Firewall.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="sqlite", callable_=_sqlite_has_fts5),
+    )
+for _statement in _POSTGRES_TRGM:
+    event.listen(
+        Firewall.__table__,
+        "after_create",
+        DDL(_statement).execute_if(dialect="postgresql"),
+    )
+event.listen(
+    Firewall.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS firewalls_fts").execute_if(dialect="sqlite"),
+)
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, ForeignKey, Integer, String
+
+from app.db import db
+from app.sharding import ShardedId
+
+# Protocol key of rules matching any protocol (stored protocol NULL)
+ANY_PROTOCOL = "any"
+
+
+class FirewallStat(db.Model):
+    __tablename__ = "firewall_stats"
+    firewall_id = Column(
+        ShardedId, ForeignKey("firewalls.id", ondelete="CASCADE"), primary_key=True
+    )
+    policies = Column(Integer, nullable=False, default=0)
+    rules = Column(Integer, nullable=False, default=0)  # effective rules
+
+
+class FirewallRuleCount(db.Model):
+    __tablename__ = "firewall_rule_counts"
+    firewall_id = Column(
+        ShardedId, ForeignKey("firewalls.id", ondelete="CASCADE"), primary_key=True
+    )
+    action = Column(String(16), primary_key=True)
+    protocol = Column(String(16), primary_key=True)
+    rules = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, String
+
+from app.db import db
+
+
+class IdempotencyRecord(db.Model):
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    method = Column(String(8), nullable=False)
+    path = Column(String(512), nullable=False)
+    fingerprint = Column(String(64), nullable=False)  # hash of method, path, body
+    # Unset while the first request with the key is in progress
+    status = Column(Integer, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,21 @@
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, Text
+
+from app.db import db
+
+
+class Job(db.Model):
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(64), nullable=False)
+    # queued, running, succeeded, failed or cancelled
+    status = Column(String(16), nullable=False, index=True)
+    params = Column(Text, nullable=False)  # JSON
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    done = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    worker = Column(String(255), nullable=False)  # host:pid running the job
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -2,13 +2,39 @@ from sqlalchemy import Column, ForeignKey, Integer, String
 from sqlalchemy.orm import relationship
 
 from app.db import db
+from app.models.template import PolicyTemplate
+from app.sharding import ShardedId
 
 
 class FilteringPolicy(db.Model):
     __tablename__ = "policies"
-    id = Column(Integer, primary_key=True)
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(ShardedId, primary_key=True)
     name = Column(String(128), nullable=False)
-    firewall_id = Column(Integer, ForeignKey("firewalls.id", ondelete="CASCADE"))
+    firewall_id = Column(
+        ShardedId, ForeignKey("firewalls.id", ondelete="CASCADE"), index=True
+    )
+    # Set while the policy shares a template's rules by reference
+    template_id = Column(
+        Integer,
+        ForeignKey("policy_templates.id", ondelete="RESTRICT"),
+        nullable=True,
+        index=True,
+    )
 
     firewall = relationship("Firewall", back_populates="policies")
-    rules = relationship("Rule", back_populates="policy", cascade="all, delete-orphan")
+    rules = relationship(
+        "Rule",
+        back_populates="policy",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="Rule.id",
+    )
+    template = relationship(PolicyTemplate)
+
+    @property
+    def effective_rules(self):
+        """The template's rules while attached by reference, else its own."""
+        if self.template_id is not None:
+            return self.template.rules
+        return self.rules
@@ -1,16 +1,22 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Index, String
 from sqlalchemy.orm import relationship
 
 from app.db import db
+from app.sharding import ShardedId
 
 
 class Rule(db.Model):
     __tablename__ = "rules"
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        Index("ix_rules_policy_hash", "policy_id", "hash", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+    id = Column(ShardedId, primary_key=True)
     action = Column(String(16), nullable=False)  # 'allow' or 'deny'
     src = Column(String(64), nullable=True)
     dst = Column(String(64), nullable=True)
     protocol = Column(String(16), nullable=True)
-    policy_id = Column(Integer, ForeignKey("policies.id", ondelete="CASCADE"))
+    policy_id = Column(ShardedId, ForeignKey("policies.id", ondelete="CASCADE"))
+    hash = Column(String(32), nullable=False)  # content hash of the canonical rule
 
     policy = relationship("FilteringPolicy", back_populates="rules")
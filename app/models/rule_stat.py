@@ -0,0 +1,13 @@
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey
+
+from app.db import db
+from app.sharding import ShardedId
+
+
+class RuleStat(db.Model):
+    __tablename__ = "rule_stats"
+    rule_id = Column(
+        ShardedId, ForeignKey("rules.id", ondelete="CASCADE"), primary_key=True
+    )
+    hits = Column(BigInteger, nullable=False, default=0)
+    last_hit = Column(DateTime, nullable=True)
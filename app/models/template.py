@@ -0,0 +1,38 @@
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
+from sqlalchemy.orm import relationship
+
+from app.db import db
+from app.sharding import ShardedId
+
+
+class PolicyTemplate(db.Model):
+    __tablename__ = "policy_templates"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(128), unique=True, nullable=False)
+    version = Column(Integer, nullable=False, default=1)  # bumped on rule changes
+
+    rules = relationship(
+        "TemplateRule",
+        back_populates="template",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="TemplateRule.id",
+    )
+
+
+class TemplateRule(db.Model):
+    __tablename__ = "template_rules"
+    __table_args__ = (
+        Index("ix_template_rules_template_hash", "template_id", "hash", unique=True),
+        {"sqlite_autoincrement": True},
+    )
+    # Starts at the reserved template rule range, see app.sharding
+    id = Column(ShardedId, primary_key=True)
+    action = Column(String(16), nullable=False)  # 'allow' or 'deny'
+    src = Column(String(64), nullable=True)
+    dst = Column(String(64), nullable=True)
+    protocol = Column(String(16), nullable=True)
+    template_id = Column(Integer, ForeignKey("policy_templates.id", ondelete="CASCADE"))
+    hash = Column(String(32), nullable=False)  # content hash of the canonical rule
+
+    template = relationship("PolicyTemplate", back_populates="rules")
@@ -0,0 +1,148 @@
+"""
+Rate limiting and admission control.
+Requests are checked against a global concurrency limit and a per-client,
+per-route token bucket before the view runs, so rejected requests never
+touch the database. Buckets live in a pluggable backend; the default keeps
+them in process memory.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from flask import current_app, g, jsonify, request
+
+from app.metrics import metrics
+
+EXEMPT_ENDPOINTS = {"static", "index", "metrics_view"}
+
+
+class RateLimitBackend(ABC):
+    """
+    Storage for token buckets. Shared implementations (e.g. backed by a
+    cache server) must make ``acquire`` atomic per key.
+    """
+
+    @abstractmethod
+    def acquire(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens from the bucket ``key`` refilled at ``rate``
+        tokens per second up to ``burst``. Returns 0 when allowed, otherwise
+        the number of seconds until enough tokens are available.
+        """
+
+
+class LocalBackend(RateLimitBackend):
+    """
+    Token buckets held in this process. Every ``sweep_interval`` seconds the
+    buckets that have refilled to their burst size are dropped: a missing
+    bucket starts full, so idle clients cost no memory and no decision changes.
+    """
+
+    def __init__(self, clock=time.monotonic, sweep_interval: float = 60.0):
+        self._clock = clock
+        self._sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # Key -> (tokens, updated, time the bucket is full again)
+        self._buckets: dict[str, tuple[float, float, float]] = {}
+        self._swept = clock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = self._clock()
+        with self._lock:
+            if now - self._swept >= self._sweep_interval:
+                self._sweep(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate if rate > 0 else float("inf")
+            full_at = now + (burst - tokens) / rate if rate > 0 else float("inf")
+            self._buckets[key] = (tokens, now, full_at)
+        return wait
+
+    def _sweep(self, now: float) -> None:
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if bucket[2] > now
+        }
+        self._swept = now
+
+
+class RateLimiter:
+    """Admission control hooked into a Flask app."""
+
+    def __init__(self, app=None, backend: RateLimitBackend | None = None):
+        self.backend = backend or LocalBackend()
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RATELIMIT_ENABLED", True)
+        # Token bucket per client and route: tokens per second and burst size
+        app.config.setdefault("RATELIMIT_DEFAULT", (100.0, 200))
+        # Per-endpoint overrides, e.g. {"rules.list_rules": (10.0, 20)}
+        app.config.setdefault("RATELIMIT_ROUTES", {})
+        # Header identifying the client, falling back to the remote address
+        app.config.setdefault("RATELIMIT_CLIENT_HEADER", None)
+        # Requests served at once by this worker; 0 disables the limit
+        app.config.setdefault("MAX_CONCURRENT_REQUESTS", 64)
+
+        limit = app.config["MAX_CONCURRENT_REQUESTS"]
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+        app.extensions["ratelimit"] = self
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def client_id(self) -> str:
+        header = current_app.config["RATELIMIT_CLIENT_HEADER"]
+        if header and request.headers.get(header):
+            return request.headers[header]
+        return request.remote_addr or "unknown"
+
+    def _admit(self):
+        config = current_app.config
+        endpoint = request.endpoint
+        if (
+            not config["RATELIMIT_ENABLED"]
+            or endpoint is None
+            or endpoint in EXEMPT_ENDPOINTS
+            or endpoint.startswith("flasgger")
+        ):
+            return None
+
+        if self._slots is not None:
+            if not self._slots.acquire(blocking=False):
+                metrics.incr("ratelimit.rejected.concurrency")
+                metrics.incr(f"ratelimit.rejected.{endpoint}")
+                response = jsonify({"error": "server busy"})
+                response.headers["Retry-After"] = "1"
+                return response, 503
+            g._ratelimit_slot = True
+
+        rate, burst = config["RATELIMIT_ROUTES"].get(
+            endpoint, config["RATELIMIT_DEFAULT"]
+        )
+        wait = self.backend.acquire(f"{self.client_id()}:{endpoint}", rate, burst)
+        if wait > 0:
+            metrics.incr("ratelimit.rejected.rate")
+            metrics.incr(f"ratelimit.rejected.{endpoint}")
+            response = jsonify({"error": "rate limit exceeded"})
+            response.headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+            return response, 429
+        metrics.incr("ratelimit.admitted")
+        return None
+
+    def _release(self, exc=None):
+        if g.pop("_ratelimit_slot", False):
+            self._slots.release()
+
+
+def init_rate_limiting(app, backend: RateLimitBackend | None = None) -> RateLimiter:
+    """Register rate limiting on the Flask app."""
+    return RateLimiter(app, backend)
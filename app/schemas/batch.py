@@ -0,0 +1,145 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from app.schemas.firewall import FirewallIn
+from app.schemas.policy import PolicyIn
+from app.schemas.rule import RuleIn
+from app.schemas.template import TemplateIn
+
+# Arguments of each batch operation, validated before the service call.
+# Unknown arguments are rejected rather than passed through to the service.
+_STRICT = {"extra": "forbid"}
+
+
+class FirewallArgs(FirewallIn):
+    model_config = _STRICT
+
+
+class UpdateFirewallArgs(FirewallIn):
+    fw_id: int
+
+    model_config = _STRICT
+
+
+class FirewallIdArgs(BaseModel):
+    fw_id: int
+
+    model_config = _STRICT
+
+
+class PolicyArgs(PolicyIn):
+    fw_id: int
+    rules: List[RuleIn] = []
+    on_duplicate: str = "reject"
+
+    model_config = _STRICT
+
+
+class AttachTemplateArgs(BaseModel):
+    fw_id: int
+    template_id: int
+    name: Optional[str] = None
+
+    model_config = _STRICT
+
+
+class PolicyIdArgs(BaseModel):
+    policy_id: int
+
+    model_config = _STRICT
+
+
+class RuleArgs(RuleIn):
+    policy_id: int
+
+    model_config = _STRICT
+
+
+class ReplaceRulesArgs(BaseModel):
+    policy_id: int
+    rules: List[RuleIn]
+    on_duplicate: str = "reject"
+
+    model_config = _STRICT
+
+
+class RuleIdArgs(BaseModel):
+    rule_id: int
+
+    model_config = _STRICT
+
+
+class DeleteRulesArgs(BaseModel):
+    policy_id: int
+    rule_ids: Optional[List[int]] = None
+    all_rules: bool = False
+
+    model_config = _STRICT
+
+
+class TemplateArgs(TemplateIn):
+    rules: List[RuleIn] = []
+    on_duplicate: str = "reject"
+
+    model_config = _STRICT
+
+
+class TemplateRulesArgs(BaseModel):
+    template_id: int
+    rules: List[RuleIn]
+    on_duplicate: str = "reject"
+
+    model_config = _STRICT
+
+
+class TemplateIdArgs(BaseModel):
+    template_id: int
+
+    model_config = _STRICT
+
+
+# Flasgger Swagger definitions
+definitions = {
+    "BatchOperation": {
+        "type": "object",
+        "properties": {
+            "op": {
+                "type": "string",
+                "description": (
+                    "create_firewall, update_firewall, delete_firewall, "
+                    "add_policy, attach_template, delete_policy, add_rule, "
+                    "replace_rules, delete_rule, delete_rules, create_template, "
+                    "update_template_rules or delete_template"
+                ),
+                "example": "add_policy",
+            },
+            "args": {
+                "type": "object",
+                "description": (
+                    "Keyword arguments of the operation. A value "
+                    '{"$ref": "name.path"} is replaced by the field at path '
+                    "(default id) of the result of an earlier operation, named "
+                    "by its ref or index."
+                ),
+                "example": {"fw_id": {"$ref": "fw"}, "name": "inbound"},
+            },
+            "ref": {"type": "string", "example": "fw"},
+        },
+        "required": ["op"],
+    },
+    "BatchIn": {
+        "type": "object",
+        "properties": {
+            "operations": {
+                "type": "array",
+                "items": {"$ref": "#/definitions/BatchOperation"},
+            }
+        },
+        "required": ["operations"],
+    },
+    "BatchOut": {
+        "type": "object",
+        "properties": {"results": {"type": "array", "items": {"type": "object"}}},
+    },
+}
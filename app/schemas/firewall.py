@@ -1,8 +1,9 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
 
 from app.schemas.policy import PolicyOut
+from app.schemas.rule import RuleIn
 
 
 class FirewallIn(BaseModel):
@@ -14,11 +15,42 @@ class FirewallOut(BaseModel):
     id: int
     name: str
     description: Optional[str] = None
+    version: int = 1
     policies: List[PolicyOut] = []
 
     model_config = {"from_attributes": True}
 
 
+class FirewallStatsOut(BaseModel):
+    firewall_id: int
+    name: str
+    policies: int = 0
+    rules: int = 0
+    # Rules per action, then per protocol
+    breakdown: Dict[str, Dict[str, int]] = {}
+
+
+class FlowIn(BaseModel):
+    src: Optional[str] = None
+    dst: Optional[str] = None
+    protocol: Optional[str] = None
+
+
+class EvaluationIn(BaseModel):
+    flows: List[FlowIn]
+
+
+class RuleChangeIn(BaseModel):
+    policy_id: Optional[int] = None
+    add: List[RuleIn] = []
+    remove: List[int] = []
+
+
+class SimulationIn(BaseModel):
+    changes: List[RuleChangeIn] = []
+    flows: List[FlowIn]
+
+
 # Flasgger Swagger definitions
 definitions = {
     "FirewallIn": {
@@ -35,10 +67,75 @@ definitions = {
             "id": {"type": "integer"},
             "name": {"type": "string"},
             "description": {"type": "string"},
+            "version": {"type": "integer", "example": 1},
             "policies": {
                 "type": "array",
                 "items": {"$ref": "#/definitions/PolicyOut"},
             },
         },
     },
+    "FirewallStatsOut": {
+        "type": "object",
+        "properties": {
+            "firewall_id": {"type": "integer"},
+            "name": {"type": "string"},
+            "policies": {"type": "integer", "example": 2},
+            "rules": {"type": "integer", "example": 12},
+            "breakdown": {
+                "type": "object",
+                "description": "Rules per action, then per protocol",
+                "example": {"allow": {"tcp": 5, "any": 4}, "deny": {"any": 3}},
+            },
+        },
+    },
+    "Flow": {
+        "type": "object",
+        "properties": {
+            "src": {"type": "string", "example": "10.1.2.3"},
+            "dst": {"type": "string", "example": "8.8.8.8"},
+            "protocol": {"type": "string", "example": "udp"},
+        },
+    },
+    "EvaluationIn": {
+        "type": "object",
+        "properties": {
+            "flows": {"type": "array", "items": {"$ref": "#/definitions/Flow"}},
+        },
+        "required": ["flows"],
+    },
+    "Verdict": {
+        "type": "object",
+        "properties": {
+            "src": {"type": "string"},
+            "dst": {"type": "string"},
+            "protocol": {"type": "string"},
+            "action": {"type": "string", "example": "allow"},
+            "policy_id": {"type": "integer", "description": "None by default"},
+            "rule_id": {"type": "integer", "description": "None by default"},
+        },
+    },
+    "SimulationIn": {
+        "type": "object",
+        "properties": {
+            "changes": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "policy_id": {
+                            "type": "integer",
+                            "description": "Omit to simulate a new policy",
+                        },
+                        "add": {
+                            "type": "array",
+                            "items": {"$ref": "#/definitions/RuleIn"},
+                        },
+                        "remove": {"type": "array", "items": {"type": "integer"}},
+                    },
+                },
+            },
+            "flows": {"type": "array", "items": {"$ref": "#/definitions/Flow"}},
+        },
+        "required": ["flows"],
+    },
 }
@@ -1,6 +1,6 @@
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import AliasChoices, BaseModel, Field
 
 from app.schemas.rule import RuleIn, RuleOut
 
@@ -13,7 +13,11 @@ class PolicyIn(BaseModel):
 class PolicyOut(BaseModel):
     id: int
     name: str
-    rules: List[RuleOut] = []
+    template_id: Optional[int] = None
+    # Template-backed policies expose the template's rules
+    rules: List[RuleOut] = Field(
+        default=[], validation_alias=AliasChoices("effective_rules", "rules")
+    )
 
     model_config = {"from_attributes": True}
 
@@ -44,6 +48,10 @@ definitions = {
         "properties": {
             "id": {"type": "integer", "example": 1},
             "name": {"type": "string", "example": "default-policy"},
+            "template_id": {
+                "type": "integer",
+                "description": "Template shared by reference, if any",
+            },
             "rules": {
                 "type": "array",
                 "items": {"$ref": "#/definitions/RuleOut"},
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel, Field, field_validator
@@ -22,6 +23,21 @@ class RuleOut(RuleIn):
     model_config = {"from_attributes": True}
 
 
+class RuleStatsOut(RuleOut):
+    hits: int = 0
+    last_hit: Optional[datetime] = None
+
+
+class HitsIn(BaseModel):
+    hits: dict[int, int]
+
+    @field_validator("hits")
+    def counts_must_be_positive(cls, v):
+        if any(count < 0 for count in v.values()):
+            raise ValueError("hit counts must not be negative")
+        return v
+
+
 # Flasgger Swagger definitions
 definitions = {
     "RuleIn": {
@@ -48,4 +64,27 @@ definitions = {
             "protocol": {"type": "string", "example": "udp"},
         },
     },
+    "RuleStatsOut": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer", "example": 1},
+            "action": {"type": "string", "example": "deny"},
+            "src": {"type": "string", "example": "192.168.1.10"},
+            "dst": {"type": "string", "example": "10.0.0.20"},
+            "protocol": {"type": "string", "example": "udp"},
+            "hits": {"type": "integer", "example": 1024},
+            "last_hit": {"type": "string", "format": "date-time"},
+        },
+    },
+    "HitsIn": {
+        "type": "object",
+        "properties": {
+            "hits": {
+                "type": "object",
+                "additionalProperties": {"type": "integer"},
+                "example": {"1": 120, "2": 3},
+            },
+        },
+        "required": ["hits"],
+    },
 }
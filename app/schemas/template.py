@@ -0,0 +1,47 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from app.schemas.rule import RuleIn, RuleOut
+
+
+class TemplateIn(BaseModel):
+    name: str
+    rules: Optional[List[RuleIn]] = []
+
+
+class TemplateOut(BaseModel):
+    id: int
+    name: str
+    version: int
+    rules: List[RuleOut] = []
+
+    model_config = {"from_attributes": True}
+
+
+# Flasgger Swagger definitions
+definitions = {
+    "TemplateIn": {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string", "example": "baseline"},
+            "rules": {
+                "type": "array",
+                "items": {"$ref": "#/definitions/RuleIn"},
+            },
+        },
+        "required": ["name"],
+    },
+    "TemplateOut": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer", "example": 1},
+            "name": {"type": "string", "example": "baseline"},
+            "version": {"type": "integer", "example": 3},
+            "rules": {
+                "type": "array",
+                "items": {"$ref": "#/definitions/RuleOut"},
+            },
+        },
+    },
+}
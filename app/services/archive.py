@@ -0,0 +1,471 @@
+"""
+Service layer for full backups and restores of firewall data.
+An archive is gzip-compressed JSON lines: a header with the archive version
+and the columns of every table, then chunks of rows in dependency order,
+then a trailer with the row count of each table. Dumps stream from one
+read transaction per shard; restores bulk-load into empty tables with
+foreign keys checked at commit and indexes and triggers restored after the
+load.
+"""
+
+import gzip
+import json
+import logging
+import re
+import sqlite3
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from operator import itemgetter
+from pathlib import Path
+
+from sqlalchemy import DateTime, delete, func, literal, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.db import db as _db
+from app.sharding import PRIMARY, SHARD_KEY_COLUMNS, SHARD_SHIFT, shard_of
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = "fireflow-archive"
+ARCHIVE_VERSION = 1
+CHUNK_SIZE = 10_000
+# Fastest gzip level: rows are repetitive and compress well anyway
+COMPRESS_LEVEL = 1
+# Per-process operational state, not moved between environments
+EXCLUDED_TABLES = ("jobs", "idempotency_keys")
+# Driver placeholders of restore INSERTs, by DB-API paramstyle
+_PLACEHOLDERS = {"qmark": "?", "format": "%s", "pyformat": "%s"}
+# Start of the chunk lines written by dump_archive
+_CHUNK_PREFIX = re.compile(r'\{"table":"(\w+)","rows":\[')
+# Pages copied per step of an online backup, letting writers in between
+SNAPSHOT_PAGES = 1024
+
+
+def archive_tables() -> list:
+    """Archived tables, parents before children."""
+    return [t for t in _db.metadata.sorted_tables if t.name not in EXCLUDED_TABLES]
+
+
+def _engines(db: Session) -> dict:
+    return db.info.get("shards") or {PRIMARY: db.get_bind()}
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+def _write(out, record: dict) -> None:
+    out.write(json.dumps(record, separators=(",", ":"), default=_encode))
+    out.write("\n")
+
+
+def _begin(conn) -> None:
+    # pysqlite only opens a transaction before DML: open it explicitly so
+    # reads share one snapshot and DDL rolls back with the rest
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN")
+
+
+@contextmanager
+def _read_transaction(engine):
+    """A connection seeing one consistent state of the database."""
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            _begin(conn)
+            yield conn
+
+
+def dump_archive(
+    db: Session,
+    fileobj,
+    chunk_size: int = CHUNK_SIZE,
+    compresslevel: int = COMPRESS_LEVEL,
+) -> dict[str, int]:
+    """
+    Stream every archived table, from every shard, to ``fileobj`` (binary).
+    Templates are read from the primary only. Returns rows written per table.
+    """
+    tables = archive_tables()
+    engines = _engines(db)
+    counts = {t.name: 0 for t in tables}
+    with ExitStack() as stack:
+        conns = {
+            shard: stack.enter_context(_read_transaction(engine))
+            for shard, engine in engines.items()
+        }
+        out = stack.enter_context(
+            gzip.open(fileobj, "wt", compresslevel=compresslevel, encoding="utf-8")
+        )
+        _write(
+            out,
+            {
+                "format": ARCHIVE_FORMAT,
+                "version": ARCHIVE_VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "shards": len(engines),
+                "tables": {t.name: [c.name for c in t.columns] for t in tables},
+            },
+        )
+        for table in tables:
+            sources = (
+                conns.values() if table.name in SHARD_KEY_COLUMNS else [conns[PRIMARY]]
+            )
+            stmt = select(table).order_by(*table.primary_key.columns)
+            for conn in sources:
+                result = conn.execution_options(yield_per=chunk_size).execute(stmt)
+                for rows in result.partitions():
+                    _write(out, {"table": table.name, "rows": [tuple(r) for r in rows]})
+                    counts[table.name] += len(rows)
+        _write(out, {"counts": counts})
+    logger.info(f"Dumped archive: {counts}")
+    return counts
+
+
+def _read_header(src, tables: dict) -> dict:
+    try:
+        header = json.loads(src.readline())
+    except (OSError, EOFError, ValueError):
+        raise ValueError("Not a FireFlow archive")
+    if not isinstance(header, dict) or header.get("format") != ARCHIVE_FORMAT:
+        raise ValueError("Not a FireFlow archive")
+    if header.get("version", 0) > ARCHIVE_VERSION:
+        raise ValueError(
+            f"Archive version {header['version']} is newer than supported "
+            f"({ARCHIVE_VERSION})"
+        )
+    for name, columns in header["tables"].items():
+        if name not in tables:
+            raise ValueError(f"Unknown table '{name}' in archive")
+        unknown = set(columns) - set(tables[name].c.keys())
+        if unknown:
+            raise ValueError(f"Unknown columns of '{name}': {sorted(unknown)}")
+    return header
+
+
+def _records(src, raw=()):
+    """
+    Archive records after the header, failing on a corrupt stream. Chunks of
+    the tables in ``raw`` are left unparsed: their record holds the line.
+    """
+    try:
+        for line in src:
+            match = _CHUNK_PREFIX.match(line)
+            if match and match[1] in raw:
+                yield {"table": match[1], "line": line}
+            else:
+                yield json.loads(line)
+    except (OSError, EOFError, ValueError):
+        raise ValueError("Archive is truncated or corrupt")
+
+
+def _from_iso(process):
+    if process is None:
+        return datetime.fromisoformat
+    return lambda value: process(datetime.fromisoformat(value))
+
+
+def _loader(dialect, table, columns: list[str]):
+    """
+    Driver-level INSERT of archived rows into ``table``, and the function
+    turning a row into its parameters, or None when no column needs
+    converting. Rows skip SQLAlchemy's per-row parameter handling: only the
+    columns whose type needs it are converted.
+    """
+    placeholder = _PLACEHOLDERS.get(dialect.paramstyle)
+    if placeholder is None:
+        raise ValueError(f"Restore not supported on driver '{dialect.driver}'")
+    quote = dialect.identifier_preparer.quote
+    sql = (
+        f"INSERT INTO {quote(table.name)} ({', '.join(map(quote, columns))}) "
+        f"VALUES ({', '.join([placeholder] * len(columns))})"
+    )
+    converters = []
+    for i, name in enumerate(columns):
+        type_ = table.c[name].type
+        process = type_.dialect_impl(dialect).bind_processor(dialect)
+        if isinstance(type_, DateTime):
+            converters.append((i, _from_iso(process)))
+        elif process is not None:
+            converters.append((i, process))
+    if not converters:
+        return sql, None
+
+    def decode(row: list) -> tuple:
+        for i, convert in converters:
+            if row[i] is not None:
+                row[i] = convert(row[i])
+        return tuple(row)
+
+    return sql, decode
+
+
+def _json_loader(dialect, table, columns: list[str], key: int | None) -> str:
+    """
+    SQLite INSERT ... SELECT of a chunk line of ``table``, reading the rows
+    from the JSON text itself rather than through Python objects and
+    per-row parameters. Rows of sharded tables, whose shard key is column
+    ``key``, are filtered to the shard bound after the line.
+    """
+    quote = dialect.identifier_preparer.quote
+    values = ", ".join(f"json_extract(value, '$[{i}]')" for i in range(len(columns)))
+    sql = (
+        f"INSERT INTO {quote(table.name)} ({', '.join(map(quote, columns))}) "
+        f"SELECT {values} FROM json_each(?, '$.rows')"
+    )
+    if key is not None:
+        sql += f" WHERE json_extract(value, '$[{key}]') >> {SHARD_SHIFT} = ?"
+    return sql
+
+
+def _unknown_shard(shard: int, conns: dict) -> ValueError:
+    return ValueError(
+        f"Archive has rows of shard {shard}, only {len(conns)} shards are configured"
+    )
+
+
+def _check_shard_keys(conns: dict, tables: list) -> None:
+    """Fail if rows loaded on the only shard belong to another one."""
+    conn = conns[PRIMARY]
+    for table in tables:
+        if table.name in SHARD_KEY_COLUMNS:
+            column = table.c[SHARD_KEY_COLUMNS[table.name][0]]
+            top = conn.scalar(select(func.max(column)))
+            if top is not None and shard_of(top) != PRIMARY:
+                raise _unknown_shard(shard_of(top), conns)
+
+
+def _load_rows(conns: dict, loader: tuple, key: int | None, rows: list) -> int:
+    """Insert parsed rows on the shard their key encodes, or on every shard."""
+    sql, decode = loader
+    if decode is None:
+        rows = list(map(tuple, rows))
+    else:
+        rows = [decode(row) for row in rows]
+    if key is None:
+        for conn in conns.values():
+            conn.exec_driver_sql(sql, rows)
+        return len(rows)
+    if not rows:
+        return 0
+    shard_key = itemgetter(key)
+    first = shard_of(shard_key(min(rows, key=shard_key)))
+    if first == shard_of(shard_key(max(rows, key=shard_key))):
+        # Rows are dumped shard by shard: chunks rarely straddle two
+        groups = {first: rows}
+    else:
+        groups = {}
+        for row in rows:
+            groups.setdefault(shard_of(shard_key(row)), []).append(row)
+    for shard, group in groups.items():
+        if shard not in conns:
+            raise _unknown_shard(shard, conns)
+        conns[shard].exec_driver_sql(sql, group)
+    return len(rows)
+
+
+def _load_json(conns: dict, sql: str, key: int | None, line: str) -> int:
+    """
+    Insert the rows of a chunk line, read by SQLite, on the shard their key
+    encodes, or on every shard.
+    """
+    try:
+        if key is None:
+            for conn in conns.values():
+                loaded = conn.exec_driver_sql(sql, (line,)).rowcount
+            return loaded
+        loaded = sum(
+            conn.exec_driver_sql(sql, (line, shard)).rowcount
+            for shard, conn in conns.items()
+        )
+        primary = conns[PRIMARY]
+        total = primary.exec_driver_sql(
+            "SELECT json_array_length(?, '$.rows')", (line,)
+        ).scalar()
+    except OperationalError as e:
+        if "JSON" not in str(e.orig):
+            raise
+        raise ValueError("Archive is truncated or corrupt")
+    if loaded != total:
+        shard = primary.exec_driver_sql(
+            f"SELECT max(json_extract(value, '$[{key}]')) >> {SHARD_SHIFT} "
+            "FROM json_each(?, '$.rows')",
+            (line,),
+        ).scalar()
+        raise _unknown_shard(shard, conns)
+    return loaded
+
+
+def _defer_constraints(conn) -> None:
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("PRAGMA defer_foreign_keys = ON")
+    elif conn.dialect.name == "postgresql":
+        # Only affects constraints declared DEFERRABLE
+        conn.exec_driver_sql("SET CONSTRAINTS ALL DEFERRED")
+
+
+def _drop_triggers(conn, tables: list) -> list[str]:
+    """
+    Drop the SQLite triggers on ``tables`` for the load, such as the ones
+    keeping the firewall full-text index in sync. Returns their DDL.
+    """
+    if conn.dialect.name != "sqlite":
+        return []
+    names = {t.name for t in tables}
+    triggers = [
+        (name, sql)
+        for name, table, sql in conn.exec_driver_sql(
+            "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'trigger'"
+        )
+        if table in names
+    ]
+    for name, _ in triggers:
+        conn.exec_driver_sql(f'DROP TRIGGER "{name}"')
+    return [sql for _, sql in triggers]
+
+
+def _restore_triggers(conn, triggers: list[str]) -> None:
+    """Recreate dropped triggers and rebuild the full-text indexes once."""
+    if not triggers:
+        return
+    for sql in triggers:
+        conn.exec_driver_sql(sql)
+    for (name,) in conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table' "
+        "AND sql LIKE 'CREATE VIRTUAL TABLE%USING fts5%'"
+    ):
+        conn.exec_driver_sql(f'INSERT INTO "{name}"("{name}") VALUES (\'rebuild\')')
+
+
+def _reset_sequences(conn, tables: list) -> None:
+    """Move PostgreSQL ID sequences past the restored IDs."""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in tables:
+        col = table.autoincrement_column
+        if col is not None:
+            conn.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                    f"'{col.name}'), MAX({col.name})) FROM {table.name} "
+                    f"HAVING MAX({col.name}) IS NOT NULL"
+                )
+            )
+
+
+def restore_archive(db: Session, fileobj, replace: bool = False) -> dict[str, int]:
+    """
+    Bulk-load an archive from ``fileobj`` (binary) into empty tables, or
+    into tables emptied first when ``replace`` is set. Rows of sharded
+    tables go to the shard their IDs encode; templates to every shard.
+    Each shard loads in one transaction with foreign keys checked at commit
+    and its indexes and triggers dropped until the rows are in; full-text
+    indexes are rebuilt once at the end. Raises ValueError, with nothing
+    written, on an invalid or truncated archive. Returns rows loaded per
+    table.
+    """
+    tables = {t.name: t for t in archive_tables()}
+    engines = _engines(db)
+    counts: dict[str, int] = {}
+    with ExitStack() as stack:
+        src = stack.enter_context(gzip.open(fileobj, "rt", encoding="utf-8"))
+        header = _read_header(src, tables)
+        conns = {
+            shard: stack.enter_context(engine.begin())
+            for shard, engine in engines.items()
+        }
+        targets = [t for name, t in tables.items() if name in header["tables"]]
+        indexes = [index for t in targets for index in t.indexes]
+        triggers = {}
+        for shard, conn in conns.items():
+            _begin(conn)
+            _defer_constraints(conn)
+            triggers[shard] = _drop_triggers(conn, list(tables.values()))
+            if replace:
+                for table in reversed(list(tables.values())):
+                    conn.execute(delete(table))
+            else:
+                for table in targets:
+                    if conn.scalar(select(literal(1)).select_from(table).limit(1)):
+                        raise ValueError(
+                            f"Table '{table.name}' is not empty; restore with replace"
+                        )
+            for index in indexes:
+                index.drop(conn)
+
+        dialect = engines[PRIMARY].dialect
+        # Rows are routed by shard key only across several shards; a single
+        # shard takes every row and its keys are checked once at the end
+        keys = {
+            name: columns.index(SHARD_KEY_COLUMNS[name][0])
+            for name, columns in header["tables"].items()
+            if name in SHARD_KEY_COLUMNS and len(conns) > 1
+        }
+        loaders = {
+            name: _loader(dialect, tables[name], columns)
+            for name, columns in header["tables"].items()
+        }
+        # SQLite reads the rows of chunks needing no conversion itself
+        json_loaders = {
+            name: _json_loader(dialect, tables[name], columns, keys.get(name))
+            for name, columns in header["tables"].items()
+            if dialect.name == "sqlite" and loaders[name][1] is None
+        }
+        trailer = None
+        for record in _records(src, json_loaders):
+            if "counts" in record:
+                trailer = record["counts"]
+                break
+            name = record["table"]
+            if "line" in record:
+                loaded = _load_json(
+                    conns, json_loaders[name], keys.get(name), record["line"]
+                )
+            else:
+                loaded = _load_rows(
+                    conns, loaders[name], keys.get(name), record["rows"]
+                )
+            counts[name] = counts.get(name, 0) + loaded
+        if trailer is None or any(counts.get(n, 0) != c for n, c in trailer.items()):
+            raise ValueError("Archive is truncated")
+        if len(conns) == 1:
+            _check_shard_keys(conns, targets)
+
+        for shard, conn in conns.items():
+            for index in indexes:
+                index.create(conn)
+            _restore_triggers(conn, triggers[shard])
+            _reset_sequences(conn, targets)
+    logger.info(f"Restored archive: {counts}")
+    return counts
+
+
+def snapshot(db: Session, path: str, pages: int = SNAPSHOT_PAGES) -> list[str]:
+    """
+    Copy every shard's SQLite database with the online backup API, while
+    the application keeps reading and writing. Shard N > 0 is written next
+    to ``path`` as ``<stem>.shardN<suffix>``. Returns the files written.
+    """
+    engines = _engines(db)
+    if any(engine.dialect.name != "sqlite" for engine in engines.values()):
+        raise ValueError("Snapshots need SQLite; use pg_dump for PostgreSQL")
+    target = Path(path)
+    written = []
+    for shard, engine in engines.items():
+        out = target
+        if shard != PRIMARY:
+            out = target.with_name(f"{target.stem}.shard{shard}{target.suffix}")
+        raw = engine.raw_connection()
+        dest = sqlite3.connect(out)
+        try:
+            raw.driver_connection.backup(dest, pages=pages)
+        finally:
+            dest.close()
+            raw.close()
+        written.append(str(out))
+    logger.info(f"Snapshot written to {', '.join(written)}")
+    return written
@@ -0,0 +1,169 @@
+"""
+Service layer for multi-operation batches.
+A batch runs an ordered list of service calls in one database transaction
+with a single commit. Later operations can reference values returned by
+earlier ones, such as the ID of a firewall created in the same batch.
+"""
+
+import logging
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.orm import Session
+
+from app.schemas import batch as schemas
+from app.services import firewall as firewall_service
+from app.services import policy as policy_service
+from app.services import rule as rule_service
+from app.services import template as template_service
+
+logger = logging.getLogger(__name__)
+
+MAX_OPERATIONS = 1000
+
+# Service functions callable from a batch and the schema of their arguments,
+# by operation name
+OPERATIONS = {
+    "create_firewall": (firewall_service.create_firewall, schemas.FirewallArgs),
+    "update_firewall": (firewall_service.update_firewall, schemas.UpdateFirewallArgs),
+    "delete_firewall": (firewall_service.delete_firewall, schemas.FirewallIdArgs),
+    "add_policy": (policy_service.add_policy, schemas.PolicyArgs),
+    "attach_template": (template_service.attach_template, schemas.AttachTemplateArgs),
+    "delete_policy": (policy_service.delete_policy, schemas.PolicyIdArgs),
+    "add_rule": (rule_service.add_rule, schemas.RuleArgs),
+    "replace_rules": (rule_service.replace_rules, schemas.ReplaceRulesArgs),
+    "delete_rule": (rule_service.delete_rule, schemas.RuleIdArgs),
+    "delete_rules": (rule_service.delete_rules, schemas.DeleteRulesArgs),
+    "create_template": (template_service.create_template, schemas.TemplateArgs),
+    "update_template_rules": (
+        template_service.update_template_rules,
+        schemas.TemplateRulesArgs,
+    ),
+    "delete_template": (template_service.delete_template, schemas.TemplateIdArgs),
+}
+
+
+class BatchError(ValueError):
+    """A batch operation failed; nothing in the batch was committed."""
+
+    def __init__(self, message: str, index: int, op: str | None = None):
+        super().__init__(message)
+        self.index = index
+        self.op = op
+
+
+class _BatchSession:
+    """
+    Session handed to service functions inside a batch.
+    Their commits only flush, and their rollbacks only undo the current
+    operation's savepoint, so the batch commits or rolls back as a whole.
+    """
+
+    def __init__(self, session: Session):
+        self._session = session
+        self._savepoint = None
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def begin_operation(self) -> None:
+        self._savepoint = self._session.begin_nested()
+
+    def end_operation(self) -> None:
+        if self._savepoint.is_active:
+            self._savepoint.commit()
+
+    def commit(self) -> None:
+        self._session.flush()
+
+    def rollback(self) -> None:
+        # Services may keep querying after a rollback, e.g. to report the
+        # existing row of a duplicate: continue in a fresh savepoint
+        self._savepoint.rollback()
+        self._savepoint = self._session.begin_nested()
+
+
+def _lookup(results: list, names: dict[str, int], ref: str, index: int):
+    name, _, path = ref.partition(".")
+    position = names.get(name)
+    if position is None and name.isdigit():
+        position = int(name)
+    if position is None or position >= index:
+        raise BatchError(f"Unknown reference '{ref}'", index)
+    value = results[position]
+    for part in (path or "id").split("."):
+        try:
+            value = value[int(part)] if isinstance(value, list) else value[part]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise BatchError(f"Reference '{ref}' does not resolve", index)
+    return value
+
+
+def _resolve(value, results: list, names: dict[str, int], index: int):
+    """Replace ``{"$ref": "name.path"}`` objects by earlier results."""
+    if isinstance(value, dict):
+        if set(value) == {"$ref"}:
+            return _lookup(results, names, str(value["$ref"]), index)
+        return {k: _resolve(v, results, names, index) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, results, names, index) for v in value]
+    return value
+
+
+def _to_result(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, list):
+        return [_to_result(v) for v in value]
+    if isinstance(value, bool):
+        return {"deleted": value}
+    if isinstance(value, int):
+        return {"deleted": value}
+    return value
+
+
+def run_batch(db: Session, operations: list[dict]) -> list:
+    """
+    Run ``operations`` in order in one transaction and commit once.
+    Each operation is ``{"op": name, "args": {...}, "ref": optional name}``.
+    Argument values may be ``{"$ref": "name.path"}``, where ``name`` is the
+    ``ref`` or index of an earlier operation and ``path`` a dotted path into
+    its result (default "id"). Returns the result of every operation; raises
+    BatchError and rolls everything back on the first failure.
+    """
+    if len(operations) > MAX_OPERATIONS:
+        raise BatchError(f"At most {MAX_OPERATIONS} operations per batch", 0)
+    batch = _BatchSession(db)
+    results: list = []
+    names: dict[str, int] = {}
+    try:
+        for index, operation in enumerate(operations):
+            name = operation.get("op") if isinstance(operation, dict) else None
+            if not isinstance(name, str) or name not in OPERATIONS:
+                raise BatchError(f"Unknown operation '{name}'", index, name)
+            fn, schema = OPERATIONS[name]
+            args = _resolve(operation.get("args") or {}, results, names, index)
+            try:
+                args = schema.model_validate(args).model_dump()
+            except ValidationError as e:
+                raise BatchError(f"Invalid arguments: {e}", index, name)
+
+            batch.begin_operation()
+            try:
+                result = fn(batch, **args)
+            except (TypeError, KeyError) as e:
+                raise BatchError(f"Invalid arguments: {e!r}", index, name)
+            except ValueError as e:
+                raise BatchError(str(e), index, name)
+            batch.end_operation()
+            if result is None or result is False:
+                raise BatchError("Not found", index, name)
+            results.append(_to_result(result))
+            if operation.get("ref") is not None:
+                names[str(operation["ref"])] = index
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.error(f"Batch of {len(operations)} operations rolled back")
+        raise
+    logger.info(f"Batch of {len(operations)} operations committed")
+    return results
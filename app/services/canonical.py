@@ -0,0 +1,108 @@
+"""
+Canonical form and content hash of firewall rules.
+Used by the rule and policy services to deduplicate rules on write.
+"""
+
+import hashlib
+from ipaddress import ip_network
+
+from app.schemas.rule import RuleOut
+
+_ANY = ("", "any", "*")
+ACTIONS = ("allow", "deny")
+
+
+class DuplicateRuleError(ValueError):
+    """Raised when a rule with the same canonical content already exists."""
+
+    def __init__(self, message: str, rule: RuleOut | None = None):
+        super().__init__(message)
+        self.rule = rule
+
+
+def canonical_address(value: str | None) -> str | None:
+    """
+    Normalize an address to its network form.
+    Host prefixes (/32, /128) are rendered as a bare address; values that are
+    not IP networks are only trimmed and lowercased.
+    """
+    if value is None:
+        return None
+    v = value.strip().lower()
+    if v in _ANY:
+        return None
+    try:
+        net = ip_network(v, strict=False)
+    except ValueError:
+        return v
+    if net.prefixlen == net.max_prefixlen:
+        return str(net.network_address)
+    return str(net)
+
+
+def canonical_protocol(value: str | None) -> str | None:
+    """Lowercase a protocol name, mapping wildcards to None."""
+    if value is None:
+        return None
+    v = value.strip().lower()
+    return None if v in _ANY else v
+
+
+def rule_hash(
+    action: str, src: str | None, dst: str | None, protocol: str | None
+) -> str:
+    """Content hash of an already canonical rule."""
+    content = "\x1f".join((action, src or "", dst or "", protocol or ""))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+
+def canonicalize_rule(
+    action: str,
+    src: str | None = None,
+    dst: str | None = None,
+    protocol: str | None = None,
+) -> dict:
+    """
+    Return the canonical column values of a rule, including its hash.
+    Raises ValueError if the action is not one of ACTIONS.
+    """
+    if not isinstance(action, str) or action.strip().lower() not in ACTIONS:
+        raise ValueError("action must be 'allow' or 'deny'")
+    action = action.strip().lower()
+    src = canonical_address(src)
+    dst = canonical_address(dst)
+    protocol = canonical_protocol(protocol)
+    return {
+        "action": action,
+        "src": src,
+        "dst": dst,
+        "protocol": protocol,
+        "hash": rule_hash(action, src, dst, protocol),
+    }
+
+
+def dedupe_rules(
+    rules: list[dict], on_duplicate: str = "reject", **columns
+) -> tuple[list[dict], int]:
+    """
+    Canonicalize rule dicts into insertable rows and drop duplicates within
+    the batch. ``columns`` (e.g. ``policy_id``) are set on every row.
+    Returns the rows and the number of duplicates skipped; raises
+    DuplicateRuleError instead when ``on_duplicate`` is "reject".
+    """
+    if on_duplicate not in ("reject", "report"):
+        raise ValueError("on_duplicate must be 'reject' or 'report'")
+    rows = []
+    seen = set()
+    for r in rules:
+        row = canonicalize_rule(
+            r.get("action"), r.get("src"), r.get("dst"), r.get("protocol")
+        )
+        if row["hash"] in seen:
+            if on_duplicate == "reject":
+                raise DuplicateRuleError("Duplicate rule in request")
+            continue
+        seen.add(row["hash"])
+        row.update(columns)
+        rows.append(row)
+    return rows, len(rules) - len(rows)
@@ -0,0 +1,146 @@
+"""
+Compiled rulesets for first-match rule evaluation.
+Rules are parsed once into integer network/mask pairs so matching a flow is
+a handful of integer operations per rule. Compiled rulesets are cached by a
+caller-provided key that must change whenever the underlying rules change.
+"""
+
+import threading
+from collections import OrderedDict
+from ipaddress import ip_address, ip_network
+
+# Verdict when no rule matches a flow
+DEFAULT_ACTION = "deny"
+
+
+def _compile_address(value: str | None):
+    """
+    Parse a rule address into (version, network, mask).
+    None matches anything; non-IP values are kept as literal strings.
+    """
+    if value is None:
+        return None
+    try:
+        net = ip_network(value, strict=False)
+    except ValueError:
+        return value
+    return (net.version, int(net.network_address), int(net.netmask))
+
+
+def parse_flow_address(value: str | None):
+    """Parse a flow address into (version, int), or a literal string."""
+    if value is None:
+        return None
+    try:
+        addr = ip_address(value)
+    except ValueError:
+        return value.strip().lower()
+    return (addr.version, int(addr))
+
+
+def _address_matches(rule_addr, flow_addr) -> bool:
+    if rule_addr is None:
+        return True
+    if flow_addr is None:
+        return False
+    if isinstance(rule_addr, str) or isinstance(flow_addr, str):
+        return rule_addr == flow_addr
+    return rule_addr[0] == flow_addr[0] and flow_addr[1] & rule_addr[2] == rule_addr[1]
+
+
+class CompiledRule:
+    """A rule parsed for fast matching."""
+
+    __slots__ = ("id", "policy_id", "action", "protocol", "src", "dst")
+
+    def __init__(self, rule: dict):
+        self.id = rule.get("id")
+        self.policy_id = rule.get("policy_id")
+        self.action = rule["action"]
+        self.protocol = rule.get("protocol")
+        self.src = _compile_address(rule.get("src"))
+        self.dst = _compile_address(rule.get("dst"))
+
+    def matches(self, src, dst, protocol: str | None) -> bool:
+        """Match a flow whose addresses went through parse_flow_address."""
+        if self.protocol is not None and self.protocol != protocol:
+            return False
+        return _address_matches(self.src, src) and _address_matches(self.dst, dst)
+
+
+class CompiledRuleset:
+    """An ordered list of compiled rules evaluated with first-match semantics."""
+
+    def __init__(self, rules: list[CompiledRule]):
+        self.rules = rules
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def evaluate(self, src, dst, protocol: str | None) -> CompiledRule | None:
+        """Return the first rule matching a parsed flow, or None."""
+        for rule in self.rules:
+            if rule.matches(src, dst, protocol):
+                return rule
+        return None
+
+
+def compile_rules(rules: list[dict]) -> CompiledRuleset:
+    """Compile rule dicts (action, src, dst, protocol, optional id) in order."""
+    return CompiledRuleset([CompiledRule(r) for r in rules])
+
+
+class FirewallRuleset:
+    """
+    A firewall's policies in evaluation order, each a compiled ruleset.
+    Template-backed policies share the template's compiled ruleset.
+    """
+
+    def __init__(self, segments: list[tuple[int, CompiledRuleset]]):
+        self.segments = segments
+
+    def __len__(self) -> int:
+        return sum(len(ruleset) for _, ruleset in self.segments)
+
+    def evaluate(self, src, dst, protocol: str | None):
+        """Return ``(policy_id, rule)`` of the first match, or None."""
+        for policy_id, ruleset in self.segments:
+            rule = ruleset.evaluate(src, dst, protocol)
+            if rule is not None:
+                return policy_id, rule
+        return None
+
+
+class RulesetCache:
+    """Thread-safe LRU of compiled rulesets keyed by versioned keys."""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        """Return the ruleset cached under ``key``, calling ``build()`` on a miss."""
+        with self._lock:
+            ruleset = self._entries.get(key)
+            if ruleset is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return ruleset
+            self.misses += 1
+        ruleset = build()
+        with self._lock:
+            self._entries[key] = ruleset
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return ruleset
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+ruleset_cache = RulesetCache()
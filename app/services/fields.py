@@ -0,0 +1,143 @@
+"""
+Sparse fieldsets for read endpoints.
+A field spec maps requested fields of an output schema to the spec of their
+nested objects, None meaning every field. Queries load only the columns and
+relationships a spec needs, and results are built as schema models whose
+unrequested fields are unset, so ``.dict(exclude_unset=True)`` leaves them
+out of the response.
+"""
+
+import typing
+
+from pydantic import AliasChoices, BaseModel
+from sqlalchemy import inspect, orm, select
+from sqlalchemy.orm import Session
+
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.models.template import PolicyTemplate, TemplateRule
+
+FieldSpec = dict[str, "FieldSpec | None"]
+
+
+def _nested_model(model: type[BaseModel], name: str) -> type[BaseModel] | None:
+    field = model.model_fields.get(name)
+    if field is None:
+        raise ValueError(f"Unknown field '{name}'")
+    for arg in typing.get_args(field.annotation) or (field.annotation,):
+        if isinstance(arg, type) and issubclass(arg, BaseModel):
+            return arg
+    return None
+
+
+def parse_fields(value: str | None, model: type[BaseModel]) -> FieldSpec | None:
+    """
+    Parse a comma-separated list of fields, with dotted paths for nested
+    objects (``id,name,policies.id,policies.rules.action``), against an
+    output schema. Returns None when ``value`` is None; raises ValueError on
+    unknown fields.
+    """
+    if value is None:
+        return None
+    spec: FieldSpec = {}
+    for path in filter(None, (p.strip() for p in value.split(","))):
+        node, schema = spec, model
+        *parents, leaf = path.split(".")
+        for name in parents:
+            schema = _nested_model(schema, name)
+            if schema is None:
+                raise ValueError(f"Field '{name}' has no nested fields")
+            if name in node and node[name] is None:
+                break
+            node = node.setdefault(name, {})
+        else:
+            _nested_model(schema, leaf)
+            node[leaf] = None
+    if not spec:
+        raise ValueError("fields must name at least one field")
+    return spec
+
+
+def columns(entity, spec: FieldSpec, *required: str) -> list:
+    """
+    Column attributes of ``entity`` named in ``spec``, plus ``required`` and
+    the primary key, which the identity map always needs.
+    """
+    names = inspect(entity).column_attrs.keys()
+    wanted = {"id", *spec, *required}
+    return [getattr(entity, n) for n in names if n in wanted]
+
+
+def _attribute(model: type[BaseModel], name: str) -> str:
+    alias = model.model_fields[name].validation_alias
+    if isinstance(alias, AliasChoices):
+        return alias.choices[0]
+    return alias or name
+
+
+def build(model: type[BaseModel], obj, spec: FieldSpec | None, *extra: str):
+    """
+    Build ``model`` from an ORM object reading only the fields in ``spec``.
+    ``extra`` attributes are set without counting as requested, e.g. a sort
+    key needed for the next page cursor.
+    """
+    if spec is None:
+        return model.model_validate(obj)
+    values = {}
+    for name, sub in spec.items():
+        value = getattr(obj, _attribute(model, name))
+        nested = _nested_model(model, name)
+        if nested is not None:
+            value = [build(nested, item, sub) for item in value]
+        values[name] = value
+    for name in extra:
+        values.setdefault(name, getattr(obj, name))
+    return model.model_construct(_fields_set=set(spec), **values)
+
+
+def _option(base, name: str, *args):
+    # Chain from a relationship loader, or start a top-level option
+    return getattr(base if base is not None else orm, name)(*args)
+
+
+def policy_loaders(spec: FieldSpec | None, base=None) -> list:
+    """
+    Loader options for policies fetching only what ``spec`` needs: the
+    policies' rules, own or from their template, are only queried when
+    requested. ``base`` is the relationship loader policies are reached
+    through, if any.
+    """
+    options = []
+    wants_rules = spec is None or "rules" in spec
+    if spec is not None:
+        required = ("template_id",) if wants_rules else ()
+        options.append(
+            _option(base, "load_only", *columns(FilteringPolicy, spec, *required))
+        )
+    if wants_rules:
+        rule_spec = None if spec is None else spec["rules"]
+        rules = _option(base, "selectinload", FilteringPolicy.rules)
+        template_rules = _option(
+            base, "selectinload", FilteringPolicy.template
+        ).selectinload(PolicyTemplate.rules)
+        if rule_spec is not None:
+            rules = rules.load_only(*columns(Rule, rule_spec))
+            template_rules = template_rules.load_only(*columns(TemplateRule, rule_spec))
+        options += [rules, template_rules]
+    return options
+
+
+def effective_rules(
+    db: Session, policy: FilteringPolicy, spec: FieldSpec, *required: str
+) -> list:
+    """A policy's effective rules, loading only the columns in ``spec``."""
+    if policy.template_id is not None:
+        entity, criteria = TemplateRule, TemplateRule.template_id == policy.template_id
+    else:
+        entity, criteria = Rule, Rule.policy_id == policy.id
+    return db.scalars(
+        select(entity)
+        .where(criteria)
+        .order_by(entity.id)
+        .options(orm.load_only(*columns(entity, spec, *required)))
+    ).all()
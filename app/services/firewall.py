@@ -3,22 +3,79 @@ Service layer for Firewall operations.
 Handles database logic for creating, retrieving, and deleting firewalls.
 """
 
+import base64
+import heapq
+import json
 import logging
+import re
 
+from sqlalchemy import (
+    String,
+    and_,
+    any_,
+    bindparam,
+    column,
+    delete,
+    func,
+    or_,
+    select,
+    table,
+    text,
+    update,
+)
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, load_only, selectinload
 
+from app.db import dialect_insert
 from app.models.firewall import Firewall
-from app.schemas.firewall import FirewallOut
+from app.schemas.firewall import FirewallIn, FirewallOut
+from app.services.fields import FieldSpec, build, columns, policy_loaders
+from app.sharding import fan_out, shard_count, shard_for_name, shard_of
 
 logger = logging.getLogger(__name__)
 
+BATCH_CHUNK_SIZE = 500
+
+
+def bump_firewall_version(db: Session, *fw_ids: int) -> None:
+    """
+    Increment the version of firewalls whose content changed, in the caller's
+    transaction. Readers use it to key caches and coalesced responses.
+    """
+    if fw_ids:
+        db.execute(
+            update(Firewall)
+            .where(Firewall.id.in_(fw_ids))
+            .values(version=Firewall.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def firewall_version(db: Session, fw_id: int) -> int | None:
+    """Current version of a firewall, or None if it does not exist."""
+    return db.scalar(select(Firewall.version).where(Firewall.id == fw_id))
+
+
+def _name_taken(db: Session, name: str, fw_id: int | None = None) -> bool:
+    """
+    Whether a firewall other than ``fw_id`` has this name on another shard.
+    The unique index on name only covers the shard a row is written to.
+    """
+    if shard_count(db) == 1:
+        return False
+    stmt = select(Firewall.id).where(Firewall.name == name)
+    return any(other != fw_id for other in db.scalars(stmt))
+
 
 def create_firewall(
     db: Session, name: str, description: str | None = None
 ) -> FirewallOut:
     """Create and persist a firewall."""
     logger.info(f"Creating firewall with name={name}")
+    if _name_taken(db, name):
+        logger.error(f"Firewall creation failed: name '{name}' already exists")
+        raise ValueError("Firewall with that name already exists")
     fw = Firewall(name=name, description=description)
     db.add(fw)
     try:
@@ -44,8 +101,12 @@ def update_firewall(
     logger.info(
         f"Updating firewall id={fw_id} with name={name} and description={description}"
     )
+    if _name_taken(db, name, fw_id):
+        logger.error(f"Firewall update failed: name '{name}' already exists")
+        raise ValueError("Firewall with that name already exists")
     fw.name = name
     fw.description = description
+    fw.version = Firewall.version + 1
     try:
         db.commit()
         db.refresh(fw)
@@ -58,30 +119,255 @@ def update_firewall(
     return FirewallOut.model_validate(fw)
 
 
-def list_firewalls(db: Session) -> list[FirewallOut]:
-    """List all firewalls."""
-    fws = db.query(Firewall).all()
+SORT_COLUMNS = {"id": Firewall.id, "name": Firewall.name}
+_fts_engines: dict = {}
+
+
+def _firewall_loaders(fields: FieldSpec | None, *required: str) -> list:
+    """Loader options fetching only what a firewall field spec needs."""
+    if fields is None:
+        return policy_loaders(None, selectinload(Firewall.policies))
+    options = [load_only(*columns(Firewall, fields, *required))]
+    if "policies" in fields:
+        options += policy_loaders(fields["policies"], selectinload(Firewall.policies))
+    return options
+
+
+def _has_fts(db: Session) -> bool:
+    """Whether the bound SQLite database has the firewalls_fts index."""
+    engine = db.get_bind()
+    if engine not in _fts_engines:
+        _fts_engines[engine] = (
+            db.scalar(
+                text(
+                    "SELECT 1 FROM sqlite_master "
+                    "WHERE type = 'table' AND name = 'firewalls_fts'"
+                )
+            )
+            is not None
+        )
+    return _fts_engines[engine]
+
+
+def _search_clause(db: Session, q: str):
+    """Full-text condition on name/description for the bound dialect."""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    if db.get_bind().dialect.name == "sqlite" and _has_fts(db):
+        match = " ".join(f'"{t}"*' for t in terms)
+        return Firewall.id.in_(
+            select(column("rowid"))
+            .select_from(table("firewalls_fts"))
+            .where(text("firewalls_fts MATCH :match").bindparams(match=match))
+        )
+    # PostgreSQL serves ILIKE from the trigram index
+    return and_(
+        *(
+            or_(Firewall.name.ilike(f"%{t}%"), Firewall.description.ilike(f"%{t}%"))
+            for t in terms
+        )
+    )
+
+
+def encode_cursor(fw: FirewallOut, sort: str = "id") -> str:
+    """Opaque keyset cursor pointing after ``fw`` for the given sort."""
+    value = getattr(fw, sort.lstrip("-"))
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _ids_by_name(db: Session, names: list[str]) -> dict[str, int]:
+    """
+    IDs of the firewalls named in ``names``, in one query per shard whatever
+    the number of names: they are bound as a single JSON array on SQLite and
+    a single array on PostgreSQL rather than one parameter each.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        values = func.json_each(json.dumps(names)).table_valued("value")
+        match = Firewall.name.in_(select(values.c.value))
+    elif dialect == "postgresql":
+        match = Firewall.name == any_(
+            bindparam("names", names, type_=postgresql.ARRAY(String))
+        )
+    else:
+        match = Firewall.name.in_(names)
+    return dict(db.execute(select(Firewall.name, Firewall.id).where(match)).all())
+
+
+def upsert_firewalls(db: Session, items: list[dict], progress=None) -> list[dict]:
+    """
+    Create or update many firewalls by name in one transaction.
+    Name collisions with existing rows are detected with a single query per
+    shard, and the batch is written with INSERT ... ON CONFLICT (name) DO
+    UPDATE on the shard holding each name, or the name's hash shard for new
+    ones. The resulting IDs are read back the same way. Returns
+    one result per item: status "created", "updated" or "error".
+    ``progress(done, total)`` is called after each written chunk.
+    """
+    results: list[dict] = []
+    rows: dict[str, dict] = {}
+    for index, item in enumerate(items):
+        try:
+            fw_in = FirewallIn.model_validate(item)
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+            continue
+        if fw_in.name in rows:
+            results.append(
+                {
+                    "index": index,
+                    "name": fw_in.name,
+                    "status": "error",
+                    "error": "Duplicate name in batch",
+                }
+            )
+            continue
+        rows[fw_in.name] = fw_in.model_dump()
+        results.append({"index": index, "name": fw_in.name})
+
+    if rows:
+        names = list(rows)
+        existing = _ids_by_name(db, names)
+        shards = shard_count(db)
+        by_shard: dict[int, list[dict]] = {}
+        for name, row in rows.items():
+            shard = (
+                shard_of(existing[name])
+                if name in existing
+                else shard_for_name(name, shards)
+            )
+            by_shard.setdefault(shard, []).append(row)
+        stmt = dialect_insert(db, Firewall.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Firewall.name],
+            set_={
+                "description": stmt.excluded.description,
+                "version": Firewall.version + 1,
+            },
+        )
+        try:
+            done = 0
+            for shard, values in by_shard.items():
+                for i in range(0, len(values), BATCH_CHUNK_SIZE):
+                    chunk = values[i : i + BATCH_CHUNK_SIZE]
+                    db.execute(stmt, chunk, bind_arguments={"shard_id": shard})
+                    done += len(chunk)
+                    if progress:
+                        progress(done, len(rows))
+            ids = _ids_by_name(db, names)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.error(f"Firewall batch upsert of {len(rows)} items failed")
+            raise
+        for result in results:
+            if "status" not in result:
+                result["id"] = ids[result["name"]]
+                result["status"] = (
+                    "updated" if result["name"] in existing else "created"
+                )
+
+    logger.info(
+        f"Firewall batch upsert: {len(rows)} written, "
+        f"{len(results) - len(rows)} errors"
+    )
+    return results
+
+
+def list_firewalls(
+    db: Session,
+    q: str | None = None,
+    name_prefix: str | None = None,
+    sort: str = "id",
+    limit: int | None = None,
+    cursor: str | None = None,
+    fields: FieldSpec | None = None,
+) -> list[FirewallOut]:
+    """
+    List firewalls, optionally filtered and paginated.
+    ``q`` is a full-text search over name and description, ``name_prefix`` a
+    range scan on the name index, ``sort`` one of id/name (prefix "-" for
+    descending) and ``cursor`` a keyset cursor from encode_cursor. ``fields``
+    limits the columns loaded and the fields set on the results.
+    Shards are queried in parallel and their sorted pages merged.
+    """
+    key = sort.lstrip("-")
+    if key not in SORT_COLUMNS:
+        raise ValueError("sort must be one of: id, -id, name, -name")
+    col = SORT_COLUMNS[key]
+    descending = sort.startswith("-")
+
+    stmt = select(Firewall).options(*_firewall_loaders(fields, key))
+    if q:
+        clause = _search_clause(db, q)
+        if clause is not None:
+            stmt = stmt.where(clause)
+    if name_prefix:
+        # Range predicate so the unique index on name serves the prefix scan
+        stmt = stmt.where(
+            Firewall.name >= name_prefix, Firewall.name < name_prefix + "\uffff"
+        )
+    if cursor:
+        after = _decode_cursor(cursor)
+        stmt = stmt.where(col < after if descending else col > after)
+    stmt = stmt.order_by(col.desc() if descending else col)
+    if limit:
+        stmt = stmt.limit(limit)
+
+    pages = fan_out(
+        db,
+        lambda session: [
+            build(FirewallOut, fw, fields, key) for fw in session.scalars(stmt).all()
+        ],
+    )
+    fws = list(
+        heapq.merge(*pages, key=lambda fw: getattr(fw, key), reverse=descending)
+    )[:limit]
     logger.info(f"Listing {len(fws)} firewalls")
-    return [FirewallOut.model_validate(fw) for fw in fws]
+    return fws
 
 
-def get_firewall(db: Session, fw_id: int) -> FirewallOut | None:
-    """Retrieve a firewall by ID."""
-    fw = db.get(Firewall, fw_id)
+def get_firewall(
+    db: Session, fw_id: int, fields: FieldSpec | None = None
+) -> FirewallOut | None:
+    """Retrieve a firewall by ID, limited to ``fields`` if given."""
+    if fields is None:
+        fw = db.get(Firewall, fw_id)
+    else:
+        fw = db.scalars(
+            select(Firewall)
+            .where(Firewall.id == fw_id)
+            .options(*_firewall_loaders(fields))
+        ).first()
     if fw:
         logger.info(f"Firewall retrieved: id={fw.id}")
-        return FirewallOut.model_validate(fw)
+        return build(FirewallOut, fw, fields)
     logger.warning(f"Firewall not found: id={fw_id}")
     return None
 
 
-def delete_firewall(db: Session, fw_id: int) -> bool:
-    """Delete a firewall by ID."""
-    fw = db.get(Firewall, fw_id)
-    if not fw:
+def delete_firewall(db: Session, fw_id: int, progress=None) -> bool:
+    """
+    Delete a firewall by ID.
+    Policies and rules are removed by the database through ON DELETE CASCADE,
+    so no child rows are loaded into the session. ``progress(1, 1)`` is
+    called once the rows are deleted, before the commit.
+    """
+    result = db.execute(delete(Firewall).where(Firewall.id == fw_id))
+    if not result.rowcount:
+        db.rollback()
         logger.warning(f"Delete failed: firewall not found id={fw_id}")
         return False
-    db.delete(fw)
+    if progress:
+        progress(1, 1)
     db.commit()
     logger.info(f"Firewall deleted: id={fw_id}")
     return True
@@ -0,0 +1,253 @@
+"""
+Service layer for per-firewall summary statistics.
+The firewall_stats and firewall_rule_counts tables hold each firewall's
+policy count and its effective rules per action and protocol. The policy,
+rule and template write paths adjust them by deltas in their own
+transaction, so a fleet summary reads two small tables instead of every rule.
+"""
+
+import logging
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from app.db import dialect_insert
+from app.models.firewall import Firewall
+from app.models.firewall_stat import ANY_PROTOCOL, FirewallRuleCount, FirewallStat
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.models.template import TemplateRule
+from app.schemas.firewall import FirewallStatsOut
+from app.services.fields import FieldSpec
+from app.sharding import fan_out, group_by_shard
+
+logger = logging.getLogger(__name__)
+
+
+def count_rules(rows) -> Counter:
+    """Canonical rule rows counted per (action, protocol)."""
+    return Counter((r["action"], r["protocol"] or ANY_PROTOCOL) for r in rows)
+
+
+def _grouped(db: Session, entity, *criteria) -> Counter:
+    rows = db.execute(
+        select(entity.action, entity.protocol, func.count())
+        .where(*criteria)
+        .group_by(entity.action, entity.protocol)
+    )
+    return Counter({(a, p or ANY_PROTOCOL): n for a, p, n in rows})
+
+
+def template_rule_counts(db: Session, template_id: int) -> Counter:
+    """Rules of a template per (action, protocol)."""
+    return _grouped(db, TemplateRule, TemplateRule.template_id == template_id)
+
+
+def policy_rule_counts(
+    db: Session, policy: FilteringPolicy, rule_ids: list[int] | None = None
+) -> Counter:
+    """
+    Effective rules of a policy per (action, protocol), only those in
+    ``rule_ids`` if given.
+    """
+    if policy.template_id is not None:
+        entity, criteria = TemplateRule, TemplateRule.template_id == policy.template_id
+    else:
+        entity, criteria = Rule, Rule.policy_id == policy.id
+    if rule_ids is not None:
+        return _grouped(db, entity, criteria, entity.id.in_(rule_ids))
+    return _grouped(db, entity, criteria)
+
+
+def _delta(added: Counter | None, removed: Counter | None) -> Counter:
+    delta = Counter(added or {})
+    delta.subtract(removed or {})
+    return Counter({key: n for key, n in delta.items() if n})
+
+
+def _apply(db: Session, deltas: dict[int, tuple[int, Counter]]) -> None:
+    """Upsert ``{fw_id: (policies, rules)}`` deltas, one batch per shard."""
+    stats = dialect_insert(db, FirewallStat.__table__)
+    stats = stats.on_conflict_do_update(
+        index_elements=[FirewallStat.firewall_id],
+        set_={
+            "policies": FirewallStat.policies + stats.excluded.policies,
+            "rules": FirewallStat.rules + stats.excluded.rules,
+        },
+    )
+    counts = dialect_insert(db, FirewallRuleCount.__table__)
+    counts = counts.on_conflict_do_update(
+        index_elements=[
+            FirewallRuleCount.firewall_id,
+            FirewallRuleCount.action,
+            FirewallRuleCount.protocol,
+        ],
+        set_={"rules": FirewallRuleCount.rules + counts.excluded.rules},
+    )
+    for shard, fw_ids in group_by_shard(deltas).items():
+        on_shard = {"bind_arguments": {"shard_id": shard}}
+        stat_rows, count_rows = [], []
+        for fw_id in fw_ids:
+            policies, rules = deltas[fw_id]
+            stat_rows.append(
+                {"firewall_id": fw_id, "policies": policies, "rules": rules.total()}
+            )
+            count_rows += [
+                {"firewall_id": fw_id, "action": a, "protocol": p, "rules": n}
+                for (a, p), n in rules.items()
+            ]
+        db.execute(stats, stat_rows, **on_shard)
+        if count_rows:
+            db.execute(counts, count_rows, **on_shard)
+
+
+def adjust_firewall_stats(
+    db: Session,
+    fw_id: int,
+    added: Counter | None = None,
+    removed: Counter | None = None,
+    policies: int = 0,
+) -> None:
+    """
+    Apply a change of a firewall's policies and effective rules, counted per
+    (action, protocol), in the caller's transaction. Does not commit.
+    """
+    rules = _delta(added, removed)
+    if policies or rules:
+        _apply(db, {fw_id: (policies, rules)})
+
+
+def adjust_template_stats(
+    db: Session,
+    template_id: int,
+    added: Counter | None = None,
+    removed: Counter | None = None,
+) -> None:
+    """
+    Apply a change of a template's rules to every firewall with policies
+    attached to it, once per attached policy. Does not commit.
+    """
+    rules = _delta(added, removed)
+    if not rules:
+        return
+    # One row per firewall, from every shard
+    attached = db.execute(
+        select(FilteringPolicy.firewall_id, func.count())
+        .where(FilteringPolicy.template_id == template_id)
+        .group_by(FilteringPolicy.firewall_id)
+    ).all()
+    _apply(
+        db,
+        {
+            fw_id: (0, Counter({key: n * k for key, n in rules.items()}))
+            for fw_id, k in attached
+        },
+    )
+
+
+def list_firewall_stats(db: Session, fields: FieldSpec | None = None) -> list[dict]:
+    """
+    Policy and rule counts of every firewall, rules broken down by action
+    and protocol, ordered by firewall ID, limited to ``fields`` if given.
+    The counts and the breakdown are only read when requested.
+    """
+    wanted = set(FirewallStatsOut.model_fields if fields is None else fields)
+    counts = bool(wanted & {"policies", "rules"})
+
+    def read(session: Session) -> list[dict]:
+        query = select(Firewall.id, Firewall.name).order_by(Firewall.id)
+        if counts:
+            query = query.add_columns(
+                FirewallStat.policies, FirewallStat.rules
+            ).outerjoin(FirewallStat, FirewallStat.firewall_id == Firewall.id)
+        stats = {}
+        for fw_id, name, *summary in session.execute(query):
+            policies, rules = summary or (0, 0)
+            stats[fw_id] = {
+                "firewall_id": fw_id,
+                "name": name,
+                "policies": policies or 0,
+                "rules": rules or 0,
+                "breakdown": {},
+            }
+        if "breakdown" in wanted:
+            for fw_id, action, protocol, rules in session.execute(
+                select(FirewallRuleCount.__table__).where(FirewallRuleCount.rules != 0)
+            ):
+                if fw_id in stats:
+                    stats[fw_id]["breakdown"].setdefault(action, {})[protocol] = rules
+        return list(stats.values())
+
+    summary = sorted(
+        (row for page in fan_out(db, read) for row in page),
+        key=lambda row: row["firewall_id"],
+    )
+    logger.info(f"Listing stats of {len(summary)} firewalls")
+    if fields is None:
+        return summary
+    return [{name: row[name] for name in fields} for row in summary]
+
+
+def rebuild_firewall_stats(db: Session) -> int:
+    """
+    Recompute every firewall's counts from its policies and rules, e.g. to
+    backfill a database created before the summary tables. Commits on each
+    shard; returns the number of firewalls with policies.
+    """
+
+    def rebuild(session: Session) -> int:
+        session.execute(delete(FirewallRuleCount.__table__))
+        session.execute(delete(FirewallStat.__table__))
+        policies = dict(
+            session.execute(
+                select(FilteringPolicy.firewall_id, func.count()).group_by(
+                    FilteringPolicy.firewall_id
+                )
+            ).all()
+        )
+        own = (
+            select(
+                FilteringPolicy.firewall_id, Rule.action, Rule.protocol, func.count()
+            )
+            .join(Rule, Rule.policy_id == FilteringPolicy.id)
+            .where(FilteringPolicy.template_id.is_(None))
+            .group_by(FilteringPolicy.firewall_id, Rule.action, Rule.protocol)
+        )
+        shared = (
+            select(
+                FilteringPolicy.firewall_id,
+                TemplateRule.action,
+                TemplateRule.protocol,
+                func.count(),
+            )
+            .join(TemplateRule, TemplateRule.template_id == FilteringPolicy.template_id)
+            .group_by(
+                FilteringPolicy.firewall_id, TemplateRule.action, TemplateRule.protocol
+            )
+        )
+        rules: dict[int, Counter] = {fw_id: Counter() for fw_id in policies}
+        for stmt in (own, shared):
+            for fw_id, action, protocol, n in session.execute(stmt):
+                rules[fw_id][(action, protocol or ANY_PROTOCOL)] += n
+        if policies:
+            session.execute(
+                insert(FirewallStat.__table__),
+                [
+                    {"firewall_id": fw_id, "policies": n, "rules": rules[fw_id].total()}
+                    for fw_id, n in policies.items()
+                ],
+            )
+            count_rows = [
+                {"firewall_id": fw_id, "action": a, "protocol": p, "rules": n}
+                for fw_id, counts in rules.items()
+                for (a, p), n in counts.items()
+            ]
+            if count_rows:
+                session.execute(insert(FirewallRuleCount.__table__), count_rows)
+        session.commit()
+        return len(policies)
+
+    rebuilt = sum(fan_out(db, rebuild))
+    logger.info(f"Rebuilt stats of {rebuilt} firewalls")
+    return rebuilt
@@ -0,0 +1,142 @@
+"""
+Service layer for policy rule optimization.
+Merges adjacent and overlapping prefixes of rules that share an action and
+protocol into minimal CIDR sets while preserving first-match semantics.
+"""
+
+import logging
+from ipaddress import collapse_addresses, ip_network
+
+from sqlalchemy.orm import Session
+
+from app.models.policy import FilteringPolicy
+from app.services.canonical import canonical_address
+from app.services.rule import replace_rules
+
+logger = logging.getLogger(__name__)
+
+RULE_FIELDS = ("action", "src", "dst", "protocol")
+
+
+def _network(value: str | None):
+    """Parse a canonical address, returning None for wildcards and non-networks."""
+    if value is None:
+        return None
+    try:
+        return ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+
+def _overlaps(a: str | None, b: str | None) -> bool:
+    """Whether two address matchers can match a common address (conservative)."""
+    if a is None or b is None or a == b:
+        return True
+    na, nb = _network(a), _network(b)
+    if na is None or nb is None:
+        return True
+    return na.version == nb.version and na.overlaps(nb)
+
+
+class _Group:
+    """Rules merged at the position of the first one along one address field."""
+
+    def __init__(self, rule: dict, field: str, net):
+        self.rule = rule
+        self.field = field
+        self.nets = [net] if net is not None else None
+
+    def overlaps(self, rule: dict, other: str) -> bool:
+        g = self.rule
+        if g["protocol"] and rule["protocol"] and g["protocol"] != rule["protocol"]:
+            return False
+        if not _overlaps(g[other], rule[other]):
+            return False
+        if self.nets is None:
+            return _overlaps(g[self.field], rule[self.field])
+        return any(_overlaps(str(n), rule[self.field]) for n in self.nets)
+
+    def rules(self) -> list[dict]:
+        if self.nets is None or len(self.nets) == 1:
+            return [self.rule]
+        return [
+            {**self.rule, self.field: canonical_address(str(net))}
+            for net in collapse_addresses(self.nets)
+        ]
+
+
+def _merge_field(rules: list[dict], field: str, other: str) -> list[dict]:
+    """
+    Merge rules along ``field`` when action, protocol and ``other`` match.
+    A later rule is moved up into an earlier group only when no rule in
+    between has a different action and overlaps it, so verdicts are unchanged.
+    """
+    groups: list[_Group] = []
+    open_groups: dict[tuple, int] = {}
+    for rule in rules:
+        net = _network(rule[field])
+        if net is not None:
+            key = (rule["action"], rule["protocol"], rule[other], net.version)
+            idx = open_groups.get(key)
+            if idx is not None and not any(
+                g.rule["action"] != rule["action"] and g.overlaps(rule, other)
+                for g in groups[idx + 1 :]
+            ):
+                groups[idx].nets.append(net)
+                continue
+            open_groups[key] = len(groups)
+        groups.append(_Group(rule, field, net))
+    return [r for g in groups for r in g.rules()]
+
+
+def optimize_rules(rules: list[dict]) -> list[dict]:
+    """
+    Return an equivalent, shorter rule list for rules in evaluation order.
+    Sources are merged first, then destinations of the result.
+    """
+    rules = [{f: r.get(f) for f in RULE_FIELDS} for r in rules]
+    rules = _merge_field(rules, "src", "dst")
+    rules = _merge_field(rules, "dst", "src")
+    # Collapsing can reproduce a later rule exactly; that copy is fully shadowed.
+    seen = set()
+    result = []
+    for r in rules:
+        content = tuple(r[f] for f in RULE_FIELDS)
+        if content not in seen:
+            seen.add(content)
+            result.append(r)
+    return result
+
+
+def optimize_policy(
+    db: Session, policy_id: int, apply: bool = False, progress=None
+) -> dict:
+    """
+    Compute the optimized rule set of a policy.
+    In dry-run mode the proposal is only returned; with ``apply`` the policy's
+    rules are atomically replaced by it. ``progress(done, total)`` is called
+    with the rules optimized, then with the rules written when applying.
+    """
+    p = db.get(FilteringPolicy, policy_id)
+    if not p:
+        logger.error(f"Policy not found for optimization: id={policy_id}")
+        raise ValueError("Policy not found")
+
+    rows = p.effective_rules
+    optimized = optimize_rules([{f: getattr(r, f) for f in RULE_FIELDS} for r in rows])
+    logger.info(
+        f"Optimized policy id={policy_id}: {len(rows)} -> {len(optimized)} rules"
+        f" (apply={apply})"
+    )
+    if progress:
+        progress(len(rows), len(rows))
+    applied = apply and len(optimized) < len(rows)
+    if applied:
+        replace_rules(db, policy_id, optimized, progress=progress)
+    return {
+        "policy_id": policy_id,
+        "before": len(rows),
+        "after": len(optimized),
+        "applied": applied,
+        "rules": optimized,
+    }
@@ -5,18 +5,37 @@ Handles database logic for creating, listing, and deleting policies.
 
 import logging
 
+from sqlalchemy import delete, insert, select
 from sqlalchemy.orm import Session
 
 from app.models.firewall import Firewall
 from app.models.policy import FilteringPolicy
 from app.models.rule import Rule
 from app.schemas.policy import PolicyOut
+from app.services.canonical import dedupe_rules
+from app.services.fields import FieldSpec, build, policy_loaders
+from app.services.firewall import bump_firewall_version
+from app.services.firewall_stats import (
+    adjust_firewall_stats,
+    count_rules,
+    policy_rule_counts,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def add_policy(db: Session, fw_id: int, name: str, rules: list[dict]) -> PolicyOut:
-    """Attach a new policy to a firewall with optional rules."""
+def add_policy(
+    db: Session,
+    fw_id: int,
+    name: str,
+    rules: list[dict],
+    on_duplicate: str = "reject",
+) -> PolicyOut:
+    """
+    Attach a new policy to a firewall with optional rules.
+    Rules are stored in canonical form; duplicates raise DuplicateRuleError, or
+    are skipped when ``on_duplicate`` is "report".
+    """
     logger.info(f"Adding policy '{name}' to firewall id={fw_id}")
     fw = db.get(Firewall, fw_id)
     if not fw:
@@ -25,44 +44,62 @@ def add_policy(db: Session, fw_id: int, name: str, rules: list[dict]) -> PolicyO
 
     policy = FilteringPolicy(name=name, firewall=fw)
     db.add(policy)
+    db.flush()
+    try:
+        rows, duplicates = dedupe_rules(rules or [], on_duplicate, policy_id=policy.id)
+    except ValueError:
+        db.rollback()
+        raise
+    if rows:
+        db.execute(insert(Rule.__table__), rows)
+    adjust_firewall_stats(db, fw_id, count_rules(rows), policies=1)
+    bump_firewall_version(db, fw_id)
     db.commit()
     db.refresh(policy)
-    logger.info(f"Policy created with id={policy.id}")
-
-    for r in rules or []:
-        rule = Rule(
-            action=r["action"],
-            src=r.get("src"),
-            dst=r.get("dst"),
-            protocol=r.get("protocol"),
-            policy=policy,
-        )
-        db.add(rule)
-    db.commit()
-    db.refresh(policy)
-    logger.info(f"Added {len(rules or [])} rules to policy id={policy.id}")
+    logger.info(
+        f"Policy created with id={policy.id}: {len(rows)} rules, "
+        f"{duplicates} duplicates skipped"
+    )
 
     return PolicyOut.model_validate(policy)  # <- Pydantic v2
 
 
-def list_policies(db: Session, fw_id: int) -> list[PolicyOut]:
-    """List all policies belonging to a firewall."""
-    fw = db.get(Firewall, fw_id)
-    if not fw:
+def list_policies(
+    db: Session, fw_id: int, fields: FieldSpec | None = None
+) -> list[PolicyOut]:
+    """
+    List all policies belonging to a firewall.
+    With ``fields``, only the requested columns are loaded and rules are not
+    queried unless requested.
+    """
+    if db.get(Firewall, fw_id) is None:
         logger.error(f"Firewall not found for listing policies: id={fw_id}")
         raise ValueError("Firewall not found")
-    policies = fw.policies
+    # Load every policy's rules up front instead of one query per policy
+    policies = db.scalars(
+        select(FilteringPolicy)
+        .where(FilteringPolicy.firewall_id == fw_id)
+        .order_by(FilteringPolicy.id)
+        .options(*policy_loaders(fields))
+    ).all()
     logger.info(f"Listing {len(policies)} policies for firewall id={fw_id}")
-    return [PolicyOut.model_validate(p) for p in policies]
+    return [build(PolicyOut, p, fields) for p in policies]
 
 
 def delete_policy(db: Session, policy_id: int) -> bool:
-    """Delete a policy by ID."""
-    p = db.get(FilteringPolicy, policy_id)
-    if not p:
+    """
+    Delete a policy by ID.
+    Rules are removed by the database through ON DELETE CASCADE.
+    """
+    policy = db.get(FilteringPolicy, policy_id)
+    if not policy:
         logger.warning(f"Delete failed: policy not found id={policy_id}")
         return False
-    db.delete(p)
+    fw_id = policy.firewall_id
+    removed = policy_rule_counts(db, policy)
+    db.execute(delete(FilteringPolicy).where(FilteringPolicy.id == policy_id))
+    adjust_firewall_stats(db, fw_id, removed=removed, policies=-1)
+    bump_firewall_version(db, fw_id)
     db.commit()
     logger.info(f"Policy deleted: id={policy_id}")
     return True
@@ -4,14 +4,32 @@ Service layer for Firewall Rule operations.
 
 import logging
 
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from app.models.firewall import Firewall
 from app.models.policy import FilteringPolicy
 from app.models.rule import Rule
+from app.models.template import TemplateRule
 from app.schemas.rule import RuleOut
+from app.services.canonical import DuplicateRuleError, canonicalize_rule, dedupe_rules
+from app.services.fields import FieldSpec, build, effective_rules
+from app.services.firewall import bump_firewall_version
+from app.services.firewall_stats import (
+    adjust_firewall_stats,
+    count_rules,
+    policy_rule_counts,
+)
+from app.services.template import materialize_policy
+from app.sharding import is_template_rule
 
 logger = logging.getLogger(__name__)
 
+# Rules deleted or inserted per statement by bulk operations, which report
+# progress after each chunk
+CHUNK_SIZE = 10_000
+
 
 def add_rule(
     db: Session,
@@ -21,38 +39,218 @@ def add_rule(
     dst: str | None = None,
     protocol: str | None = None,
 ) -> RuleOut:
-    """Add a new rule to a policy."""
+    """
+    Add a new rule to a policy.
+    The rule is stored in canonical form; adding a rule whose content already
+    exists in the policy raises DuplicateRuleError carrying the existing rule.
+    """
     logger.info(f"Adding rule to policy id={policy_id}, action={action}")
     p = db.get(FilteringPolicy, policy_id)
     if not p:
         logger.error(f"Policy not found: id={policy_id}")
         raise ValueError("Policy not found")
 
-    r = Rule(action=action, src=src, dst=dst, protocol=protocol, policy=p)
+    row = canonicalize_rule(action, src, dst, protocol)
+    if p.template_id is not None:
+        # Checked before copy-on-write, which the duplicate would roll back
+        shared = db.scalar(
+            select(TemplateRule).where(
+                TemplateRule.template_id == p.template_id,
+                TemplateRule.hash == row["hash"],
+            )
+        )
+        if shared:
+            logger.warning(
+                f"Duplicate rule for policy id={policy_id}: template rule "
+                f"id={shared.id}"
+            )
+            raise DuplicateRuleError(
+                "Rule already exists in policy", RuleOut.model_validate(shared)
+            )
+    materialize_policy(db, p)
+    r = Rule(**row, policy=p)
     db.add(r)
-    db.commit()
+    try:
+        adjust_firewall_stats(db, p.firewall_id, count_rules([row]))
+        bump_firewall_version(db, p.firewall_id)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = db.scalar(
+            select(Rule).where(Rule.policy_id == policy_id, Rule.hash == row["hash"])
+        )
+        if existing is None:
+            # Not a duplicate, e.g. the policy was deleted concurrently
+            logger.error(f"Adding rule to policy id={policy_id} failed")
+            raise ValueError("Policy not found")
+        logger.warning(f"Duplicate rule for policy id={policy_id}: id={existing.id}")
+        raise DuplicateRuleError(
+            "Rule already exists in policy", RuleOut.model_validate(existing)
+        )
     db.refresh(r)
     logger.info(f"Rule created with id={r.id} for policy id={policy_id}")
     return RuleOut.model_validate(r)  # <- Pydantic v2
 
 
-def list_rules(db: Session, policy_id: int) -> list[RuleOut]:
-    """List all rules for a policy."""
+def list_rules(
+    db: Session, policy_id: int, fields: FieldSpec | None = None
+) -> list[RuleOut]:
+    """List all rules for a policy, limited to ``fields`` if given."""
     p = db.get(FilteringPolicy, policy_id)
     if not p:
         logger.error(f"Policy not found for listing rules: id={policy_id}")
         raise ValueError("Policy not found")
-    logger.info(f"Listing {len(p.rules)} rules for policy id={policy_id}")
-    return [RuleOut.model_validate(r) for r in p.rules]
+    if fields is None:
+        rules = p.effective_rules
+    else:
+        rules = effective_rules(db, p, fields)
+    logger.info(f"Listing {len(rules)} rules for policy id={policy_id}")
+    return [build(RuleOut, r, fields) for r in rules]
+
+
+def policy_firewall_version(db: Session, policy_id: int) -> int | None:
+    """Version of the firewall owning a policy, or None if the policy is missing."""
+    return db.scalar(
+        select(Firewall.version)
+        .join(FilteringPolicy, FilteringPolicy.firewall_id == Firewall.id)
+        .where(FilteringPolicy.id == policy_id)
+    )
 
 
 def delete_rule(db: Session, rule_id: int) -> bool:
-    """Delete a rule by ID."""
+    """
+    Delete a rule by ID.
+    Template rules are shared by every policy attached to their template and
+    raise ValueError: delete them from a policy with delete_rules.
+    """
+    if is_template_rule(rule_id):
+        logger.error(f"Delete failed: id={rule_id} is a template rule")
+        raise ValueError(
+            "Rule belongs to a template; delete it through the policy's rules"
+        )
     r = db.get(Rule, rule_id)
     if not r:
         logger.warning(f"Delete failed: rule not found id={rule_id}")
         return False
+    fw_id = r.policy.firewall_id
     db.delete(r)
+    adjust_firewall_stats(
+        db, fw_id, removed=count_rules([{"action": r.action, "protocol": r.protocol}])
+    )
+    bump_firewall_version(db, fw_id)
     db.commit()
     logger.info(f"Rule deleted: id={rule_id}")
     return True
+
+
+def delete_rules(
+    db: Session,
+    policy_id: int,
+    rule_ids: list[int] | None = None,
+    all_rules: bool = False,
+    progress=None,
+) -> int:
+    """
+    Delete rules of a policy with set-based statements.
+    Listed ``rule_ids`` are deleted CHUNK_SIZE at a time; emptying the policy
+    takes ``all_rules=True`` instead, in one statement. On a template-backed
+    policy the IDs refer to template rules and the policy gets its own copy
+    of the remaining ones. ``progress(done, total)`` is called after each
+    statement, before the commit.
+    Returns the number of deleted rows.
+    """
+    if (rule_ids is None) == (not all_rules):
+        raise ValueError("Pass either rule IDs or all_rules")
+    p = db.get(FilteringPolicy, policy_id)
+    if not p:
+        logger.error(f"Policy not found for bulk delete: id={policy_id}")
+        raise ValueError("Policy not found")
+
+    if rule_ids is not None and not rule_ids:
+        return 0
+    removed = policy_rule_counts(db, p, rule_ids)
+    if p.template_id is not None:
+        # Copy-on-write: keep every template rule except the deleted ones
+        deleted = materialize_policy(db, p, exclude=rule_ids)
+        adjust_firewall_stats(db, p.firewall_id, removed=removed)
+        bump_firewall_version(db, p.firewall_id)
+        if progress:
+            progress(deleted, deleted)
+        db.commit()
+        logger.info(f"Deleted {deleted} template rules from policy id={policy_id}")
+        return deleted
+
+    stmt = (
+        delete(Rule)
+        .where(Rule.policy_id == policy_id)
+        .execution_options(synchronize_session=False)
+    )
+    if rule_ids is None:
+        deleted = db.execute(stmt).rowcount
+        if progress:
+            progress(deleted, deleted)
+    else:
+        deleted = 0
+        for i in range(0, len(rule_ids), CHUNK_SIZE):
+            chunk = rule_ids[i : i + CHUNK_SIZE]
+            deleted += db.execute(stmt.where(Rule.id.in_(chunk))).rowcount
+            if progress:
+                progress(i + len(chunk), len(rule_ids))
+    if deleted:
+        adjust_firewall_stats(db, p.firewall_id, removed=removed)
+        bump_firewall_version(db, p.firewall_id)
+    db.commit()
+    db.expire(p, ["rules"])
+    logger.info(f"Deleted {deleted} rules from policy id={policy_id}")
+    return deleted
+
+
+def replace_rules(
+    db: Session,
+    policy_id: int,
+    rules: list[dict],
+    on_duplicate: str = "reject",
+    progress=None,
+) -> dict:
+    """
+    Atomically replace every rule of a policy.
+    Existing rules are removed with one DELETE and the new set is written with
+    bulk INSERTs of CHUNK_SIZE rows inside the same transaction. Duplicate
+    rules in the new set raise DuplicateRuleError, or are skipped and counted
+    when ``on_duplicate`` is "report". ``progress(done, total)`` is called
+    after each chunk with the number of rules written.
+    """
+    p = db.get(FilteringPolicy, policy_id)
+    if not p:
+        logger.error(f"Policy not found for rule replace: id={policy_id}")
+        raise ValueError("Policy not found")
+
+    rows, duplicates = dedupe_rules(rules, on_duplicate, policy_id=policy_id)
+    try:
+        removed = policy_rule_counts(db, p)
+        deleted = materialize_policy(db, p, exclude=None)
+        deleted += db.execute(
+            delete(Rule)
+            .where(Rule.policy_id == policy_id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        for i in range(0, len(rows), CHUNK_SIZE):
+            chunk = rows[i : i + CHUNK_SIZE]
+            db.execute(insert(Rule.__table__), chunk)
+            if progress:
+                progress(i + len(chunk), len(rows))
+        if progress and not rows:
+            progress(0, 0)
+        adjust_firewall_stats(db, p.firewall_id, count_rules(rows), removed)
+        bump_firewall_version(db, p.firewall_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.error(f"Rule replace failed for policy id={policy_id}")
+        raise
+    db.expire(p, ["rules"])
+    logger.info(
+        f"Replaced rules of policy id={policy_id}: deleted={deleted}, "
+        f"created={len(rows)}, duplicates={duplicates}"
+    )
+    return {"deleted": deleted, "created": len(rows), "duplicates": duplicates}
@@ -0,0 +1,249 @@
+"""
+Service layer for rule hit counters.
+Hits are aggregated in memory per worker and flushed to the rule_stats table
+in batched upserts instead of one write per hit, by a background flusher
+every flush interval and at exit, or sooner when many rules are pending.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, load_only
+
+from app.db import db as _db
+from app.db import dialect_insert
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.models.rule_stat import RuleStat
+from app.schemas.rule import RuleStatsOut
+from app.services.fields import FieldSpec, build, columns, effective_rules
+from app.sharding import group_by_shard, is_template_rule
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+
+class HitCounter:
+    """Thread-safe in-memory aggregation of hit counts keyed by rule id."""
+
+    def __init__(self, flush_interval: float = 5.0, max_pending: int = 10_000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending: dict[int, int] = {}
+        self._last_flush = time.monotonic()
+
+    def record(self, hits: dict[int, int]) -> None:
+        """Add a batch of hit counts."""
+        with self._lock:
+            pending = self._pending
+            for rule_id, count in hits.items():
+                if count:
+                    pending[rule_id] = pending.get(rule_id, 0) + count
+
+    def __len__(self) -> int:
+        """Number of rules with pending hits."""
+        return len(self._pending)
+
+    def pending(self, rule_id: int) -> int:
+        """Hits recorded for a rule but not flushed yet."""
+        return self._pending.get(rule_id, 0)
+
+    def flush_due(self) -> bool:
+        """Whether the flush interval elapsed or too many rules are pending."""
+        return (
+            len(self._pending) >= self.max_pending
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def drain(self) -> dict[int, int]:
+        """Take every pending count, leaving the counter empty."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        return pending
+
+
+hit_counter = HitCounter()
+
+
+def flush_hits(db: Session, counter: HitCounter = hit_counter) -> int:
+    """
+    Upsert pending hit counts into rule_stats in batches.
+    Counts for rules that no longer exist are dropped. Returns the number of
+    rules written.
+    """
+    pending = counter.drain()
+    if not pending:
+        return 0
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    written = 0
+    # Each batch is written to the single shard holding its rules
+    chunks = [
+        ids[i : i + FLUSH_BATCH_SIZE]
+        for ids in group_by_shard(pending).values()
+        for i in range(0, len(ids), FLUSH_BATCH_SIZE)
+    ]
+    try:
+        for chunk in chunks:
+            existing = db.scalars(select(Rule.id).where(Rule.id.in_(chunk))).all()
+            if not existing:
+                continue
+            stmt = dialect_insert(db, RuleStat.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[RuleStat.rule_id],
+                set_={
+                    "hits": RuleStat.hits + stmt.excluded.hits,
+                    "last_hit": stmt.excluded.last_hit,
+                },
+            )
+            db.execute(
+                stmt,
+                [
+                    {"rule_id": rule_id, "hits": pending[rule_id], "last_hit": now}
+                    for rule_id in existing
+                ],
+            )
+            written += len(existing)
+        db.commit()
+    except Exception:
+        db.rollback()
+        counter.record(pending)
+        logger.exception("Flushing rule hit counters failed; counts re-queued")
+        raise
+    logger.info(f"Flushed hit counters for {written} rules")
+    return written
+
+
+class HitFlusher:
+    """
+    Daemon thread flushing a counter every flush interval in an app context,
+    so counts reach the database even when no more hits arrive. Started by
+    the first ingest of a worker process; stopping it flushes what is left.
+    """
+
+    def __init__(self, app, counter: HitCounter = hit_counter):
+        self.app = app
+        self.counter = counter
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Start the thread unless running; also flush at interpreter exit."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="hit-flusher", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.counter.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """Flush pending counts in a fresh session. Returns rules written."""
+        if not len(self.counter):
+            return 0
+        with self.app.app_context():
+            try:
+                return flush_hits(_db.session, self.counter)
+            except Exception:
+                # Counts are re-queued and retried at the next interval
+                return 0
+            finally:
+                _db.session.remove()
+
+    def stop(self) -> None:
+        """Stop the thread and flush the remaining counts."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+            atexit.unregister(self.stop)
+        self.flush()
+
+
+def init_hit_flusher(app) -> HitFlusher:
+    """Attach the flusher of the shared hit counter to the app."""
+    flusher = HitFlusher(app)
+    app.extensions["hit_flusher"] = flusher
+    return flusher
+
+
+def ingest_hits(
+    db: Session, hits: dict[int, int], counter: HitCounter = hit_counter
+) -> bool:
+    """
+    Record a batch of hit counts, flushing to the database when due.
+    Raises ValueError, recording nothing, if a rule ID is a template rule:
+    those are shared by every attached policy and have no counters.
+    Returns whether a flush happened.
+    """
+    shared = sorted(rule_id for rule_id in hits if is_template_rule(rule_id))
+    if shared:
+        raise ValueError(f"Template rules have no hit counters: {shared}")
+    counter.record(hits)
+    if counter.flush_due():
+        flush_hits(db, counter)
+        return True
+    return False
+
+
+def _with_stats(rule, fields: FieldSpec | None, hits: int, last_hit):
+    stats = {"hits": hits, "last_hit": last_hit}
+    if fields is None:
+        return RuleStatsOut.model_validate(rule).model_copy(update=stats)
+    rule_fields = {k: v for k, v in fields.items() if k not in stats}
+    return build(RuleStatsOut, rule, rule_fields).model_copy(
+        update={k: v for k, v in stats.items() if k in fields}
+    )
+
+
+def list_rules_with_stats(
+    db: Session,
+    policy_id: int,
+    counter: HitCounter = hit_counter,
+    fields: FieldSpec | None = None,
+) -> list[RuleStatsOut]:
+    """
+    List the rules of a policy with stored plus pending hit counts, limited
+    to ``fields`` if given.
+    """
+    p = db.get(FilteringPolicy, policy_id)
+    if not p:
+        logger.error(f"Policy not found for listing rule stats: id={policy_id}")
+        raise ValueError("Policy not found")
+
+    if p.template_id is not None:
+        # Template rules are shared and have no per-policy counters
+        if fields is None:
+            return [RuleStatsOut.model_validate(r) for r in p.effective_rules]
+        rules = effective_rules(db, p, fields)
+        return [_with_stats(r, fields, 0, None) for r in rules]
+    stmt = (
+        select(Rule, RuleStat.hits, RuleStat.last_hit)
+        .outerjoin(RuleStat, RuleStat.rule_id == Rule.id)
+        .where(Rule.policy_id == policy_id)
+        .order_by(Rule.id)
+    )
+    if fields is not None:
+        stmt = stmt.options(load_only(*columns(Rule, fields)))
+    rows = db.execute(stmt).all()
+    logger.info(f"Listing {len(rows)} rules with stats for policy id={policy_id}")
+    return [
+        _with_stats(rule, fields, (hits or 0) + counter.pending(rule.id), last_hit)
+        for rule, hits, last_hit in rows
+    ]
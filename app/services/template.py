@@ -0,0 +1,317 @@
+"""
+Service layer for policy templates.
+Firewalls attach a template by reference through a policy; the policy copies
+the template's rules only when it is customized (copy-on-write). Compiled
+rulesets are cached per template version so one compile serves every
+firewall using it.
+"""
+
+import logging
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, load_only, selectinload
+
+from app.db import dialect_insert
+from app.models.firewall import Firewall
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.models.template import PolicyTemplate, TemplateRule
+from app.schemas.policy import PolicyOut
+from app.schemas.template import TemplateOut
+from app.services.canonical import dedupe_rules
+from app.services.evaluation import CompiledRuleset, compile_rules, ruleset_cache
+from app.services.fields import FieldSpec, build, columns
+from app.services.firewall import bump_firewall_version
+from app.services.firewall_stats import (
+    adjust_firewall_stats,
+    adjust_template_stats,
+    count_rules,
+    template_rule_counts,
+)
+from app.sharding import PRIMARY, shard_ids
+
+logger = logging.getLogger(__name__)
+
+RULE_COLUMNS = ("action", "src", "dst", "protocol", "hash")
+
+
+def _replicate_template(db: Session, template_id: int) -> None:
+    """
+    Copy a template and its rules from the primary to every other shard, so
+    policies on any shard can reference it. A template missing from the
+    primary is removed from the replicas. Does not commit.
+    """
+    replicas = [shard for shard in shard_ids(db) if shard != PRIMARY]
+    if not replicas:
+        return
+    db.flush()
+    template = db.execute(
+        select(PolicyTemplate.__table__).where(PolicyTemplate.id == template_id)
+    ).first()
+    rules = [
+        row._asdict()
+        for row in db.execute(
+            select(TemplateRule.__table__).where(
+                TemplateRule.template_id == template_id
+            )
+        )
+    ]
+    for shard in replicas:
+        on_shard = {"bind_arguments": {"shard_id": shard}}
+        db.execute(
+            delete(TemplateRule.__table__).where(
+                TemplateRule.template_id == template_id
+            ),
+            **on_shard,
+        )
+        if template is None:
+            db.execute(
+                delete(PolicyTemplate.__table__).where(
+                    PolicyTemplate.id == template_id
+                ),
+                **on_shard,
+            )
+            continue
+        stmt = dialect_insert(db, PolicyTemplate.__table__).values(template._asdict())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PolicyTemplate.id],
+            set_={"name": stmt.excluded.name, "version": stmt.excluded.version},
+        )
+        db.execute(stmt, **on_shard)
+        if rules:
+            db.execute(insert(TemplateRule.__table__), rules, **on_shard)
+
+
+def create_template(
+    db: Session, name: str, rules: list[dict], on_duplicate: str = "reject"
+) -> TemplateOut:
+    """Create a template with its rules."""
+    logger.info(f"Creating template with name={name}")
+    template = PolicyTemplate(name=name, version=1)
+    db.add(template)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        logger.error(f"Template creation failed: name '{name}' already exists")
+        raise ValueError("Template with that name already exists")
+    try:
+        rows, _ = dedupe_rules(rules or [], on_duplicate, template_id=template.id)
+    except ValueError:
+        db.rollback()
+        raise
+    if rows:
+        db.execute(insert(TemplateRule.__table__), rows)
+    _replicate_template(db, template.id)
+    db.commit()
+    db.refresh(template)
+    logger.info(f"Template created with id={template.id} and {len(rows)} rules")
+    return TemplateOut.model_validate(template)
+
+
+def _template_loaders(fields: FieldSpec | None) -> list:
+    """Loader options fetching only what a template field spec needs."""
+    if fields is None:
+        return []
+    options = [load_only(*columns(PolicyTemplate, fields))]
+    if "rules" in fields:
+        rules = selectinload(PolicyTemplate.rules)
+        if fields["rules"] is not None:
+            rules = rules.load_only(*columns(TemplateRule, fields["rules"]))
+        options.append(rules)
+    return options
+
+
+def list_templates(db: Session, fields: FieldSpec | None = None) -> list[TemplateOut]:
+    """List all templates, limited to ``fields`` if given."""
+    templates = db.scalars(
+        select(PolicyTemplate)
+        .order_by(PolicyTemplate.id)
+        .options(*_template_loaders(fields))
+    ).all()
+    logger.info(f"Listing {len(templates)} templates")
+    return [build(TemplateOut, t, fields) for t in templates]
+
+
+def get_template(
+    db: Session, template_id: int, fields: FieldSpec | None = None
+) -> TemplateOut | None:
+    """Retrieve a template by ID, limited to ``fields`` if given."""
+    if fields is None:
+        template = db.get(PolicyTemplate, template_id)
+    else:
+        template = db.scalars(
+            select(PolicyTemplate)
+            .where(PolicyTemplate.id == template_id)
+            .options(*_template_loaders(fields))
+        ).first()
+    if not template:
+        logger.warning(f"Template not found: id={template_id}")
+        return None
+    return build(TemplateOut, template, fields)
+
+
+def update_template_rules(
+    db: Session, template_id: int, rules: list[dict], on_duplicate: str = "reject"
+) -> TemplateOut | None:
+    """
+    Replace the rules of a template and bump its version.
+    Every policy attached by reference sees the new rules.
+    """
+    template = db.get(PolicyTemplate, template_id)
+    if not template:
+        logger.warning(f"Template update failed: not found id={template_id}")
+        return None
+    rows, _ = dedupe_rules(rules or [], on_duplicate, template_id=template_id)
+    removed = template_rule_counts(db, template_id)
+    db.execute(
+        delete(TemplateRule)
+        .where(TemplateRule.template_id == template_id)
+        .execution_options(synchronize_session=False)
+    )
+    if rows:
+        db.execute(insert(TemplateRule.__table__), rows)
+    template.version += 1
+    adjust_template_stats(db, template_id, count_rules(rows), removed)
+    db.execute(
+        update(Firewall)
+        .where(
+            Firewall.id.in_(
+                select(FilteringPolicy.firewall_id).where(
+                    FilteringPolicy.template_id == template_id
+                )
+            )
+        )
+        .values(version=Firewall.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    _replicate_template(db, template_id)
+    db.commit()
+    db.refresh(template)
+    db.expire(template, ["rules"])
+    logger.info(f"Template id={template_id} updated to version {template.version}")
+    return TemplateOut.model_validate(template)
+
+
+def delete_template(db: Session, template_id: int) -> bool:
+    """
+    Delete a template by ID.
+    Raises ValueError while policies still reference it.
+    """
+    # One count per shard
+    attached = sum(
+        db.scalars(
+            select(func.count())
+            .select_from(FilteringPolicy)
+            .where(FilteringPolicy.template_id == template_id)
+        )
+    )
+    if attached:
+        logger.error(f"Template id={template_id} is attached to {attached} policies")
+        raise ValueError("Template is attached to policies")
+    result = db.execute(delete(PolicyTemplate).where(PolicyTemplate.id == template_id))
+    if not result.rowcount:
+        db.rollback()
+        logger.warning(f"Delete failed: template not found id={template_id}")
+        return False
+    _replicate_template(db, template_id)
+    db.commit()
+    logger.info(f"Template deleted: id={template_id}")
+    return True
+
+
+def attach_template(
+    db: Session, fw_id: int, template_id: int, name: str | None = None
+) -> PolicyOut:
+    """Add a policy to a firewall that shares a template's rules by reference."""
+    fw = db.get(Firewall, fw_id)
+    if not fw:
+        logger.error(f"Firewall not found: id={fw_id}")
+        raise ValueError("Firewall not found")
+    template = db.get(PolicyTemplate, template_id)
+    if not template:
+        logger.error(f"Template not found: id={template_id}")
+        raise ValueError("Template not found")
+
+    policy = FilteringPolicy(
+        name=name or template.name, firewall=fw, template_id=template_id
+    )
+    db.add(policy)
+    adjust_firewall_stats(db, fw_id, template_rule_counts(db, template_id), policies=1)
+    bump_firewall_version(db, fw_id)
+    db.commit()
+    db.refresh(policy)
+    logger.info(
+        f"Template id={template_id} attached to firewall id={fw_id} "
+        f"as policy id={policy.id}"
+    )
+    return PolicyOut.model_validate(policy)
+
+
+def materialize_policy(
+    db: Session, policy: FilteringPolicy, exclude: list[int] | None = ()
+) -> int:
+    """
+    Copy-on-write: give a template-backed policy its own copy of the
+    template's rules and detach it from the template. Template rules whose
+    IDs are in ``exclude`` are not copied; ``exclude=None`` copies nothing.
+    Does not commit. Returns the number of template rules left out.
+    """
+    template_id = policy.template_id
+    if template_id is None:
+        return 0
+    stmt = select(*(getattr(TemplateRule, c) for c in RULE_COLUMNS)).where(
+        TemplateRule.template_id == template_id
+    )
+    total = db.scalar(
+        select(func.count())
+        .select_from(TemplateRule)
+        .where(TemplateRule.template_id == template_id)
+    )
+    copied = 0
+    if exclude is not None:
+        if exclude:
+            stmt = stmt.where(TemplateRule.id.not_in(exclude))
+        rows = [
+            {**row._asdict(), "policy_id": policy.id}
+            for row in db.execute(stmt.order_by(TemplateRule.id))
+        ]
+        if rows:
+            db.execute(insert(Rule.__table__), rows)
+        copied = len(rows)
+    policy.template_id = None
+    db.flush()
+    db.expire(policy, ["rules", "template"])
+    logger.info(
+        f"Policy id={policy.id} detached from template id={template_id}: "
+        f"{copied} rules copied"
+    )
+    return total - copied
+
+
+def compiled_template(db: Session, template_id: int) -> CompiledRuleset:
+    """Compiled ruleset of a template, cached per template version."""
+    version = db.scalar(
+        select(PolicyTemplate.version).where(PolicyTemplate.id == template_id)
+    )
+    if version is None:
+        raise ValueError("Template not found")
+
+    def load():
+        rows = db.execute(
+            select(
+                TemplateRule.id,
+                TemplateRule.action,
+                TemplateRule.src,
+                TemplateRule.dst,
+                TemplateRule.protocol,
+            )
+            .where(TemplateRule.template_id == template_id)
+            .order_by(TemplateRule.id)
+        )
+        return [row._asdict() for row in rows]
+
+    return ruleset_cache.get_or_build(
+        ("template", template_id, version), lambda: compile_rules(load())
+    )
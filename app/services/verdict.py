@@ -0,0 +1,163 @@
+"""
+Service layer for flow verdicts.
+Traffic repeats heavily, so verdicts are cached per flow in front of rule
+evaluation, conntrack style. Keys carry the firewall version, which every
+change to the firewall, its policies, their rules or an attached template
+bumps: a cached verdict is never served for an older ruleset.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session
+
+from app.metrics import metrics
+from app.services.canonical import canonical_protocol
+from app.services.evaluation import DEFAULT_ACTION, parse_flow_address
+from app.services.firewall import firewall_version
+from app.services.rule_stats import HitCounter, hit_counter
+from app.services.simulation import compiled_firewall
+from app.sharding import is_template_rule
+
+logger = logging.getLogger(__name__)
+
+VERDICT_CACHE_SIZE = 100_000
+# Seconds a verdict is kept; entries of old versions are unreachable anyway
+VERDICT_CACHE_TTL = 300.0
+
+
+class VerdictCache:
+    """
+    Thread-safe LRU of flow verdicts with a time to live.
+    Keys are flat ``(fw_id, version, src, dst, protocol)`` tuples and values
+    ``(action, policy_id, rule_id)`` tuples.
+    """
+
+    def __init__(
+        self, max_size: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_CACHE_TTL
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, now: float | None = None) -> tuple | None:
+        """The verdict cached under ``key``, or None if missing or expired."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, verdict: tuple, now: float | None = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries[key] = (now + self.ttl, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Size, hit/miss/eviction/expiration counts and the hit ratio."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+
+verdict_cache = VerdictCache()
+
+
+def evaluate_flows(
+    db: Session,
+    fw_id: int,
+    flows: list[dict],
+    cache: VerdictCache = verdict_cache,
+    counter: HitCounter = hit_counter,
+) -> list[dict]:
+    """
+    Verdict of the firewall for each flow (src, dst, protocol), in order.
+    Cached flows cost one lookup; the firewall's compiled ruleset is only
+    loaded when a flow misses the cache. Rules do not match ports, so ports
+    are not part of the key. Each flow matching a rule counts as a hit of
+    that rule in ``counter``; template rules have no counters.
+    """
+    version = firewall_version(db, fw_id)
+    if version is None:
+        raise ValueError("Firewall not found")
+
+    ruleset = None
+    verdicts = []
+    hits: dict[int, int] = {}
+    misses = 0
+    now = time.monotonic()
+    for flow in flows:
+        src, dst = flow.get("src"), flow.get("dst")
+        protocol = canonical_protocol(flow.get("protocol"))
+        key = (fw_id, version, src, dst, protocol)
+        verdict = cache.get(key, now)
+        if verdict is None:
+            misses += 1
+            if ruleset is None:
+                ruleset = compiled_firewall(db, fw_id)
+            match = ruleset.evaluate(
+                parse_flow_address(src), parse_flow_address(dst), protocol
+            )
+            if match is None:
+                verdict = (DEFAULT_ACTION, None, None)
+            else:
+                policy_id, rule = match
+                verdict = (rule.action, policy_id, rule.id)
+            cache.put(key, verdict, now)
+        action, policy_id, rule_id = verdict
+        if rule_id is not None and not is_template_rule(rule_id):
+            hits[rule_id] = hits.get(rule_id, 0) + 1
+        verdicts.append(
+            {
+                "src": src,
+                "dst": dst,
+                "protocol": protocol,
+                "action": action,
+                "policy_id": policy_id,
+                "rule_id": rule_id,
+            }
+        )
+
+    counter.record(hits)
+    metrics.incr("verdict_cache.hit", len(flows) - misses)
+    metrics.incr("verdict_cache.miss", misses)
+    logger.info(
+        f"Evaluated {len(flows)} flows on firewall id={fw_id}: "
+        f"{len(flows) - misses} cached"
+    )
+    return verdicts
@@ -0,0 +1,289 @@
+"""
+Firewall-keyed horizontal sharding.
+Every firewall lives on one shard together with its policies, rules, rule
+stats and summary counts. IDs of those rows carry their shard in the bits
+above SHARD_SHIFT (each shard's ID sequences start at
+``shard << SHARD_SHIFT``), so any firewall, policy or rule ID resolves to
+its shard without a lookup. New firewalls are placed by a hash of their name.
+
+Shard 0 is the primary database (SQLALCHEMY_DATABASE_URI); extra shards are
+listed in SHARD_DATABASE_URIS. Unsharded tables (templates, jobs,
+idempotency keys) live on the primary, and templates are replicated to every
+shard so policies can reference them. Template rule IDs come from the range
+of a reserved shard number, apart from the rule IDs of every shard. A deployment without extra shards is a
+single shard and behaves exactly as an unsharded database.
+"""
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import BigInteger, Integer, create_engine, inspect, text
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlalchemy.sql.schema import Column
+
+PRIMARY = 0
+# IDs of sharded rows are ``shard << SHARD_SHIFT`` plus a per-shard sequence.
+# 2**40 IDs per shard; shards below 2**13 keep IDs exact as JSON numbers.
+SHARD_SHIFT = 40
+# Template rule IDs take the range of the last shard number, which no shard
+# uses, so they are never mistaken for the ID of a rule on any shard
+TEMPLATE_RULE_SHARD = (1 << 13) - 1
+
+# Type of shard-encoded ID columns (SQLite integers are always 64-bit)
+ShardedId = BigInteger().with_variant(Integer, "sqlite")
+
+# Sharded tables and their columns holding a shard-encoded ID
+SHARD_KEY_COLUMNS = {
+    "firewalls": ("id",),
+    "policies": ("id", "firewall_id"),
+    "rules": ("id", "policy_id"),
+    "rule_stats": ("rule_id",),
+    "firewall_stats": ("firewall_id",),
+    "firewall_rule_counts": ("firewall_id",),
+}
+# Tables whose ID sequences are offset per shard
+SEQUENCE_TABLES = ("firewalls", "policies", "rules")
+# Relationship to the parent row deciding the shard of a new row
+_PARENTS = {"policies": "firewall", "rules": "policy", "rule_stats": "rule"}
+
+_executor = ThreadPoolExecutor(thread_name_prefix="shard")
+
+
+def shard_of(row_id: int) -> int:
+    """Shard holding a firewall, policy or rule ID."""
+    return row_id >> SHARD_SHIFT
+
+
+def is_template_rule(rule_id: int) -> bool:
+    """Whether a rule ID is the ID of a template rule."""
+    return shard_of(rule_id) == TEMPLATE_RULE_SHARD
+
+
+def shard_for_name(name: str, count: int) -> int:
+    """Shard a new firewall with this name is placed on."""
+    return zlib.crc32(name.encode()) % count
+
+
+def group_by_shard(ids) -> dict[int, list[int]]:
+    """Split firewall, policy or rule IDs by shard."""
+    groups: dict[int, list[int]] = {}
+    for row_id in ids:
+        groups.setdefault(shard_of(row_id), []).append(row_id)
+    return groups
+
+
+def _state_shard(state):
+    if state.key is not None:
+        return state.key[2]
+    return state.identity_token
+
+
+def _criteria_shards(statement, parameters) -> set[int] | None:
+    """
+    Shards selected by the top-level AND criteria of a statement, from
+    equality and IN comparisons on shard-key columns with bound values.
+    None when the criteria do not restrict the shards.
+    """
+    if not isinstance(parameters, dict):
+        parameters = {}
+    where = getattr(statement, "whereclause", None)
+    if where is None:
+        return None
+    if isinstance(where, BooleanClauseList) and where.operator is operators.and_:
+        clauses = where.clauses
+    else:
+        clauses = [where]
+    shards = None
+    for clause in clauses:
+        if not isinstance(clause, BinaryExpression):
+            continue
+        col, value = clause.left, clause.right
+        if not (
+            isinstance(col, Column)
+            and col.name in SHARD_KEY_COLUMNS.get(getattr(col.table, "name", ""), ())
+            and isinstance(value, BindParameter)
+        ):
+            continue
+        bound = parameters.get(value.key, value.effective_value)
+        if clause.operator is operators.eq:
+            values = [bound]
+        elif clause.operator is operators.in_op:
+            values = bound or []
+        else:
+            continue
+        found = {shard_of(v) for v in values if isinstance(v, int)}
+        shards = found if shards is None else shards & found
+    return shards
+
+
+class ShardedFlaskSession(ShardedSession):
+    """
+    Flask-SQLAlchemy session routing statements to the shards of the current
+    app. Statements not tied to a mapped class (text, DDL) run on the primary.
+    """
+
+    def __init__(self, db, **kwargs):
+        self.shards = {PRIMARY: db.engine, **current_app.extensions.get("shards", {})}
+        # Attributes of flask_sqlalchemy.session.Session used by its signals
+        self._db = db
+        self._model_changes = {}
+        super().__init__(
+            shard_chooser=self._shard_for_instance,
+            identity_chooser=self._shards_for_identity,
+            execute_chooser=self._shards_for_statement,
+            shards=self.shards,
+            **kwargs,
+        )
+        # Reachable through scoped_session proxies, unlike attributes
+        self.info["shards"] = self.shards
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = PRIMARY
+        return super().get_bind(
+            mapper, shard_id=shard_id, instance=instance, clause=clause, **kw
+        )
+
+    def _shard_for_instance(self, mapper, instance, clause=None, **kw):
+        table = mapper.local_table.name
+        if table not in SHARD_KEY_COLUMNS or len(self.shards) == 1:
+            return PRIMARY
+        if instance is None:
+            raise ValueError(f"Cannot choose a shard for a statement on {table}")
+        for name in SHARD_KEY_COLUMNS[table]:
+            value = getattr(instance, name, None)
+            if value is not None:
+                return shard_of(value)
+        parent = getattr(instance, _PARENTS.get(table, ""), None)
+        if parent is not None:
+            shard = _state_shard(inspect(parent))
+            if shard is not None:
+                return shard
+        if table == "firewalls":
+            return shard_for_name(instance.name, len(self.shards))
+        raise ValueError(f"Cannot choose a shard for a new {mapper.class_.__name__}")
+
+    def _shards_for_identity(self, mapper, primary_key, **kw):
+        if mapper.local_table.name not in SHARD_KEY_COLUMNS:
+            return [PRIMARY]
+        shard = shard_of(primary_key[0])
+        return [shard] if shard in self.shards else []
+
+    def _shards_for_statement(self, orm_context):
+        if len(self.shards) == 1:
+            return [PRIMARY]
+        statement = orm_context.statement
+        if statement.is_dml:
+            # Also covers Core DML on tables, used for multi-row writes since
+            # ORM bulk writes cannot be sharded
+            table = statement.table.name
+        else:
+            mapper = orm_context.bind_mapper
+            table = mapper.local_table.name if mapper is not None else None
+        if table not in SHARD_KEY_COLUMNS:
+            return [PRIMARY]
+        if statement.is_insert:
+            return [self._shard_for_rows(table, orm_context.parameters)]
+        if orm_context.is_select and orm_context.lazy_loaded_from is not None:
+            return [_state_shard(orm_context.lazy_loaded_from)]
+        shards = _criteria_shards(statement, orm_context.parameters)
+        if shards is None:
+            return list(self.shards)
+        # No shard can match, e.g. an empty IN list or IDs of unknown shards
+        return sorted(shards & set(self.shards)) or [PRIMARY]
+
+    def _shard_for_rows(self, table: str, parameters) -> int:
+        rows = parameters if isinstance(parameters, list) else [parameters or {}]
+        shards = set()
+        for row in rows:
+            for name in SHARD_KEY_COLUMNS[table]:
+                if row.get(name) is not None:
+                    shards.add(shard_of(row[name]))
+                    break
+            else:
+                if table != "firewalls" or "name" not in row:
+                    raise ValueError(f"Cannot choose a shard for rows of {table}")
+                shards.add(shard_for_name(row["name"], len(self.shards)))
+        if len(shards) != 1:
+            raise ValueError(f"Insert into {table} spans several shards")
+        return shards.pop()
+
+
+def shard_ids(db: Session) -> list[int]:
+    """Shards the session routes to, the primary first."""
+    return list(db.info.get("shards", (PRIMARY,)))
+
+
+def shard_count(db: Session) -> int:
+    """Number of shards the session routes to."""
+    return len(shard_ids(db))
+
+
+def fan_out(db: Session, fn) -> list:
+    """
+    Call ``fn(session)`` once per shard and return the results in shard
+    order. With several shards the calls run in parallel, each on its own
+    session (so they only see committed rows); a single shard uses ``db``.
+    """
+    shards = db.info.get("shards")
+    if not shards or len(shards) == 1:
+        return [fn(db)]
+
+    def run(engine):
+        with Session(engine) as session:
+            return fn(session)
+
+    return list(_executor.map(run, shards.values()))
+
+
+def configure_shards(app) -> dict:
+    """
+    Create the engines of the extra shards in SHARD_DATABASE_URIS, numbered
+    from 1. They are not Flask-SQLAlchemy binds: binds get their own metadata,
+    while every shard holds the full schema.
+    """
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    uris = app.config.get("SHARD_DATABASE_URIS") or []
+    shards = {
+        shard: create_engine(uri, **options) for shard, uri in enumerate(uris, start=1)
+    }
+    app.extensions["shards"] = shards
+    return shards
+
+
+def prepare_shard(engine, metadata, shard: int) -> None:
+    """
+    Create the schema on a shard and start its ID sequences at its range,
+    and the template rule sequence at the reserved template rule range.
+    """
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        if shard != PRIMARY:
+            for table in SEQUENCE_TABLES:
+                _start_sequence(conn, table, shard << SHARD_SHIFT)
+        _start_sequence(conn, "template_rules", TEMPLATE_RULE_SHARD << SHARD_SHIFT)
+
+
+def _start_sequence(conn, table: str, base: int) -> None:
+    """Make the ID sequence of ``table`` continue from at least ``base``."""
+    if conn.dialect.name == "sqlite":
+        conn.execute(
+            text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :base "
+                "WHERE NOT EXISTS "
+                "(SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+            ),
+            {"name": table, "base": base},
+        )
+    elif conn.dialect.name == "postgresql":
+        conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"GREATEST(:base, (SELECT COALESCE(MAX(id), 0) FROM {table})))"
+            ),
+            {"base": base},
+        )
@@ -0,0 +1,97 @@
+"""
+Benchmark dumping and restoring an archive against the number of rules.
+
+Rows are streamed in chunks, so memory stays flat while wall time grows
+linearly, apart from rebuilding the indexes. Each run projects the restore
+time of TARGET_RULES from its rate, and the benchmark fails if the largest
+run, by default TARGET_RULES itself, misses TARGET_SECONDS.
+
+Usage:
+    python -m benchmarks.bench_archive [rule counts...]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import insert
+
+from app import create_app
+from app.db import db
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.services.archive import dump_archive, restore_archive
+from app.services.canonical import canonicalize_rule
+from app.services.firewall import create_firewall
+
+# A full fleet must restore in under a minute
+TARGET_RULES = 10_000_000
+TARGET_SECONDS = 60
+DEFAULT_COUNTS = [100_000, 1_000_000, TARGET_RULES]
+POLICIES = 10
+SEED_BATCH = 50_000
+
+
+def seed(session, rule_count: int) -> None:
+    """One firewall with POLICIES policies sharing ``rule_count`` rules."""
+    fw = create_firewall(session, "bench")
+    policy_ids = []
+    for i in range(POLICIES):
+        p = FilteringPolicy(name=f"p{i}", firewall_id=fw.id)
+        session.add(p)
+        session.flush()
+        policy_ids.append(p.id)
+    for start in range(0, rule_count, SEED_BATCH):
+        rows = [
+            {
+                **canonicalize_rule(
+                    "allow", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+                ),
+                "policy_id": policy_ids[i % POLICIES],
+            }
+            for i in range(start, min(start + SEED_BATCH, rule_count))
+        ]
+        session.execute(insert(Rule.__table__), rows)
+    session.commit()
+
+
+def main(counts: list[int]) -> None:
+    print(
+        f"{'rules':>10} {'dump s':>8} {'restore s':>10} {'MiB':>8} "
+        f"{'rules/s':>10} {'target s':>9}"
+    )
+    projections = {}
+    for n in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/a.db"})
+            target = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/b.db"})
+            path = os.path.join(tmp, "fleet.jsonl.gz")
+            with source.app_context():
+                seed(db.session, n)
+                start = time.perf_counter()
+                with open(path, "wb") as f:
+                    dump_archive(db.session, f)
+                dumped = time.perf_counter() - start
+            with target.app_context():
+                start = time.perf_counter()
+                with open(path, "rb") as f:
+                    restore_archive(db.session, f)
+                restored = time.perf_counter() - start
+            size = os.path.getsize(path) / 2**20
+            rate = n / max(dumped, restored)
+            projected = restored * TARGET_RULES / n
+            projections[n] = projected
+            print(
+                f"{n:>10} {dumped:>8.2f} {restored:>10.2f} {size:>8.1f} "
+                f"{rate:>10.0f} {projected:>9.1f}"
+            )
+    projected = projections[max(projections)]
+    assert projected < TARGET_SECONDS, (
+        f"Restoring {TARGET_RULES} rules would take {projected:.0f}s, "
+        f"over the {TARGET_SECONDS}s target"
+    )
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or DEFAULT_COUNTS)
@@ -0,0 +1,70 @@
+"""
+Benchmark firewall deletion against the number of child rules.
+
+Deletion relies on ON DELETE CASCADE, so wall time should grow only with the
+work the database does and Python memory should stay flat regardless of how
+many policies and rules hang off the firewall.
+
+Usage:
+    python -m benchmarks.bench_cascade_delete [rule counts...]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from sqlalchemy import insert
+
+from app import create_app
+from app.db import db
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.services.canonical import canonicalize_rule
+from app.services.firewall import create_firewall, delete_firewall
+
+DEFAULT_COUNTS = [1_000, 10_000, 100_000, 200_000]
+POLICIES = 10
+
+
+def seed(session, name: str, rule_count: int) -> int:
+    """Create a firewall with POLICIES policies sharing ``rule_count`` rules."""
+    fw = create_firewall(session, name)
+    policy_ids = []
+    for i in range(POLICIES):
+        p = FilteringPolicy(name=f"p{i}", firewall_id=fw.id)
+        session.add(p)
+        session.flush()
+        policy_ids.append(p.id)
+    rows = [
+        {
+            **canonicalize_rule(
+                "allow", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+            ),
+            "policy_id": policy_ids[i % POLICIES],
+        }
+        for i in range(rule_count)
+    ]
+    session.execute(insert(Rule.__table__), rows)
+    session.commit()
+    session.expunge_all()
+    return fw.id
+
+
+def main(counts: list[int]) -> None:
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    with app.app_context():
+        session = db.session
+        print(f"{'rules':>10} {'seconds':>10} {'peak KiB':>10}")
+        for n in counts:
+            fw_id = seed(session, f"bench-{n}", n)
+            tracemalloc.start()
+            start = time.perf_counter()
+            delete_firewall(session, fw_id)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{n:>10} {elapsed:>10.4f} {peak / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or DEFAULT_COUNTS)
@@ -0,0 +1,55 @@
+"""
+Benchmark payload size and CPU per request for rule listings.
+
+Compares the row and columnar JSON shapes, each uncompressed and with every
+installed encoding (gzip always; brotli/zstd when installed).
+
+Usage:
+    python -m benchmarks.bench_compression [rule count]
+"""
+
+import json
+import sys
+import time
+
+from app.api.common import to_columnar
+from app.compression import available_encodings, compress
+
+LEVEL = 6
+REPEAT = 20
+
+
+def make_rules(n: int) -> list[dict]:
+    return [
+        {
+            "id": i,
+            "action": "allow" if i % 3 else "deny",
+            "src": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+            "dst": "0.0.0.0/0" if i % 2 else f"192.168.{i & 255}.0/24",
+            "protocol": ("tcp", "udp", None)[i % 3],
+        }
+        for i in range(n)
+    ]
+
+
+def main(n: int) -> None:
+    rules = make_rules(n)
+    shapes = {"rows": rules, "columnar": to_columnar(rules)}
+    print(f"{n} rules")
+    print(f"{'shape':>9} {'encoding':>9} {'bytes':>10} {'ms/request':>11}")
+    for shape, payload in shapes.items():
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            body = json.dumps(payload).encode()
+        serialize_ms = (time.perf_counter() - start) * 1000 / REPEAT
+        print(f"{shape:>9} {'identity':>9} {len(body):>10} {serialize_ms:>11.2f}")
+        for encoding in available_encodings():
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                out = compress(body, encoding, LEVEL)
+            ms = (time.perf_counter() - start) * 1000 / REPEAT + serialize_ms
+            print(f"{shape:>9} {encoding:>9} {len(out):>10} {ms:>11.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
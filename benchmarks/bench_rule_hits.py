@@ -0,0 +1,91 @@
+"""
+Benchmark rule hit ingestion against the 100k hits/s per worker target.
+
+Seeds a firewall with RULES rules and replays batches of hit counts, one
+hit per rule in each batch, drawn from a Zipf law so a few rules take most
+hits. Reports hits per second through the service (aggregation plus the
+batched upserts it triggers), through POST /api/rules/hits, and the time of
+one flush of every rule.
+
+Usage:
+    python -m benchmarks.bench_rule_hits [hit count] [batch size]
+"""
+
+import random
+import sys
+import time
+
+from app import create_app
+from app.db import db
+from app.services.firewall import create_firewall
+from app.services.policy import add_policy
+from app.services.rule_stats import HitCounter, flush_hits, ingest_hits
+
+RULES = 10_000
+RULES_PER_POLICY = 1_000
+ZIPF_EXPONENT = 1.1
+
+
+def seed(session) -> list[int]:
+    fw = create_firewall(session, "bench-hits")
+    rule_ids = []
+    for p in range(RULES // RULES_PER_POLICY):
+        rules = [
+            {"action": "allow", "src": f"10.{p}.{i >> 8}.{i & 255}"}
+            for i in range(RULES_PER_POLICY)
+        ]
+        rule_ids += [r.id for r in add_policy(session, fw.id, f"p{p}", rules).rules]
+    return rule_ids
+
+
+def make_batches(rule_ids: list[int], n: int, batch: int) -> list[dict[int, int]]:
+    rng = random.Random(0)
+    weights = [1 / rank**ZIPF_EXPONENT for rank in range(1, len(rule_ids) + 1)]
+    batches = []
+    for _ in range(n // batch):
+        hits: dict[int, int] = {}
+        for rule_id in rng.choices(rule_ids, weights=weights, k=batch):
+            hits[rule_id] = hits.get(rule_id, 0) + 1
+        batches.append(hits)
+    return batches
+
+
+def main(n: int, batch: int) -> None:
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    with app.app_context():
+        session = db.session
+        rule_ids = seed(session)
+        batches = make_batches(rule_ids, n, batch)
+        total = sum(sum(hits.values()) for hits in batches)
+        print(f"{total} hits over {RULES} rules, batches of {batch}")
+        print(f"{'path':>10} {'hits/s':>12}")
+
+        counter = HitCounter()
+        start = time.perf_counter()
+        for hits in batches:
+            ingest_hits(session, hits, counter)
+        flush_hits(session, counter)
+        elapsed = time.perf_counter() - start
+        print(f"{'service':>10} {total / elapsed:>12.0f}")
+
+        client = app.test_client()
+        bodies = [{"hits": {str(k): v for k, v in hits.items()}} for hits in batches]
+        start = time.perf_counter()
+        for body in bodies:
+            assert client.post("/api/rules/hits", json=body).status_code == 202
+        client.post("/api/rules/hits?flush=true", json={"hits": {}})
+        elapsed = time.perf_counter() - start
+        print(f"{'http':>10} {total / elapsed:>12.0f}")
+
+        counter.record({rule_id: 1 for rule_id in rule_ids})
+        start = time.perf_counter()
+        flush_hits(session, counter)
+        elapsed = time.perf_counter() - start
+        print(f"flush of {RULES} rules: {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1_000,
+    )
@@ -0,0 +1,78 @@
+"""
+Benchmark what-if simulation over a large flow sample.
+
+Seeds a firewall with a few hundred rules, then simulates removing one rule
+and adding another against a sample of flows drawn from a limited address
+space, as real traffic repeats heavily.
+
+Usage:
+    python -m benchmarks.bench_simulation [flow count]
+"""
+
+import random
+import sys
+import time
+
+from app import create_app
+from app.db import db
+from app.services.firewall import create_firewall
+from app.services.policy import add_policy
+from app.services.simulation import compiled_firewall, simulate
+
+POLICIES = 4
+RULES_PER_POLICY = 100
+
+
+def seed(session) -> tuple[int, list]:
+    fw = create_firewall(session, "bench-simulation")
+    policies = []
+    for p in range(POLICIES):
+        rules = [
+            {
+                "action": "deny" if (p + i) % 2 else "allow",
+                "src": f"10.{p}.{i}.0/24",
+                "protocol": ("tcp", "udp")[i % 2],
+            }
+            for i in range(RULES_PER_POLICY)
+        ]
+        policies.append(add_policy(session, fw.id, f"p{p}", rules))
+    return fw.id, policies
+
+
+def make_flows(n: int) -> list[dict]:
+    rng = random.Random(0)
+    return [
+        {
+            "src": f"10.{rng.randrange(POLICIES)}.{rng.randrange(RULES_PER_POLICY)}.{rng.randrange(64)}",
+            "dst": f"192.168.0.{rng.randrange(16)}",
+            "protocol": rng.choice(("tcp", "udp")),
+        }
+        for _ in range(n)
+    ]
+
+
+def main(n: int) -> None:
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    with app.app_context():
+        session = db.session
+        fw_id, policies = seed(session)
+        compiled_firewall(session, fw_id)
+        flows = make_flows(n)
+        changes = [
+            {"policy_id": policies[0].id, "remove": [policies[0].rules[0].id]},
+            {
+                "policy_id": policies[1].id,
+                "add": [{"action": "deny", "dst": "192.168.0.1"}],
+            },
+        ]
+        start = time.perf_counter()
+        result = simulate(session, fw_id, changes, flows)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{n} flows ({result['unique_flows']} unique, {result['evaluated']} "
+            f"evaluated): {result['changed']} changed verdict in {elapsed:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
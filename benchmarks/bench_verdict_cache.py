@@ -0,0 +1,96 @@
+"""
+Benchmark the flow verdict cache on a Zipf-distributed flow workload.
+
+Seeds a firewall with a few hundred rules and draws flows from a fixed
+population whose popularity follows a Zipf law, as real traffic does. Each
+run evaluates the same flows without the cache and then through caches of
+several sizes, reporting throughput and hit ratio.
+
+Usage:
+    python -m benchmarks.bench_verdict_cache [flow count] [zipf exponent]
+"""
+
+import random
+import sys
+import time
+
+from app import create_app
+from app.db import db
+from app.services.evaluation import parse_flow_address
+from app.services.firewall import create_firewall
+from app.services.policy import add_policy
+from app.services.simulation import compiled_firewall
+from app.services.verdict import VerdictCache, evaluate_flows
+
+POLICIES = 4
+RULES_PER_POLICY = 100
+POPULATION = 200_000
+CACHE_SIZES = [1_000, 10_000, 100_000]
+BATCH = 1_000
+
+
+def seed(session) -> int:
+    fw = create_firewall(session, "bench-verdict")
+    for p in range(POLICIES):
+        rules = [
+            {
+                "action": "deny" if (p + i) % 2 else "allow",
+                "src": f"10.{p}.{i}.0/24",
+                "protocol": ("tcp", "udp")[i % 2],
+            }
+            for i in range(RULES_PER_POLICY)
+        ]
+        add_policy(session, fw.id, f"p{p}", rules)
+    return fw.id
+
+
+def make_flows(n: int, exponent: float) -> list[dict]:
+    rng = random.Random(0)
+    population = [
+        {
+            "src": f"10.{rng.randrange(POLICIES + 1)}.{rng.randrange(256)}.{rng.randrange(256)}",
+            "dst": f"192.168.{rng.randrange(256)}.{rng.randrange(256)}",
+            "protocol": rng.choice(("tcp", "udp")),
+        }
+        for _ in range(POPULATION)
+    ]
+    weights = [1 / rank**exponent for rank in range(1, POPULATION + 1)]
+    return rng.choices(population, weights=weights, k=n)
+
+
+def main(n: int, exponent: float) -> None:
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    with app.app_context():
+        session = db.session
+        fw_id = seed(session)
+        flows = make_flows(n, exponent)
+        batches = [flows[i : i + BATCH] for i in range(0, n, BATCH)]
+        print(f"{n} flows, {POPULATION} distinct, zipf s={exponent}")
+        print(f"{'cache size':>12} {'flows/s':>12} {'hit ratio':>10}")
+
+        ruleset = compiled_firewall(session, fw_id)
+        start = time.perf_counter()
+        for flow in flows:
+            ruleset.evaluate(
+                parse_flow_address(flow["src"]),
+                parse_flow_address(flow["dst"]),
+                flow["protocol"],
+            )
+        elapsed = time.perf_counter() - start
+        print(f"{'none':>12} {n / elapsed:>12.0f} {'-':>10}")
+
+        for size in CACHE_SIZES:
+            cache = VerdictCache(max_size=size)
+            start = time.perf_counter()
+            for batch in batches:
+                evaluate_flows(session, fw_id, batch, cache)
+            elapsed = time.perf_counter() - start
+            ratio = cache.stats()["hit_ratio"]
+            print(f"{size:>12} {n / elapsed:>12.0f} {ratio:>10.2%}")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 1.1,
+    )
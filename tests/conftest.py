@@ -1,8 +1,100 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+
 import pytest
+from sqlalchemy import event
 
 from app import create_app
 from app.db import db
 
+# Statements slower than this fail the test that ran them
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", "250")) / 1000
+# Tables whose unindexed full scans are reported at the end of the run
+SCAN_WATCHED_TABLES = ("rules", "policies")
+# A plan step reading every row of a table or alias, through the table itself
+# or a whole (covering) index: "SCAN r USING COVERING INDEX ix_rules_hash"
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(?: USING .*)?$")
+# Aliases given to watched tables in a statement: "rules AS r", "rules rules_1"
+_TABLE_ALIAS = re.compile(
+    rf"\b({'|'.join(SCAN_WATCHED_TABLES)})\b(?:\s+AS)?\s+(\w+)", re.IGNORECASE
+)
+
+
+def full_scans(statement: str, plan: list[str]) -> list[str]:
+    """The watched tables fully scanned by the steps of a query plan."""
+    aliases = {alias: table.lower() for table, alias in _TABLE_ALIAS.findall(statement)}
+    scanned = []
+    for detail in plan:
+        match = _FULL_SCAN.match(detail)
+        if match:
+            name = match.group(2) or match.group(1)
+            table = aliases.get(name, name)
+            if table in SCAN_WATCHED_TABLES:
+                scanned.append(table)
+    return scanned
+
+
+class QueryGuard:
+    """
+    Records SQL statements run on an engine: their count and duration, and
+    the SQLite query plan of statements that fully scan a watched table.
+    """
+
+    def __init__(self):
+        self.statements: list[tuple[str, float]] = []
+        self.slow: list[tuple[str, float]] = []
+        self.scans: dict[str, list[str]] = {}
+        self._plans: dict[str, list[str] | None] = {}
+
+    def install(self, engine) -> None:
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def reset(self) -> None:
+        self.statements.clear()
+        self.slow.clear()
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_started")
+        self.statements.append((statement, elapsed))
+        if elapsed > SLOW_QUERY_SECONDS:
+            self.slow.append((statement, elapsed))
+        if not executemany and conn.dialect.name == "sqlite":
+            self._check_plan(cursor, statement, parameters)
+
+    def _check_plan(self, cursor, statement, parameters) -> None:
+        if statement in self._plans or not statement.lstrip().upper().startswith(
+            ("SELECT", "UPDATE", "DELETE")
+        ):
+            return
+        # Plan on a separate cursor so the pending result set is untouched
+        rows = cursor.connection.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).fetchall()
+        plan = [row[-1] for row in rows]
+        full_scan = bool(full_scans(statement, plan))
+        self._plans[statement] = plan if full_scan else None
+        if full_scan:
+            self.scans[statement] = plan
+
+    @contextmanager
+    def assert_max_queries(self, limit: int):
+        """Fail if the block runs more than ``limit`` statements."""
+        start = len(self.statements)
+        yield
+        ran = [sql for sql, _ in self.statements[start:]]
+        assert (
+            len(ran) <= limit
+        ), f"{len(ran)} queries run, expected at most {limit}:\n" + "\n".join(ran)
+
+
+query_guard = QueryGuard()
+
 
 @pytest.fixture(scope="session")
 def app():
@@ -17,7 +109,10 @@ def app():
 
     with app.app_context():
         db.create_all()
+        query_guard.install(db.engine)
         yield app
+        # Flush hits recorded by the tests while the tables still exist
+        app.extensions["hit_flusher"].stop()
         db.drop_all()
 
 
@@ -29,3 +124,34 @@ def db_session(app):
         yield session
         session.rollback()
         session.remove()
+
+
+@pytest.fixture
+def assert_max_queries():
+    """Context manager failing if its block runs more than N statements."""
+    return query_guard.assert_max_queries
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    """Fail tests that ran a statement slower than SLOW_QUERY_SECONDS."""
+    query_guard.reset()
+    result = yield
+    if query_guard.slow:
+        details = "\n".join(f"{t * 1000:.0f}ms: {sql}" for sql, t in query_guard.slow)
+        pytest.fail(
+            f"Queries slower than {SLOW_QUERY_SECONDS * 1000:.0f}ms:\n{details}",
+            pytrace=False,
+        )
+    return result
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Print the query plan of every statement fully scanning a watched table."""
+    if not query_guard.scans:
+        return
+    terminalreporter.section(f"full table scans on {', '.join(SCAN_WATCHED_TABLES)}")
+    for statement, plan in query_guard.scans.items():
+        terminalreporter.write_line(" ".join(statement.split()))
+        for detail in plan:
+            terminalreporter.write_line(f"    {detail}")
@@ -0,0 +1,204 @@
+import gzip
+import json
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, select
+
+from app import create_app
+from app.db import db
+from app.models.rule import Rule
+from app.services.archive import dump_archive, restore_archive
+from app.services.firewall import create_firewall, list_firewalls
+from app.services.firewall_stats import list_firewall_stats
+from app.services.policy import add_policy
+from app.services.rule_stats import HitCounter, flush_hits, list_rules_with_stats
+from app.services.template import attach_template, create_template
+
+
+def _app(tmp_path, name: str, shards: int = 1):
+    paths = [tmp_path / name] + [
+        tmp_path / f"shard{i}_{name}" for i in range(1, shards)
+    ]
+    uris = [f"sqlite:///{path}" for path in paths]
+    return create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": uris[0],
+            "SHARD_DATABASE_URIS": uris[1:],
+        }
+    )
+
+
+def _dump(app, path, **kwargs) -> None:
+    with app.app_context(), open(path, "wb") as f:
+        dump_archive(db.session, f, **kwargs)
+        db.session.remove()
+
+
+@pytest.fixture
+def source(tmp_path):
+    """An app with firewalls, policies, rules, a template and hit counters."""
+    app = _app(tmp_path, "source.db")
+    with app.app_context():
+        template = create_template(db.session, "baseline", [{"action": "deny"}])
+        for i in range(3):
+            fw = create_firewall(db.session, f"fw{i}", "edge")
+            policy = add_policy(
+                db.session,
+                fw.id,
+                "p",
+                [{"action": "allow", "src": f"10.0.{i}.{j}"} for j in range(5)],
+            )
+            attach_template(db.session, fw.id, template.id)
+        counter = HitCounter()
+        counter.record({policy.rules[0].id: 7})
+        flush_hits(db.session, counter)
+        db.session.remove()
+    return app
+
+
+def _state(app) -> tuple:
+    with app.app_context():
+        firewalls = [fw.model_dump() for fw in list_firewalls(db.session)]
+        policy_id = firewalls[-1]["policies"][0]["id"]
+        rules = [r.model_dump() for r in list_rules_with_stats(db.session, policy_id)]
+        state = (firewalls, rules, list_firewall_stats(db.session))
+        db.session.remove()
+    return state
+
+
+def test_round_trip_through_cli(source, tmp_path):
+    """A dump restored into an empty database reproduces every row."""
+    path = tmp_path / "fleet.jsonl.gz"
+    result = source.test_cli_runner().invoke(
+        args=["data", "dump", str(path), "--chunk-size", "4"]
+    )
+    assert result.exit_code == 0, result.output
+
+    with gzip.open(path, "rt") as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0]["version"] == 1
+    assert lines[-1]["counts"]["rules"] == 15
+    assert max(len(line.get("rows", [])) for line in lines) == 4
+
+    target = _app(tmp_path, "target.db")
+    result = target.test_cli_runner().invoke(args=["data", "restore", str(path)])
+    assert result.exit_code == 0, result.output
+    assert _state(target) == _state(source)
+
+    # IDs keep counting after the restored ones
+    with target.app_context():
+        fw = create_firewall(db.session, "fw_new")
+        assert fw.id == 4
+        db.session.remove()
+
+
+def test_restore_requires_empty_tables(source, tmp_path):
+    path = tmp_path / "fleet.jsonl.gz"
+    with source.app_context(), open(path, "wb") as f:
+        dump_archive(db.session, f)
+
+    runner = source.test_cli_runner()
+    result = runner.invoke(args=["data", "restore", str(path)])
+    assert result.exit_code != 0
+    assert "not empty" in result.output
+    state = _state(source)
+    result = runner.invoke(args=["data", "restore", str(path), "--replace"])
+    assert result.exit_code == 0, result.output
+    assert _state(source) == state
+
+
+def test_truncated_archive_restores_nothing(source, tmp_path):
+    path = tmp_path / "fleet.jsonl.gz"
+    with source.app_context(), open(path, "wb") as f:
+        dump_archive(db.session, f, chunk_size=2)
+    data = path.read_bytes()
+    path.write_bytes(data[: len(data) // 2])
+
+    target = _app(tmp_path, "target.db")
+    with target.app_context():
+        indexes = {ix["name"] for ix in inspect(db.engine).get_indexes("rules")}
+        with open(path, "rb") as f, pytest.raises(ValueError, match="truncated"):
+            restore_archive(db.session, f)
+        assert db.session.scalar(select(func.count()).select_from(Rule)) == 0
+        assert {ix["name"] for ix in inspect(db.engine).get_indexes("rules")} == indexes
+        db.session.remove()
+
+
+def test_newer_archive_rejected(source, tmp_path):
+    path = tmp_path / "future.jsonl.gz"
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps({"format": "fireflow-archive", "version": 99}) + "\n")
+    with source.app_context(), open(path, "rb") as f:
+        with pytest.raises(ValueError, match="newer"):
+            restore_archive(db.session, f)
+
+
+def test_restore_rebuilds_search(source, tmp_path):
+    """The full-text index is rebuilt after the load and kept in sync again."""
+    path = tmp_path / "fleet.jsonl.gz"
+    _dump(source, path)
+    target = _app(tmp_path, "target.db")
+    with target.app_context():
+        with open(path, "rb") as f:
+            restore_archive(db.session, f)
+        assert len(list_firewalls(db.session, q="edge")) == 3
+        create_firewall(db.session, "fw_after", "branch")
+        assert [fw.name for fw in list_firewalls(db.session, q="branch")] == [
+            "fw_after"
+        ]
+        db.session.remove()
+
+
+def test_sharded_round_trip(tmp_path):
+    """Rows go back to their shard, and need as many shards as the dump."""
+    source = _app(tmp_path, "source.db", shards=3)
+    with source.app_context():
+        for i in range(6):
+            fw = create_firewall(db.session, f"fw{i}", "edge")
+            add_policy(db.session, fw.id, "p", [{"action": "allow"}])
+        db.session.remove()
+    path = tmp_path / "fleet.jsonl.gz"
+    _dump(source, path, chunk_size=4)
+
+    target = _app(tmp_path, "target.db", shards=3)
+    with target.app_context(), open(path, "rb") as f:
+        restore_archive(db.session, f)
+        db.session.remove()
+    assert _state(target) == _state(source)
+
+    for shards in (1, 2):
+        smaller = _app(tmp_path, f"smaller{shards}.db", shards=shards)
+        with smaller.app_context(), open(path, "rb") as f:
+            with pytest.raises(ValueError, match="shards are configured"):
+                restore_archive(db.session, f)
+            assert db.session.scalar(select(func.count()).select_from(Rule)) == 0
+            db.session.remove()
+
+
+def test_corrupt_chunk_restores_nothing(source, tmp_path):
+    path = tmp_path / "fleet.jsonl.gz"
+    _dump(source, path)
+    with gzip.open(path, "rt") as f:
+        lines = f.readlines()
+    lines = [
+        line.replace("]]}", "]}") if line.startswith('{"table":"rules"') else line
+        for line in lines
+    ]
+    with gzip.open(path, "wt") as f:
+        f.writelines(lines)
+
+    target = _app(tmp_path, "target.db")
+    with target.app_context(), open(path, "rb") as f:
+        with pytest.raises(ValueError, match="corrupt"):
+            restore_archive(db.session, f)
+        assert db.session.scalar(select(func.count()).select_from(Rule)) == 0
+        db.session.remove()
+
+
+def test_snapshot(source, tmp_path):
+    path = tmp_path / "snapshot.db"
+    result = source.test_cli_runner().invoke(args=["data", "snapshot", str(path)])
+    assert result.exit_code == 0, result.output
+    with create_engine(f"sqlite:///{path}").connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(Rule.__table__)) == 15
@@ -0,0 +1,152 @@
+import pytest
+from sqlalchemy import event
+
+from app.db import db
+from app.models.firewall import Firewall
+from app.schemas.batch import PolicyIdArgs
+from app.services.batch import OPERATIONS, BatchError, run_batch
+
+
+def _names(db_session, prefix):
+    return (
+        db_session.query(Firewall.name).filter(Firewall.name.like(f"{prefix}%")).all()
+    )
+
+
+def test_batch_with_back_references(db_session):
+    """Operations reference IDs created earlier; the batch commits once."""
+    commits = []
+    event.listen(db.engine, "commit", commits.append)
+    results = run_batch(
+        db_session,
+        [
+            {"op": "create_firewall", "ref": "fw", "args": {"name": "batch_fw"}},
+            {
+                "op": "add_policy",
+                "ref": "p",
+                "args": {
+                    "fw_id": {"$ref": "fw"},
+                    "name": "inbound",
+                    "rules": [{"action": "deny", "src": "10.0.0.0/8"}],
+                },
+            },
+            {
+                "op": "add_rule",
+                "args": {"policy_id": {"$ref": "p"}, "action": "allow"},
+            },
+            {"op": "delete_rule", "args": {"rule_id": {"$ref": "p.rules.0.id"}}},
+            {"op": "update_firewall", "args": {"fw_id": {"$ref": "0"}, "name": "b_fw"}},
+        ],
+    )
+    assert len(commits) == 1
+    fw_id = results[0]["id"]
+    assert fw_id and results[1]["name"] == "inbound"
+    assert results[2]["action"] == "allow"
+    assert results[3] == {"deleted": True}
+    assert results[4]["name"] == "b_fw"
+    fw = db_session.get(Firewall, fw_id)
+    assert [r.action for r in fw.policies[0].rules] == ["allow"]
+
+
+@pytest.mark.parametrize(
+    "failing, message",
+    [
+        (
+            {"op": "add_policy", "args": {"fw_id": 999999, "name": "x", "rules": []}},
+            "not found",
+        ),
+        ({"op": "delete_policy", "args": {"policy_id": 999999}}, "Not found"),
+        ({"op": "create_firewall", "args": {"name": "batch_rb_0"}}, "already exists"),
+        ({"op": "add_rule", "args": {"policy_id": {"$ref": "p"}}}, "Invalid arguments"),
+        ({"op": "add_rule", "args": {"policy_id": {"$ref": "nope"}}}, "Unknown ref"),
+        ({"op": "shutdown"}, "Unknown operation"),
+        ({"op": ["add_rule"]}, "Unknown operation"),
+        (
+            {
+                "op": "add_policy",
+                "args": {
+                    "fw_id": {"$ref": "fw"},
+                    "name": "x",
+                    "rules": [{"src": "1.1.1.1"}],
+                },
+            },
+            "Invalid arguments",
+        ),
+        (
+            {"op": "add_rule", "args": {"policy_id": "abc", "action": "deny"}},
+            "Invalid arguments",
+        ),
+        (
+            {"op": "delete_rules", "args": {"policy_id": {"$ref": "p"}, "progress": 1}},
+            "Invalid arguments",
+        ),
+        ({"op": "delete_firewall", "args": [1]}, "Invalid arguments"),
+        (
+            {"op": "add_rule", "args": {"policy_id": {"$ref": "p"}, "action": "deny"}},
+            "already exists",
+        ),
+    ],
+)
+def test_batch_rolls_back_on_failure(db_session, failing, message):
+    """A failing operation rolls back every operation of the batch."""
+    operations = [
+        {"op": "create_firewall", "ref": "fw", "args": {"name": "batch_rb_0"}},
+        {
+            "op": "add_policy",
+            "ref": "p",
+            "args": {
+                "fw_id": {"$ref": "fw"},
+                "name": "p",
+                "rules": [{"action": "deny"}],
+            },
+        },
+        failing,
+    ]
+    with pytest.raises(BatchError, match=message) as info:
+        run_batch(db_session, operations)
+    assert info.value.index == 2
+    assert _names(db_session, "batch_rb") == []
+
+
+def test_batch_endpoint(app, db_session):
+    """The endpoint returns every result, or the failing operation."""
+    client = app.test_client()
+    response = client.post(
+        "/api/batch",
+        json={
+            "operations": [
+                {"op": "create_firewall", "ref": "fw", "args": {"name": "batch_api"}},
+                {
+                    "op": "attach_template",
+                    "args": {"fw_id": {"$ref": "fw"}, "template_id": 999999},
+                },
+            ]
+        },
+    )
+    assert response.status_code == 400
+    assert response.json == {
+        "error": "Template not found",
+        "index": 1,
+        "op": "attach_template",
+    }
+    assert _names(db_session, "batch_api") == []
+
+    response = client.post(
+        "/api/batch",
+        json={"operations": [{"op": "create_firewall", "args": {"name": "batch_api"}}]},
+    )
+    assert response.status_code == 200
+    assert response.json["results"][0]["name"] == "batch_api"
+    assert client.post("/api/batch", json={"operations": {}}).status_code == 400
+
+
+def test_batch_service_type_errors_are_batch_errors(db_session, monkeypatch):
+    """Errors a service raises on unexpected arguments fail the batch cleanly."""
+
+    def broken(db, policy_id):
+        raise KeyError("action")
+
+    monkeypatch.setitem(OPERATIONS, "delete_policy", (broken, PolicyIdArgs))
+    with pytest.raises(BatchError, match="Invalid arguments") as info:
+        run_batch(db_session, [{"op": "delete_policy", "args": {"policy_id": 1}}])
+    assert (info.value.index, info.value.op) == (0, "delete_policy")
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+
+from app.coalesce import SingleFlight
+from app.metrics import metrics
+
+
+def _run_concurrently(flight, key, fn, n):
+    results = []
+    started = threading.Barrier(n)
+
+    def worker():
+        started.wait()
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_calls_share_one_execution():
+    """Concurrent callers with the same key get the leader's result."""
+    flight = SingleFlight("test_coalesce")
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.05)
+        return b"payload"
+
+    before = metrics.get("test_coalesce.shared")
+    results = _run_concurrently(flight, "key", work, 8)
+    assert len(calls) == 1
+    assert {r for r, _ in results} == {b"payload"}
+    assert sum(shared for _, shared in results) == 7
+    assert metrics.get("test_coalesce.shared") == before + 7
+
+
+def test_errors_propagate_to_waiters():
+    """A failing leader raises in every caller that shared the call."""
+    flight = SingleFlight("test_coalesce_error")
+
+    def work():
+        time.sleep(0.05)
+        raise RuntimeError("boom")
+
+    results = _run_concurrently(flight, "key", work, 4)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_completed_calls_are_not_cached():
+    """Once a call finishes, the next caller executes again."""
+    flight = SingleFlight("test_coalesce_sequential")
+    assert flight.do("key", lambda: 1) == (1, False)
+    assert flight.do("key", lambda: 2) == (2, False)
+    with pytest.raises(ZeroDivisionError):
+        flight.do("key", lambda: 1 / 0)
+    assert flight.do("key", lambda: 3) == (3, False)
@@ -0,0 +1,81 @@
+import gzip
+
+import pytest
+from flask import Flask, Response, jsonify
+
+from app.api.common import to_columnar
+from app.compression import init_compression, negotiate
+
+
+@pytest.fixture
+def client():
+    """A minimal app with compression and one buffered and one streamed route."""
+    app = Flask(__name__)
+    app.config["COMPRESS_MIN_SIZE"] = 100
+    init_compression(app)
+
+    @app.route("/small")
+    def small():
+        return jsonify({"ok": True})
+
+    @app.route("/large")
+    def large():
+        return jsonify([{"id": i, "action": "allow"} for i in range(100)])
+
+    @app.route("/stream")
+    def stream():
+        return Response((f'{{"id": {i}}}\n' for i in range(10)), mimetype="text/plain")
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (None, None),
+        ("gzip", "gzip"),
+        ("br;q=1.0, gzip;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("identity", None),
+    ],
+)
+def test_negotiate(header, expected):
+    """Only installed encodings are chosen, by client q-value."""
+    assert negotiate(header, {"gzip": object}) == expected
+
+
+def test_large_response_compressed(client):
+    """Responses above the threshold are gzip-compressed when accepted."""
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    plain = client.get("/large")
+    assert gzip.decompress(response.data) == plain.data
+    assert len(response.data) < len(plain.data)
+
+
+def test_small_response_not_compressed(client):
+    """Responses below the threshold are sent as-is."""
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_streamed_response_compressed(client):
+    """Streamed responses are compressed incrementally."""
+    response = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data).decode().count("\n") == 10
+
+
+def test_to_columnar():
+    """Rows become arrays per field, including nested lists of rows."""
+    rows = [
+        {"id": 1, "name": "p1", "rules": [{"id": 10, "action": "allow"}]},
+        {"id": 2, "name": "p2", "rules": []},
+    ]
+    assert to_columnar(rows) == {
+        "id": [1, 2],
+        "name": ["p1", "p2"],
+        "rules": [{"id": [10], "action": ["allow"]}, []],
+    }
@@ -0,0 +1,114 @@
+import pytest
+
+from app.models.firewall import Firewall
+from app.schemas.firewall import FirewallOut
+from app.schemas.policy import PolicyOut
+from app.schemas.rule import RuleOut
+from app.services.fields import parse_fields
+from app.services.firewall import get_firewall, list_firewalls
+from app.services.policy import add_policy, list_policies
+from app.services.rule import list_rules
+from app.services.rule_stats import HitCounter, list_rules_with_stats
+from app.services.template import attach_template, create_template, get_template
+
+
+def _firewall(db_session, name: str) -> Firewall:
+    fw = Firewall(name=name, description="desc")
+    db_session.add(fw)
+    db_session.commit()
+    return fw
+
+
+def test_parse_fields():
+    """Dotted paths nest; a whole object wins over some of its fields."""
+    spec = parse_fields("id, name,policies.id,policies.rules.action", FirewallOut)
+    assert spec == {
+        "id": None,
+        "name": None,
+        "policies": {"id": None, "rules": {"action": None}},
+    }
+    assert parse_fields("policies,policies.id", FirewallOut) == {"policies": None}
+    assert parse_fields(None, FirewallOut) is None
+
+
+@pytest.mark.parametrize("value", ["id,bogus", "policies.bogus", "name.id", ","])
+def test_parse_fields_invalid(value):
+    with pytest.raises(ValueError):
+        parse_fields(value, FirewallOut)
+
+
+def test_list_policies_skips_rules(db_session, assert_max_queries):
+    """Policies listed without rules never query the rules tables."""
+    fw = _firewall(db_session, "fw_fields_policies")
+    add_policy(db_session, fw.id, "p1", [{"action": "allow", "src": "10.0.0.1"}])
+    add_policy(db_session, fw.id, "p2", [{"action": "deny", "dst": "10.0.0.2"}])
+    db_session.expire_all()
+
+    fields = parse_fields("id,name", PolicyOut)
+    with assert_max_queries(2):
+        policies = list_policies(db_session, fw.id, fields)
+    assert [p.model_dump(exclude_unset=True) for p in policies] == [
+        {"id": policies[0].id, "name": "p1"},
+        {"id": policies[1].id, "name": "p2"},
+    ]
+
+
+def test_list_firewalls_nested_fields(db_session):
+    fw = _firewall(db_session, "fw_fields_nested")
+    add_policy(db_session, fw.id, "p1", [{"action": "allow", "src": "10.0.0.1"}])
+    db_session.expire_all()
+
+    fields = parse_fields("name,policies.rules.action", FirewallOut)
+    (out,) = list_firewalls(db_session, name_prefix="fw_fields_nested", fields=fields)
+    assert out.model_dump(exclude_unset=True) == {
+        "name": "fw_fields_nested",
+        "policies": [{"rules": [{"action": "allow"}]}],
+    }
+    # The sort key is kept for cursors without being returned
+    assert out.id == fw.id
+
+
+def test_fields_through_template(db_session):
+    """Template-backed policies return the requested template rule fields."""
+    fw = _firewall(db_session, "fw_fields_template")
+    template = create_template(
+        db_session, "tpl_fields", [{"action": "deny", "src": "10.1.0.0/16"}]
+    )
+    policy = attach_template(db_session, fw.id, template.id, "p1")
+    db_session.expire_all()
+
+    spec = parse_fields("src", RuleOut)
+    assert [
+        r.model_dump(exclude_unset=True)
+        for r in list_rules(db_session, policy.id, spec)
+    ] == [{"src": "10.1.0.0/16"}]
+    out = get_template(db_session, template.id, {"version": None})
+    assert out.model_dump(exclude_unset=True) == {"version": template.version}
+
+
+def test_rules_with_stats_fields(db_session):
+    fw = _firewall(db_session, "fw_fields_stats")
+    policy = add_policy(db_session, fw.id, "p1", [{"action": "allow"}])
+    counter = HitCounter()
+    counter.record({policy.rules[0].id: 3})
+
+    rules = list_rules_with_stats(
+        db_session, policy.id, counter, fields={"id": None, "hits": None}
+    )
+    assert [r.model_dump(exclude_unset=True) for r in rules] == [
+        {"id": policy.rules[0].id, "hits": 3}
+    ]
+
+
+def test_fields_endpoint(app, db_session):
+    fw = _firewall(db_session, "fw_fields_api")
+    add_policy(db_session, fw.id, "p1", [{"action": "allow"}])
+    client = app.test_client()
+
+    response = client.get(f"/api/firewalls/{fw.id}?fields=id,policies.name")
+    assert response.status_code == 200
+    assert response.get_json() == {"id": fw.id, "policies": [{"name": "p1"}]}
+    full = client.get(f"/api/firewalls/{fw.id}").get_json()
+    assert set(full) == {"id", "name", "description", "version", "policies"}
+    assert client.get(f"/api/firewalls/{fw.id}?fields=nope").status_code == 400
+    assert get_firewall(db_session, fw.id, {"name": None}).name == fw.name
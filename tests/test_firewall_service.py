@@ -1,13 +1,26 @@
+import sqlite3
+
 import pytest
+from sqlalchemy import func, select, text
 
+from app import create_app
+from app.db import db
 from app.models.firewall import Firewall
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.services.canonical import canonicalize_rule
 from app.services.firewall import (
     create_firewall,
     delete_firewall,
+    encode_cursor,
+    firewall_version,
     get_firewall,
     list_firewalls,
     update_firewall,
+    upsert_firewalls,
 )
+from app.services.policy import add_policy, delete_policy
+from app.services.rule import add_rule
 
 
 @pytest.mark.parametrize(
@@ -90,6 +103,32 @@ def test_delete_firewall(db_session):
     assert get_firewall(db_session, fw.id) is None
 
 
+def test_delete_firewall_cascades_in_database(db_session):
+    """
+    Test that deleting a firewall removes its policies and rules through
+    ON DELETE CASCADE without loading the children into the session.
+    """
+    fw = create_firewall(db_session, "fw_cascade", "desc")
+    policy = FilteringPolicy(name="p", firewall_id=fw.id)
+    db_session.add(policy)
+    db_session.flush()
+    db_session.add_all(
+        Rule(**canonicalize_rule("allow", f"10.0.0.{i}"), policy_id=policy.id)
+        for i in range(5)
+    )
+    db_session.commit()
+    policy_id = policy.id
+    db_session.expunge_all()
+
+    assert delete_firewall(db_session, fw.id) is True
+    assert not any(isinstance(obj, Rule) for obj in db_session.identity_map.values())
+    assert db_session.get(FilteringPolicy, policy_id) is None
+    remaining = db_session.scalar(
+        select(func.count()).select_from(Rule).where(Rule.policy_id == policy_id)
+    )
+    assert remaining == 0
+
+
 def test_delete_nonexistent_firewall(db_session):
     """
     Test deleting a firewall that does not exist.
@@ -115,3 +154,165 @@ def test_list_firewalls(db_session):
     ids = [fw.id for fw in firewalls]
     assert fw1.id in ids
     assert fw2.id in ids
+
+
+def test_list_firewalls_query_count(app, db_session, assert_max_queries):
+    """A page of firewalls loads policies and rules in a fixed number of queries."""
+    for i in range(5):
+        fw = create_firewall(db_session, f"fw_list_queries_{i}")
+        add_policy(db_session, fw.id, "p", [{"action": "allow"}, {"action": "deny"}])
+    db_session.expire_all()
+
+    with assert_max_queries(4):
+        response = app.test_client().get("/api/firewalls/?name_prefix=fw_list_queries_")
+    assert [len(fw["policies"][0]["rules"]) for fw in response.json] == [2] * 5
+
+
+def test_list_firewalls_search(db_session):
+    """
+    Test full-text search over name and description and name prefix filtering.
+    """
+    db_session.query(Firewall).delete()
+    db_session.commit()
+
+    edge = create_firewall(db_session, "edge-paris", "Corporate edge firewall")
+    dc = create_firewall(db_session, "dc-paris", "Datacenter core")
+    create_firewall(db_session, "edge-lyon", "Branch office")
+
+    assert [fw.id for fw in list_firewalls(db_session, q="corporate")] == [edge.id]
+    assert [fw.id for fw in list_firewalls(db_session, q="data")] == [dc.id]
+    assert {fw.name for fw in list_firewalls(db_session, q="paris")} == {
+        "edge-paris",
+        "dc-paris",
+    }
+    assert [fw.name for fw in list_firewalls(db_session, name_prefix="edge-")] == [
+        "edge-paris",
+        "edge-lyon",
+    ]
+
+    update_firewall(db_session, dc.id, "dc-paris", "Datacenter spine")
+    assert list_firewalls(db_session, q="core") == []
+    delete_firewall(db_session, edge.id)
+    assert list_firewalls(db_session, q="corporate") == []
+
+
+def test_version_bump_skips_search_index(db_session):
+    """Bumping the version does not rewrite the firewall's full-text entry."""
+
+    def fts_segments() -> int:
+        return db_session.scalar(text("SELECT count(*) FROM firewalls_fts_data"))
+
+    fw = create_firewall(db_session, "fw_fts_version", "edge")
+    before = fts_segments()
+    add_policy(db_session, fw.id, "p1", [{"action": "allow"}])
+    assert firewall_version(db_session, fw.id) == 2
+    assert fts_segments() == before
+    update_firewall(db_session, fw.id, "fw_fts_renamed", "edge")
+    assert fts_segments() > before
+    assert [f.id for f in list_firewalls(db_session, q="fw_fts_renamed")] == [fw.id]
+
+
+@pytest.mark.parametrize("sort", ["id", "-id", "name", "-name"])
+def test_list_firewalls_keyset_pagination(db_session, sort):
+    """
+    Test that walking pages with cursors returns every firewall once, in order.
+    """
+    db_session.query(Firewall).delete()
+    db_session.commit()
+    for name in ["fw_c", "fw_a", "fw_e", "fw_b", "fw_d"]:
+        create_firewall(db_session, name)
+
+    expected = list_firewalls(db_session, sort=sort)
+    seen = []
+    cursor = None
+    while True:
+        page = list_firewalls(db_session, sort=sort, limit=2, cursor=cursor)
+        seen.extend(page)
+        if len(page) < 2:
+            break
+        cursor = encode_cursor(page[-1], sort)
+    assert [fw.id for fw in seen] == [fw.id for fw in expected]
+    key = sort.lstrip("-")
+    values = [getattr(fw, key) for fw in expected]
+    assert values == sorted(values, reverse=sort.startswith("-"))
+
+
+def test_list_firewalls_invalid_sort(db_session):
+    """
+    Test that an unknown sort key raises ValueError.
+    """
+    with pytest.raises(ValueError):
+        list_firewalls(db_session, sort="description")
+
+
+def test_upsert_firewalls(db_session):
+    """
+    Test batch upsert: new names are created, existing names updated and
+    invalid or repeated items reported without failing the batch.
+    """
+    existing = create_firewall(db_session, "fw_batch_existing", "old")
+    results = upsert_firewalls(
+        db_session,
+        [
+            {"name": "fw_batch_new", "description": "new"},
+            {"name": "fw_batch_existing", "description": "updated"},
+            {"description": "no name"},
+            {"name": "fw_batch_new"},
+        ],
+    )
+    assert [r["status"] for r in results] == ["created", "updated", "error", "error"]
+    assert results[1]["id"] == existing.id
+    assert get_firewall(db_session, existing.id).description == "updated"
+    created = get_firewall(db_session, results[0]["id"])
+    assert created.name == "fw_batch_new"
+    assert created.description == "new"
+
+
+def test_upsert_firewalls_single_lookup(db_session, assert_max_queries):
+    """Names are looked up in one query however large the batch."""
+    create_firewall(db_session, "fw_lookup_0")
+    items = [{"name": f"fw_lookup_{i}"} for i in range(1200)]
+    # Lookup, three written chunks and the ID readback
+    with assert_max_queries(5):
+        results = upsert_firewalls(db_session, items)
+    assert [r["status"] for r in results].count("created") == 1199
+    assert results[0]["status"] == "updated"
+    assert len({r["id"] for r in results}) == 1200
+
+
+def test_firewall_version_bumped_on_changes(db_session):
+    """
+    Test that changes to a firewall's policies and rules bump its version.
+    """
+    fw = create_firewall(db_session, "fw_version", "desc")
+    assert fw.version == 1
+    policy = add_policy(db_session, fw.id, "p", [])
+    assert firewall_version(db_session, fw.id) == 2
+    add_rule(db_session, policy.id, "allow")
+    assert firewall_version(db_session, fw.id) == 3
+    delete_policy(db_session, policy.id)
+    assert firewall_version(db_session, fw.id) == 4
+    assert update_firewall(db_session, fw.id, "fw_version", "new").version == 5
+    assert firewall_version(db_session, 9999) is None
+
+
+def test_version_column_on_upgrade(tmp_path):
+    """Firewalls of a database created before versions start at version 1."""
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            "CREATE TABLE firewalls (id INTEGER NOT NULL PRIMARY KEY, "
+            "name VARCHAR(128) NOT NULL UNIQUE, description TEXT); "
+            "INSERT INTO firewalls VALUES (1, 'fw_old', 'before versions');"
+        )
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=["schema", "upgrade"])
+        assert (
+            result.output
+            == "Added columns: firewalls.version\nRebuilt firewall stats\n"
+        )
+        assert get_firewall(db.session, 1).version == 1
+        add_policy(db.session, 1, "p1", [{"action": "allow"}])
+        assert firewall_version(db.session, 1) == 2
+        db.session.remove()
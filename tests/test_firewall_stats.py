@@ -0,0 +1,122 @@
+from app import create_app
+from app.db import db
+from app.models.firewall_stat import FirewallRuleCount, FirewallStat
+from app.services.firewall import create_firewall, delete_firewall
+from app.services.firewall_stats import list_firewall_stats, rebuild_firewall_stats
+from app.services.policy import add_policy, delete_policy
+from app.services.rule import add_rule, delete_rule, delete_rules, replace_rules
+from app.services.template import (
+    attach_template,
+    create_template,
+    update_template_rules,
+)
+
+
+def _stats(db_session, fw_id: int) -> dict:
+    (stats,) = [s for s in list_firewall_stats(db_session) if s["firewall_id"] == fw_id]
+    return stats
+
+
+def test_stats_follow_writes(db_session):
+    """Every write path keeps the counts equal to a full recount."""
+    fw = create_firewall(db_session, "fw_stats_writes")
+    assert _stats(db_session, fw.id)["policies"] == 0
+
+    p1 = add_policy(
+        db_session,
+        fw.id,
+        "p1",
+        [
+            {"action": "allow", "protocol": "tcp"},
+            {"action": "allow", "src": "10.0.0.1", "protocol": "TCP"},
+            {"action": "deny"},
+        ],
+    )
+    rule = add_rule(db_session, p1.id, "deny", protocol="udp")
+    delete_rule(db_session, p1.rules[0].id)
+    template = create_template(
+        db_session,
+        "tpl_stats",
+        [{"action": "deny", "protocol": "icmp"}, {"action": "allow"}],
+    )
+    p2 = attach_template(db_session, fw.id, template.id)
+    attach_template(db_session, fw.id, template.id, "again")
+    update_template_rules(db_session, template.id, [{"action": "deny"}])
+    delete_rules(db_session, p1.id, [rule.id])
+    p3 = add_policy(db_session, fw.id, "p3", [{"action": "allow", "dst": "10.0.0.3"}])
+    replace_rules(db_session, p3.id, [{"action": "deny", "protocol": "tcp"}])
+    delete_policy(db_session, p2.id)
+
+    stats = _stats(db_session, fw.id)
+    assert stats == {
+        "firewall_id": fw.id,
+        "name": "fw_stats_writes",
+        "policies": 3,
+        "rules": 4,
+        "breakdown": {"allow": {"tcp": 1}, "deny": {"any": 2, "tcp": 1}},
+    }
+    rebuild_firewall_stats(db_session)
+    assert _stats(db_session, fw.id) == stats
+
+
+def test_copy_on_write_delete(db_session):
+    """Deleting template rules from an attached policy only removes those."""
+    fw = create_firewall(db_session, "fw_stats_cow")
+    template = create_template(
+        db_session, "tpl_stats_cow", [{"action": "deny"}, {"action": "allow"}]
+    )
+    policy = attach_template(db_session, fw.id, template.id)
+    delete_rules(db_session, policy.id, [template.rules[0].id])
+    assert _stats(db_session, fw.id)["breakdown"] == {"allow": {"any": 1}}
+
+
+def test_stats_endpoint(app, db_session):
+    fw = create_firewall(db_session, "fw_stats_api")
+    add_policy(db_session, fw.id, "p1", [{"action": "allow", "protocol": "udp"}])
+    client = app.test_client()
+
+    response = client.get("/api/firewalls/stats")
+    assert response.status_code == 200
+    (stats,) = [s for s in response.get_json() if s["firewall_id"] == fw.id]
+    assert stats["rules"] == 1
+    assert stats["breakdown"] == {"allow": {"udp": 1}}
+
+    delete_firewall(db_session, fw.id)
+    ids = [s["firewall_id"] for s in client.get("/api/firewalls/stats").get_json()]
+    assert fw.id not in ids
+
+
+def test_stats_endpoint_fields(app, db_session):
+    fw = create_firewall(db_session, "fw_stats_fields")
+    add_policy(db_session, fw.id, "p1", [{"action": "deny"}])
+    client = app.test_client()
+
+    response = client.get("/api/firewalls/stats?fields=firewall_id,rules")
+    assert response.status_code == 200
+    assert {"firewall_id": fw.id, "rules": 1} in response.get_json()
+    assert all(set(s) == {"firewall_id", "rules"} for s in response.get_json())
+    (stats,) = [
+        s
+        for s in list_firewall_stats(db_session, {"name": None, "breakdown": None})
+        if s["name"] == "fw_stats_fields"
+    ]
+    assert stats == {"name": "fw_stats_fields", "breakdown": {"deny": {"any": 1}}}
+    assert client.get("/api/firewalls/stats?fields=nope").status_code == 400
+
+
+def test_backfill_on_upgrade(tmp_path):
+    """Starting on a database without the summary tables fills them."""
+    config = {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/old.db",
+    }
+    with create_app(config).app_context():
+        fw = create_firewall(db.session, "fw_stats_old")
+        add_policy(db.session, fw.id, "p1", [{"action": "deny"}])
+        FirewallRuleCount.__table__.drop(db.engine)
+        FirewallStat.__table__.drop(db.engine)
+        db.session.remove()
+
+    with create_app(config).app_context():
+        assert _stats(db.session, fw.id)["breakdown"] == {"deny": {"any": 1}}
+        db.session.remove()
@@ -0,0 +1,124 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from flask import jsonify
+
+from app import create_app
+from app.db import db
+from app.idempotency import idempotent
+from app.models.firewall import Firewall
+from app.models.idempotency import IdempotencyRecord
+
+
+@pytest.fixture
+def client(app, db_session):
+    return app.test_client()
+
+
+def test_retry_replays_stored_response(client, db_session):
+    """A retried create returns the first response without writing again."""
+    headers = {"Idempotency-Key": "create-fw-1"}
+    body = {"name": "fw_idempotent", "description": "desc"}
+    first = client.post("/api/firewalls/", json=body, headers=headers)
+    retry = client.post("/api/firewalls/", json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.json == first.json
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert db_session.query(Firewall).filter_by(name="fw_idempotent").count() == 1
+
+
+def test_key_reused_for_different_request(client):
+    """Reusing a key with another body is rejected."""
+    headers = {"Idempotency-Key": "create-fw-2"}
+    client.post("/api/firewalls/", json={"name": "fw_idem_a"}, headers=headers)
+    response = client.post(
+        "/api/firewalls/", json={"name": "fw_idem_b"}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+def test_failed_request_not_stored(client, db_session):
+    """Error responses are not stored, so the request can be retried."""
+    headers = {"Idempotency-Key": "add-policy-missing-fw"}
+    response = client.post(
+        "/api/policies/firewall/9999", json={"name": "p"}, headers=headers
+    )
+    assert response.status_code == 404
+    assert db_session.get(IdempotencyRecord, "add-policy-missing-fw") is None
+
+
+def test_expired_record_is_replaced(client, db_session):
+    """Once the TTL passed, the key executes the request again."""
+    headers = {"Idempotency-Key": "create-fw-expired"}
+    first = client.post(
+        "/api/firewalls/", json={"name": "fw_idem_expired"}, headers=headers
+    )
+    record = db_session.get(IdempotencyRecord, "create-fw-expired")
+    record.expires_at = datetime.now() - timedelta(days=2)
+    db_session.commit()
+
+    client.delete(f"/api/firewalls/{first.json['id']}")
+    response = client.post(
+        "/api/firewalls/", json={"name": "fw_idem_expired"}, headers=headers
+    )
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+    assert db_session.get(IdempotencyRecord, "create-fw-expired").expires_at > (
+        datetime.now()
+    )
+
+
+def test_requests_without_key_are_not_stored(client, db_session):
+    """Requests without the header behave as before."""
+    before = db_session.query(IdempotencyRecord).count()
+    client.post("/api/firewalls/", json={"name": "fw_no_key"})
+    assert db_session.query(IdempotencyRecord).count() == before
+
+
+def test_retry_while_in_progress(tmp_path):
+    """A retry arriving before the first request finished does not run it again."""
+    app = create_app(
+        {"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/idem.db"}
+    )
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_create():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return jsonify({"created": len(calls)}), 201
+
+    def failing_create():
+        raise RuntimeError("write failed")
+
+    app.add_url_rule("/slow", view_func=idempotent(slow_create), methods=["POST"])
+    app.add_url_rule("/failing", view_func=idempotent(failing_create), methods=["POST"])
+    client = app.test_client()
+    headers = {"Idempotency-Key": "slow-1"}
+    first = []
+    thread = threading.Thread(
+        target=lambda: first.append(client.post("/slow", json={}, headers=headers))
+    )
+    thread.start()
+    assert started.wait(5)
+
+    retry = client.post("/slow", json={}, headers=headers)
+    assert retry.status_code == 409
+    assert retry.headers["Retry-After"] == "1"
+    assert client.post("/slow", json={"other": 1}, headers=headers).status_code == 422
+    release.set()
+    thread.join()
+    assert first[0].status_code == 201
+    replay = client.post("/slow", json={}, headers=headers)
+    assert replay.json == {"created": 1}
+    assert calls == [1]
+
+    # A request raising releases its key
+    with pytest.raises(RuntimeError):
+        client.post("/failing", json={}, headers={"Idempotency-Key": "fail-1"})
+    with app.app_context():
+        assert db.session.get(IdempotencyRecord, "fail-1") is None
+        db.session.remove()
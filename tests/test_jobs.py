@@ -0,0 +1,238 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from app.db import db
+from app.jobs import WORKER, JobCancelled, JobContext, get_runner, task
+from app.models.firewall import Firewall
+from app.models.job import Job
+from app.services.policy import add_policy
+
+
+@task("test.count")
+def _count_job(db, job, n: int) -> dict:
+    for i in range(n):
+        job.progress(i + 1, n)
+    return {"counted": n}
+
+
+@task("test.cancel_midway")
+def _cancel_midway_job(db, job, name: str) -> dict:
+    db.add(Firewall(name=name))
+    db.flush()
+    job.progress(1, 2)
+    job.runner._cancelled.add(job.job_id)
+    job.progress(2, 2)
+    return {}
+
+
+@pytest.fixture
+def client(app, db_session, monkeypatch):
+    """A test client whose jobs run inline."""
+    monkeypatch.setitem(app.config, "JOBS_SYNC", True)
+    return app.test_client()
+
+
+def test_async_batch_upsert(client, db_session):
+    """async=true answers 202 and the job holds the usual response."""
+    body = [{"name": "fw_job_a"}, {"name": "fw_job_b"}, {}]
+    response = client.post("/api/firewalls/:batch?async=true", json=body)
+    assert response.status_code == 202
+    assert response.headers["Location"] == f"/api/jobs/{response.json['id']}"
+
+    job = client.get(response.headers["Location"]).json
+    assert job["status"] == "succeeded"
+    assert job["kind"] == "firewalls.batch_upsert"
+    assert job["done"] == job["total"] == 2
+    assert job["result"]["created"] == 2
+    assert job["result"]["error"] == 1
+    assert db_session.query(Firewall).filter_by(name="fw_job_b").count() == 1
+
+
+def test_job_fields(client):
+    """fields= limits the job to the requested keys."""
+    response = client.post(
+        "/api/firewalls/:batch?async=true", json=[{"name": "fw_job_f"}]
+    )
+    location = response.headers["Location"]
+    job = client.get(f"{location}?fields=status,result").json
+    assert set(job) == {"status", "result"}
+    assert job["status"] == "succeeded"
+    assert job["result"]["created"] == 1
+    assert client.get(f"{location}?fields=bogus").status_code == 400
+
+
+def test_async_endpoint_checks_existence(client):
+    """Missing resources are still reported synchronously."""
+    assert client.delete("/api/firewalls/999999?async=true").status_code == 404
+    response = client.post("/api/policies/999999/optimize?async=true")
+    assert response.status_code == 404
+
+
+def test_failed_job_records_error(client, db_session):
+    """A job whose task raises is failed with the error and rolled back."""
+    fw = Firewall(name="fw_job_dup")
+    db_session.add(fw)
+    db_session.commit()
+    policy = add_policy(db_session, fw.id, "p", [{"action": "allow"}])
+    rules = [{"action": "deny", "src": "10.0.0.1"}] * 2
+    response = client.put(f"/api/rules/policy/{policy.id}?async=true", json=rules)
+    job = client.get(response.headers["Location"]).json
+    assert job["status"] == "failed"
+    assert "Duplicate" in job["error"]
+    assert len(client.get(f"/api/rules/policy/{policy.id}").json) == 1
+
+
+def test_running_job_cancelled_rolls_back(app, client, db_session):
+    """A cancelled job stops at its next progress report without committing."""
+    with app.test_request_context():
+        job = get_runner().submit("test.cancel_midway", {"name": "fw_job_cancel"})
+    job = client.get(f"/api/jobs/{job.id}").json
+    assert job["status"] == "cancelled"
+    assert job["done"] == 2
+    assert db_session.query(Firewall).filter_by(name="fw_job_cancel").count() == 0
+
+
+def test_cancel_queued_and_running(app, client, db_session):
+    """Queued jobs are cancelled outright; running ones are flagged."""
+    now = datetime.utcnow()
+    queued = Job(
+        kind="test.count",
+        status="queued",
+        params='{"n": 1}',
+        worker=WORKER,
+        created_at=now,
+    )
+    running = Job(
+        kind="test.count",
+        status="running",
+        params='{"n": 1}',
+        worker=WORKER,
+        created_at=now,
+    )
+    db_session.add_all([queued, running])
+    db_session.commit()
+
+    assert client.post(f"/api/jobs/{queued.id}/cancel").json["status"] == "cancelled"
+    runner = app.extensions["jobs"]
+    # A cancelled job is never claimed
+    runner._run(queued.id)
+    db_session.refresh(queued)
+    assert queued.status == "cancelled"
+
+    assert client.post(f"/api/jobs/{running.id}/cancel").json["status"] == "running"
+    db_session.refresh(running)
+    assert running.cancel_requested
+    assert running.id in runner._cancelled
+    with pytest.raises(JobCancelled):
+        JobContext(runner, running.id).progress(0)
+    runner._cancelled.discard(running.id)
+    assert client.post("/api/jobs/999999/cancel").status_code == 404
+
+
+def test_thread_pool_and_recovery(tmp_path):
+    """Jobs run on the pool; interrupted ones are failed on the next start."""
+    config = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'jobs.db'}"}
+    app = create_app(config)
+    client = app.test_client()
+    with app.test_request_context():
+        job = get_runner().submit("test.count", {"n": 3})
+    deadline = time.monotonic() + 5
+    while (state := client.get(f"/api/jobs/{job.id}").json)["status"] != "succeeded":
+        assert time.monotonic() < deadline, state
+        time.sleep(0.01)
+    assert state["result"] == {"counted": 3}
+    app.extensions["jobs"].shutdown()
+
+    host = WORKER.rpartition(":")[0]
+    old = datetime.utcnow() - timedelta(days=1)
+    with app.app_context():
+        db.session.add_all(
+            [
+                # Dead process on this host
+                Job(
+                    kind="test.count",
+                    status="running",
+                    params="{}",
+                    worker=f"{host}:{2**22 + 1}",
+                    created_at=old,
+                ),
+                # Same PID as this process but from before it started
+                Job(
+                    kind="test.count",
+                    status="queued",
+                    params="{}",
+                    worker=WORKER,
+                    created_at=old,
+                ),
+                # Another host: left alone
+                Job(
+                    kind="test.count",
+                    status="running",
+                    params="{}",
+                    worker="elsewhere:1",
+                    created_at=old,
+                ),
+                # Live process on this host
+                Job(
+                    kind="test.count",
+                    status="running",
+                    params="{}",
+                    worker=f"{host}:{os.getppid()}",
+                    created_at=old,
+                ),
+            ]
+        )
+        db.session.commit()
+
+    restarted = create_app(config)
+    with restarted.app_context():
+        statuses = [
+            status for status, in db.session.query(Job.status).order_by(Job.id).all()
+        ]
+    assert statuses == ["succeeded", "failed", "failed", "running", "running"]
+
+
+@pytest.mark.parametrize(
+    "kind, method, url",
+    [
+        ("delete_all", "delete", "/api/rules/policy/{policy_id}?all=true"),
+        ("delete_ids", "delete", "/api/rules/policy/{policy_id}?ids={rule_id}"),
+        ("replace", "put", "/api/rules/policy/{policy_id}"),
+        ("fw_delete", "delete", "/api/firewalls/{fw_id}"),
+        ("optimize", "post", "/api/policies/{policy_id}/optimize?mode=apply"),
+    ],
+)
+def test_bulk_jobs_can_be_cancelled(client, db_session, monkeypatch, kind, method, url):
+    """Bulk jobs report progress, so a cancellation rolls their writes back."""
+    fw = Firewall(name=f"fw_job_cancel_{kind}")
+    db_session.add(fw)
+    db_session.commit()
+    rules = [
+        {"action": "allow", "src": "10.0.0.0/8"},
+        {"action": "allow", "src": "10.1.1.1"},
+    ]
+    policy = add_policy(db_session, fw.id, "p", rules)
+    fw_id, policy_id, rule_id = fw.id, policy.id, policy.rules[0].id
+
+    report = JobContext.progress
+
+    def cancel_then_report(self, done, total=None):
+        self.runner._cancelled.add(self.job_id)
+        report(self, done, total)
+
+    monkeypatch.setattr(JobContext, "progress", cancel_then_report)
+    url = url.format(fw_id=fw_id, policy_id=policy_id, rule_id=rule_id)
+    body = [{"action": "deny"}] if method == "put" else None
+    response = getattr(client, method)(
+        f"{url}{'&' if '?' in url else '?'}async=true", json=body
+    )
+    assert response.status_code == 202
+    assert client.get(response.headers["Location"]).json["status"] == "cancelled"
+    db_session.expire_all()
+    assert db_session.get(Firewall, fw_id) is not None
+    listed = client.get(f"/api/rules/policy/{policy_id}").json
+    assert [r["src"] for r in listed] == ["10.0.0.0/8", "10.1.1.1"]
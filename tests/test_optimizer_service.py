@@ -0,0 +1,101 @@
+import random
+from ipaddress import ip_address, ip_network
+
+import pytest
+
+from app.models.firewall import Firewall
+from app.services.canonical import canonicalize_rule
+from app.services.optimizer import optimize_policy, optimize_rules
+from app.services.policy import add_policy
+from app.services.rule import list_rules
+
+
+def _verdict(rules, src, dst, protocol):
+    """Reference first-match evaluation over rule dicts."""
+    for r in rules:
+        if r["protocol"] and r["protocol"] != protocol:
+            continue
+        if r["src"] and ip_address(src) not in ip_network(r["src"]):
+            continue
+        if r["dst"] and ip_address(dst) not in ip_network(r["dst"]):
+            continue
+        return r["action"]
+    return None
+
+
+def test_optimize_rules_merges_adjacent_hosts():
+    """A run of /32 rules with the same action and protocol collapses to a /24."""
+    rules = [canonicalize_rule("allow", f"10.0.0.{i}", None, "tcp") for i in range(256)]
+    assert optimize_rules(rules) == [
+        {"action": "allow", "src": "10.0.0.0/24", "dst": None, "protocol": "tcp"}
+    ]
+
+
+def test_optimize_rules_respects_intervening_rule():
+    """A rule only moves above intervening rules with another action it misses."""
+    blocked = [
+        canonicalize_rule("allow", "10.0.0.0"),
+        canonicalize_rule("deny", "10.0.0.1"),
+        canonicalize_rule("allow", "10.0.0.1"),
+    ]
+    assert optimize_rules(blocked) == [
+        {k: r[k] for k in ("action", "src", "dst", "protocol")} for r in blocked
+    ]
+
+    disjoint = [
+        canonicalize_rule("allow", "10.0.0.0"),
+        canonicalize_rule("deny", "10.0.0.5"),
+        canonicalize_rule("allow", "10.0.0.1"),
+    ]
+    assert [(r["action"], r["src"]) for r in optimize_rules(disjoint)] == [
+        ("allow", "10.0.0.0/31"),
+        ("deny", "10.0.0.5"),
+    ]
+
+
+def test_optimize_rules_preserves_verdicts():
+    """Randomized rule sets keep the same first-match verdict for every flow."""
+    rng = random.Random(7)
+    for _ in range(100):
+        rules = [
+            canonicalize_rule(
+                rng.choice(["allow", "deny"]),
+                f"10.0.0.{rng.randint(0, 15)}/{rng.choice([28, 29, 30, 31, 32])}",
+                rng.choice([None, "10.1.0.0/31", "10.1.0.2"]),
+                rng.choice([None, "tcp", "udp"]),
+            )
+            for _ in range(rng.randint(1, 25))
+        ]
+        optimized = optimize_rules(rules)
+        assert len(optimized) <= len(rules)
+        for s in range(16):
+            for d in range(4):
+                for proto in ("tcp", "udp"):
+                    flow = (f"10.0.0.{s}", f"10.1.0.{d}", proto)
+                    assert _verdict(rules, *flow) == _verdict(optimized, *flow)
+
+
+@pytest.mark.parametrize("apply", [False, True])
+def test_optimize_policy(db_session, apply):
+    """Dry-run leaves the policy untouched; apply replaces its rules."""
+    fw = Firewall(name=f"fw_optimize_{apply}")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    rules = [{"action": "deny", "dst": f"192.168.1.{i}"} for i in range(4)]
+    policy = add_policy(db_session, fw.id, "to_optimize", rules)
+    result = optimize_policy(db_session, policy.id, apply=apply)
+    assert result["before"] == 4
+    assert result["after"] == 1
+    assert result["applied"] is apply
+    stored = list_rules(db_session, policy.id)
+    assert len(stored) == (1 if apply else 4)
+    if apply:
+        assert stored[0].dst == "192.168.1.0/30"
+
+
+def test_optimize_invalid_policy(db_session):
+    """Optimizing a non-existent policy should raise ValueError."""
+    with pytest.raises(ValueError):
+        optimize_policy(db_session, 9999)
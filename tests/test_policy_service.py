@@ -1,7 +1,10 @@
 import pytest
+from sqlalchemy import func, select
 
 from app.models.firewall import Firewall
 from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.services.canonical import DuplicateRuleError
 from app.services.policy import add_policy, delete_policy, list_policies
 
 
@@ -40,6 +43,29 @@ def test_list_policies(db_session):
     assert "p1" in names and "p2" in names
 
 
+@pytest.mark.parametrize("count", [2, 10])
+def test_list_policies_query_count(app, db_session, assert_max_queries, count):
+    """Listing policies costs the same number of queries however many there are."""
+    fw = Firewall(name=f"fw_list_queries_{count}")
+    db_session.add(fw)
+    db_session.commit()
+    for i in range(count):
+        add_policy(
+            db_session, fw.id, f"p{i}", [{"action": "allow", "src": f"10.0.0.{i}"}]
+        )
+    db_session.expire_all()
+
+    with assert_max_queries(4):
+        policies = list_policies(db_session, fw.id)
+    assert [len(p.rules) for p in policies] == [1] * count
+
+    # The endpoint adds one firewall version lookup
+    db_session.expire_all()
+    with assert_max_queries(5):
+        response = app.test_client().get(f"/api/policies/firewall/{fw.id}")
+    assert len(response.json) == count
+
+
 def test_list_policies_invalid_firewall(db_session):
     """Listing policies for a non-existent firewall should raise ValueError."""
     with pytest.raises(ValueError):
@@ -59,7 +85,43 @@ def test_delete_policy(db_session):
     assert db_session.get(FilteringPolicy, policy.id) is None
 
 
+def test_delete_policy_cascades_rules(db_session):
+    """Deleting a policy removes its rules through ON DELETE CASCADE."""
+    fw = Firewall(name="fw_del_policy_cascade")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(
+        db_session, fw.id, "cascade", [{"action": "allow"}, {"action": "deny"}]
+    )
+    assert delete_policy(db_session, policy.id) is True
+    remaining = db_session.scalar(
+        select(func.count()).select_from(Rule).where(Rule.policy_id == policy.id)
+    )
+    assert remaining == 0
+
+
 def test_delete_nonexistent_policy(db_session):
     """Deleting a non-existent policy should return False."""
     result = delete_policy(db_session, 9999)
     assert result is False
+
+
+def test_add_policy_duplicate_rules(db_session):
+    """Duplicate rules are rejected by default and skipped on report."""
+    fw = Firewall(name="fw_policy_dup")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    rules = [
+        {"action": "deny", "protocol": "UDP"},
+        {"action": "deny", "protocol": "udp"},
+    ]
+    with pytest.raises(DuplicateRuleError):
+        add_policy(db_session, fw.id, "dup", rules)
+    assert list_policies(db_session, fw.id) == []
+
+    policy = add_policy(db_session, fw.id, "dup", rules, on_duplicate="report")
+    assert len(policy.rules) == 1
@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from app.metrics import metrics
+from app.ratelimit import LocalBackend, RateLimitBackend, RateLimiter
+
+
+class FakeSharedBackend(RateLimitBackend):
+    """In-memory stand-in for a shared store, recording every call."""
+
+    def __init__(self):
+        self.calls = []
+        self._local = LocalBackend(clock=lambda: 0.0)
+
+    def acquire(self, key, rate, burst, cost=1.0):
+        self.calls.append(key)
+        return self._local.acquire(key, rate, burst, cost)
+
+
+def _make_app(backend, **config):
+    app = Flask(__name__)
+    app.config.update(config)
+    limiter = RateLimiter(app, backend)
+
+    @app.route("/ping")
+    def ping():
+        return {"ok": True}
+
+    return app, limiter
+
+
+def test_local_backend_refills():
+    """Buckets allow a burst, then refill at the configured rate."""
+    now = [0.0]
+    backend = LocalBackend(clock=lambda: now[0])
+    assert [backend.acquire("k", rate=1.0, burst=2) for _ in range(2)] == [0.0, 0.0]
+    assert backend.acquire("k", rate=1.0, burst=2) == pytest.approx(1.0)
+    now[0] = 1.0
+    assert backend.acquire("k", rate=1.0, burst=2) == 0.0
+    assert backend.acquire("other", rate=1.0, burst=2) == 0.0
+
+
+def test_local_backend_drops_idle_buckets():
+    """Buckets refilled to their burst are swept; partly drained ones stay."""
+    now = [0.0]
+    backend = LocalBackend(clock=lambda: now[0], sweep_interval=10)
+    for client in range(100):
+        backend.acquire(f"idle{client}", rate=1.0, burst=2)
+    backend.acquire("busy", rate=0.01, burst=2)
+    backend.acquire("busy", rate=0.01, burst=2)
+    assert len(backend) == 101
+    now[0] = 10.0
+    assert backend.acquire("new", rate=1.0, burst=2) == 0.0
+    assert len(backend) == 2
+    # The swept state is the one a fresh bucket would have
+    assert backend.acquire("busy", rate=0.01, burst=2) > 0
+
+
+def test_backend_is_abstract():
+    """Backends must implement acquire."""
+    with pytest.raises(TypeError):
+        RateLimitBackend()
+
+
+def test_rate_limited_per_client_and_route():
+    """Clients are limited independently and get 429 with Retry-After."""
+    backend = FakeSharedBackend()
+    app, _ = _make_app(
+        backend,
+        RATELIMIT_ROUTES={"ping": (1.0, 2)},
+        RATELIMIT_CLIENT_HEADER="X-Client-Id",
+    )
+    client = app.test_client()
+    before = metrics.get("ratelimit.rejected.rate")
+    a = [
+        client.get("/ping", headers={"X-Client-Id": "a"}).status_code for _ in range(3)
+    ]
+    b = client.get("/ping", headers={"X-Client-Id": "b"})
+    assert a == [200, 200, 429]
+    assert b.status_code == 200
+    assert backend.calls == ["a:ping", "a:ping", "a:ping", "b:ping"]
+    assert metrics.get("ratelimit.rejected.rate") == before + 1
+
+
+def test_shared_backend_across_workers():
+    """Two app instances sharing a backend draw from the same buckets."""
+    backend = FakeSharedBackend()
+    config = {"RATELIMIT_DEFAULT": (1.0, 1)}
+    first, _ = _make_app(backend, **config)
+    second, _ = _make_app(backend, **config)
+    assert first.test_client().get("/ping").status_code == 200
+    response = second.test_client().get("/ping")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_concurrency_limit_sheds_load():
+    """Requests beyond the concurrency limit are rejected with 503."""
+    app, limiter = _make_app(LocalBackend(), MAX_CONCURRENT_REQUESTS=1)
+    client = app.test_client()
+    assert limiter._slots.acquire(blocking=False)
+    try:
+        response = client.get("/ping")
+        assert response.status_code == 503
+    finally:
+        limiter._slots.release()
+    assert client.get("/ping").status_code == 200
+    # The slot taken by the admitted request was released
+    assert limiter._slots.acquire(blocking=False)
+
+
+def test_disabled():
+    """RATELIMIT_ENABLED=False skips every check."""
+    app, _ = _make_app(
+        LocalBackend(), RATELIMIT_ENABLED=False, RATELIMIT_DEFAULT=(0.0, 0)
+    )
+    assert app.test_client().get("/ping").status_code == 200
+
+
+def test_concurrent_requests_release_slots():
+    """Slots are returned after each request under concurrent load."""
+    app, limiter = _make_app(LocalBackend(), MAX_CONCURRENT_REQUESTS=4)
+    statuses = []
+
+    def worker():
+        client = app.test_client()
+        for _ in range(20):
+            statuses.append(client.get("/ping").status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert set(statuses) <= {200, 429, 503}
+    for _ in range(4):
+        assert limiter._slots.acquire(blocking=False)
@@ -1,9 +1,19 @@
 import pytest
+from sqlalchemy import func, inspect, select
 
+from app import create_app
+from app.db import db
 from app.models.firewall import Firewall
 from app.models.rule import Rule
+from app.services.canonical import DuplicateRuleError
 from app.services.policy import add_policy
-from app.services.rule import add_rule, delete_rule, list_rules
+from app.services.rule import (
+    add_rule,
+    delete_rule,
+    delete_rules,
+    list_rules,
+    replace_rules,
+)
 
 
 @pytest.mark.parametrize("action", ["allow", "deny"])
@@ -48,6 +58,24 @@ def test_list_rules(db_session):
     assert "allow" in actions and "deny" in actions
 
 
+def test_list_rules_query_count(app, db_session, assert_max_queries):
+    """Listing rules reads the version, the policy and its rules."""
+    fw = Firewall(name="fw_list_rules_queries")
+    db_session.add(fw)
+    db_session.commit()
+    policy = add_policy(
+        db_session,
+        fw.id,
+        "p",
+        [{"action": "allow", "src": f"10.0.0.{i}"} for i in range(20)],
+    )
+    db_session.expire_all()
+
+    with assert_max_queries(3):
+        response = app.test_client().get(f"/api/rules/policy/{policy.id}")
+    assert len(response.json) == 20
+
+
 def test_list_rules_invalid_policy(db_session):
     """Listing rules for a non-existent policy should raise ValueError."""
     with pytest.raises(ValueError):
@@ -72,3 +100,242 @@ def test_delete_nonexistent_rule(db_session):
     """Deleting a non-existent rule should return False."""
     result = delete_rule(db_session, 9999)
     assert result is False
+
+
+def test_delete_rules_by_ids(db_session):
+    """Bulk delete removes only the selected rules of the policy."""
+    fw = Firewall(name="fw_bulk_del")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(db_session, fw.id, "policy_bulk_del", [])
+    r1 = add_rule(db_session, policy.id, "allow")
+    r2 = add_rule(db_session, policy.id, "deny")
+    r3 = add_rule(db_session, policy.id, "allow", "10.0.0.1")
+    deleted = delete_rules(db_session, policy.id, [r1.id, r3.id])
+    assert deleted == 2
+    assert [r.id for r in list_rules(db_session, policy.id)] == [r2.id]
+
+
+def test_delete_rules_all(db_session):
+    """Bulk delete with all_rules empties the policy; it is never implied."""
+    fw = Firewall(name="fw_bulk_del_all")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(db_session, fw.id, "policy_bulk_del_all", [])
+    add_rule(db_session, policy.id, "allow")
+    add_rule(db_session, policy.id, "deny")
+    with pytest.raises(ValueError):
+        delete_rules(db_session, policy.id)
+    with pytest.raises(ValueError):
+        delete_rules(db_session, policy.id, [1], all_rules=True)
+    assert delete_rules(db_session, policy.id, all_rules=True) == 2
+    assert list_rules(db_session, policy.id) == []
+
+
+def test_delete_rules_endpoint_requires_ids_or_all(app, db_session):
+    """The endpoint never empties a policy unless all=true is given."""
+    fw = Firewall(name="fw_bulk_del_api")
+    db_session.add(fw)
+    db_session.commit()
+    policy = add_policy(db_session, fw.id, "p", [{"action": "allow"}])
+    client = app.test_client()
+    url = f"/api/rules/policy/{policy.id}"
+    assert client.delete(url).status_code == 400
+    assert client.delete(f"{url}?all=false").status_code == 400
+    assert client.delete(f"{url}?ids=1&all=true").status_code == 400
+    assert len(list_rules(db_session, policy.id)) == 1
+    response = client.delete(f"{url}?all=true")
+    assert response.status_code == 200
+    assert response.json == {"deleted": 1}
+
+
+def test_delete_rules_invalid_policy(db_session):
+    """Bulk delete on a non-existent policy should raise ValueError."""
+    with pytest.raises(ValueError):
+        delete_rules(db_session, 9999, [1])
+
+
+def test_replace_rules(db_session):
+    """Replacing rules swaps the whole rule set and reports counts."""
+    fw = Firewall(name="fw_replace")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(
+        db_session, fw.id, "policy_replace", [{"action": "allow"}, {"action": "deny"}]
+    )
+    result = replace_rules(
+        db_session,
+        policy.id,
+        [
+            {"action": "deny", "src": "10.0.0.1", "protocol": "udp"},
+            {"action": "allow", "dst": "10.0.0.2", "protocol": "tcp"},
+            {"action": "deny"},
+        ],
+    )
+    assert result == {"deleted": 2, "created": 3, "duplicates": 0}
+    rules = list_rules(db_session, policy.id)
+    assert [r.action for r in rules] == ["deny", "allow", "deny"]
+    assert rules[0].src == "10.0.0.1"
+
+
+def test_replace_rules_invalid_policy(db_session):
+    """Replacing rules of a non-existent policy should raise ValueError."""
+    with pytest.raises(ValueError):
+        replace_rules(db_session, 9999, [])
+
+
+def test_add_rule_canonicalizes(db_session):
+    """Rules are stored with normalized networks and lowercase protocol."""
+    fw = Firewall(name="fw_canonical")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(db_session, fw.id, "policy_canonical", [])
+    rule = add_rule(db_session, policy.id, "Deny", "10.0.0.5/24", "8.8.8.8/32", "TCP")
+    assert rule.action == "deny"
+    assert rule.src == "10.0.0.0/24"
+    assert rule.dst == "8.8.8.8"
+    assert rule.protocol == "tcp"
+
+
+@pytest.mark.parametrize("action", ["bogus", 5, None])
+def test_add_rule_invalid_action(app, db_session, action):
+    """Only allow and deny are stored, through the service or the endpoint."""
+    fw = Firewall(name=f"fw_bad_action_{action}")
+    db_session.add(fw)
+    db_session.commit()
+    policy = add_policy(db_session, fw.id, "p", [])
+    with pytest.raises(ValueError):
+        add_rule(db_session, policy.id, action)
+    with pytest.raises(ValueError):
+        add_policy(db_session, fw.id, "p2", [{"action": action}])
+    client = app.test_client()
+    url = f"/api/rules/policy/{policy.id}"
+    assert client.post(url, json={"action": action}).status_code == 400
+    response = client.post(
+        f"/api/policies/firewall/{fw.id}",
+        json={"name": "p3", "rules": [{"action": action}]},
+    )
+    assert response.status_code == 400
+    assert client.get(url).json == []
+    assert len(client.get(f"/api/policies/firewall/{fw.id}").json) == 1
+
+
+def test_add_rule_duplicate(db_session):
+    """Adding a rule equal in canonical form raises with the existing rule."""
+    fw = Firewall(name="fw_dup_rule")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(db_session, fw.id, "policy_dup_rule", [])
+    first = add_rule(db_session, policy.id, "allow", "10.0.0.1", None, "tcp")
+    with pytest.raises(DuplicateRuleError) as exc:
+        add_rule(db_session, policy.id, "ALLOW", "10.0.0.1/32", None, "Tcp")
+    assert exc.value.rule.id == first.id
+    assert len(list_rules(db_session, policy.id)) == 1
+
+
+def test_replace_rules_duplicates(db_session):
+    """Duplicates in a replace are rejected, or skipped and counted on report."""
+    fw = Firewall(name="fw_replace_dup")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+
+    policy = add_policy(db_session, fw.id, "policy_replace_dup", [])
+    rules = [
+        {"action": "allow", "src": "10.0.0.0/8"},
+        {"action": "allow", "src": "10.1.2.3/8"},
+    ]
+    with pytest.raises(DuplicateRuleError):
+        replace_rules(db_session, policy.id, rules)
+    result = replace_rules(db_session, policy.id, rules, on_duplicate="report")
+    assert result == {"deleted": 0, "created": 1, "duplicates": 1}
+
+
+def test_hash_rules_on_upgrade(tmp_path):
+    """Rules of a database created before rule hashes are hashed on request."""
+    config = {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/old.db",
+    }
+    with create_app(config).app_context():
+        fw = Firewall(name="fw_upgrade")
+        db.session.add(fw)
+        db.session.commit()
+        policy = add_policy(db.session, fw.id, "p1", [])
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_rules_policy_hash")
+            conn.exec_driver_sql("ALTER TABLE rules DROP COLUMN hash")
+            conn.exec_driver_sql(
+                "INSERT INTO rules (action, src, protocol, policy_id) VALUES "
+                f"('Allow', '10.0.0.1/32', 'TCP', {policy.id}), "
+                f"('deny', NULL, NULL, {policy.id}), "
+                f"('allow', '10.0.0.1', 'tcp', {policy.id})"
+            )
+        db.session.remove()
+
+    app = create_app(config)
+    with app.app_context():
+        # Starting the app changes nothing
+        assert "hash" not in {
+            c["name"] for c in inspect(db.engine).get_columns("rules")
+        }
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["schema", "upgrade", "--dry-run"])
+        assert result.exit_code == 0, result.output
+        assert "Would hash 2 rules" in result.output
+        assert "Would delete rule id=3 of policy id=" in result.output
+        assert db.session.scalar(select(func.count()).select_from(Rule)) == 3
+
+        result = runner.invoke(args=["schema", "upgrade"])
+        assert result.exit_code == 0, result.output
+        assert "Deleted rule id=3" in result.output
+        indexes = inspect(db.engine).get_indexes("rules")
+        assert "ix_rules_policy_hash" in {ix["name"] for ix in indexes}
+        rules = db.session.scalars(select(Rule).order_by(Rule.id)).all()
+        assert [(r.action, r.src, r.protocol) for r in rules] == [
+            ("allow", "10.0.0.1", "tcp"),
+            ("deny", None, None),
+        ]
+        with pytest.raises(DuplicateRuleError):
+            add_rule(db.session, policy.id, "deny")
+        result = runner.invoke(args=["schema", "upgrade"])
+        assert result.output == "Schema is up to date\n"
+        db.session.remove()
+
+
+def test_upgrade_rejects_invalid_actions(tmp_path):
+    """Upgrading stops, changing nothing, on rules it cannot canonicalize."""
+    config = {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/old.db",
+    }
+    app = create_app(config)
+    with app.app_context():
+        fw = Firewall(name="fw_upgrade_invalid")
+        db.session.add(fw)
+        db.session.commit()
+        policy = add_policy(db.session, fw.id, "p1", [])
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_rules_policy_hash")
+            conn.exec_driver_sql("ALTER TABLE rules DROP COLUMN hash")
+            conn.exec_driver_sql(
+                "INSERT INTO rules (action, policy_id) VALUES "
+                f"('reject', {policy.id})"
+            )
+        result = app.test_cli_runner().invoke(args=["schema", "upgrade"])
+        assert result.exit_code == 1
+        assert "action other than allow or deny: [1]" in result.output
+        assert "hash" not in {
+            c["name"] for c in inspect(db.engine).get_columns("rules")
+        }
+        db.session.remove()
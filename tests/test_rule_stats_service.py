@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+from app import create_app
+from app.db import db
+from app.models.firewall import Firewall
+from app.models.rule_stat import RuleStat
+from app.services.policy import add_policy
+from app.services.rule_stats import (
+    HitCounter,
+    HitFlusher,
+    flush_hits,
+    ingest_hits,
+    list_rules_with_stats,
+)
+
+
+@pytest.fixture
+def policy(db_session, request):
+    """A policy with two rules on its own firewall."""
+    fw = Firewall(name=f"fw_{request.node.name}")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+    return add_policy(
+        db_session, fw.id, "stats", [{"action": "allow"}, {"action": "deny"}]
+    )
+
+
+def test_hit_counter_aggregates():
+    """Recorded batches are summed per rule until drained."""
+    counter = HitCounter()
+    counter.record({1: 3, 2: 1})
+    counter.record({1: 2})
+    assert counter.pending(1) == 5
+    assert counter.drain() == {1: 5, 2: 1}
+    assert counter.pending(1) == 0
+
+
+def test_flush_hits_upserts(db_session, policy):
+    """Flushes add to existing counts instead of overwriting them."""
+    counter = HitCounter(flush_interval=3600)
+    r1, r2 = (r.id for r in policy.rules)
+    counter.record({r1: 10, r2: 1})
+    assert flush_hits(db_session, counter) == 2
+    counter.record({r1: 5})
+    assert flush_hits(db_session, counter) == 1
+    assert db_session.get(RuleStat, r1).hits == 15
+    assert db_session.get(RuleStat, r2).hits == 1
+
+
+def test_flush_hits_drops_unknown_rules(db_session, policy):
+    """Counts for rules that do not exist are discarded."""
+    counter = HitCounter(flush_interval=3600)
+    counter.record({999999: 4})
+    assert flush_hits(db_session, counter) == 0
+    assert db_session.get(RuleStat, 999999) is None
+
+
+def test_ingest_hits_flushes_when_due(db_session, policy):
+    """Ingest only writes to the database once the counter is due."""
+    counter = HitCounter(flush_interval=3600, max_pending=2)
+    r1, r2 = (r.id for r in policy.rules)
+    assert ingest_hits(db_session, {r1: 1}, counter) is False
+    assert db_session.get(RuleStat, r1) is None
+    assert ingest_hits(db_session, {r2: 1}, counter) is True
+    assert db_session.get(RuleStat, r1).hits == 1
+
+
+def test_list_rules_with_stats(db_session, policy):
+    """Listing includes flushed and pending hits; unseen rules report zero."""
+    counter = HitCounter(flush_interval=3600)
+    r1, r2 = (r.id for r in policy.rules)
+    counter.record({r1: 7})
+    flush_hits(db_session, counter)
+    counter.record({r1: 1})
+    rules = list_rules_with_stats(db_session, policy.id, counter)
+    assert [(r.id, r.hits) for r in rules] == [(r1, 8), (r2, 0)]
+    assert rules[0].last_hit is not None
+    assert rules[1].last_hit is None
+
+
+def test_list_rules_with_stats_invalid_policy(db_session):
+    """Listing stats for a non-existent policy should raise ValueError."""
+    with pytest.raises(ValueError):
+        list_rules_with_stats(db_session, 9999)
+
+
+def test_flusher_writes_without_new_hits(tmp_path):
+    """Pending hits are flushed every interval and when the flusher stops."""
+    app = create_app(
+        {"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path}/hits.db"}
+    )
+    counter = HitCounter(flush_interval=0.01)
+    flusher = HitFlusher(app, counter)
+    with app.app_context():
+        fw = Firewall(name="fw_flusher")
+        db.session.add(fw)
+        db.session.commit()
+        (rule_id,) = (
+            r.id
+            for r in add_policy(db.session, fw.id, "p", [{"action": "allow"}]).rules
+        )
+
+        def hits() -> int:
+            db.session.expire_all()
+            stat = db.session.get(RuleStat, rule_id)
+            return stat.hits if stat else 0
+
+        counter.record({rule_id: 3})
+        flusher.start()
+        deadline = time.monotonic() + 5
+        while hits() != 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert hits() == 3
+
+        counter.flush_interval = 3600
+        counter.record({rule_id: 2})
+        flusher.stop()
+        assert hits() == 5
+        db.session.remove()
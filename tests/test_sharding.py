@@ -0,0 +1,227 @@
+import itertools
+from collections import Counter
+
+import pytest
+from sqlalchemy import event, func, select
+
+from app import create_app
+from app.db import db
+from app.models.firewall import Firewall
+from app.models.firewall_stat import FirewallStat
+from app.models.rule import Rule
+from app.models.template import PolicyTemplate
+from app.services.firewall import (
+    create_firewall,
+    delete_firewall,
+    encode_cursor,
+    get_firewall,
+    list_firewalls,
+    update_firewall,
+    upsert_firewalls,
+)
+from app.services.firewall_stats import list_firewall_stats, rebuild_firewall_stats
+from app.services.policy import add_policy, delete_policy
+from app.services.rule import delete_rule, list_rules, replace_rules
+from app.services.rule_stats import HitCounter, flush_hits, list_rules_with_stats
+from app.services.simulation import compiled_firewall
+from app.services.template import (
+    attach_template,
+    create_template,
+    delete_template,
+    update_template_rules,
+)
+from app.sharding import SHARD_SHIFT, shard_for_name, shard_of
+
+SHARDS = 3
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A session over an app sharded across three SQLite files."""
+    uris = [f"sqlite:///{tmp_path / f'shard{i}.db'}" for i in range(SHARDS)]
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": uris[0],
+            "SHARD_DATABASE_URIS": uris[1:],
+        }
+    )
+    with app.app_context():
+        yield db.session
+        db.session.remove()
+
+
+def _names_by_shard(prefix: str, per_shard: int = 1) -> dict[int, list[str]]:
+    """Firewall names hashing to each shard."""
+    names: dict[int, list[str]] = {shard: [] for shard in range(SHARDS)}
+    for i in itertools.count():
+        name = f"{prefix}{i}"
+        shard = shard_for_name(name, SHARDS)
+        if len(names[shard]) < per_shard:
+            names[shard].append(name)
+        if all(len(n) == per_shard for n in names.values()):
+            return names
+
+
+def _count_on(session, shard: int, model) -> int:
+    return session.scalar(
+        select(func.count()).select_from(model),
+        bind_arguments={"shard_id": shard},
+    )
+
+
+def test_rows_live_on_their_firewall_shard(session):
+    """Firewalls are placed by name; policies and rules follow, IDs encode it."""
+    names = _names_by_shard("fw", per_shard=2)
+    for shard, shard_names in names.items():
+        for name in shard_names:
+            fw = create_firewall(session, name)
+            assert shard_of(fw.id) == shard
+            policy = add_policy(session, fw.id, "p", [{"action": "allow"}])
+            assert shard_of(policy.id) == shard
+            assert shard_of(policy.rules[0].id) == shard
+    for shard in range(SHARDS):
+        assert _count_on(session, shard, Firewall) == 2
+        assert _count_on(session, shard, Rule) == 2
+    # The primary keeps its unshifted ID range
+    assert session.scalar(select(func.min(Firewall.id))) < 1 << SHARD_SHIFT
+
+
+def test_reads_and_writes_route_by_id(session):
+    """Lookups, updates and deletes by ID reach the owning shard only."""
+    name = _names_by_shard("route")[2][0]
+    fw = create_firewall(session, name, "before")
+    policy = add_policy(
+        session,
+        fw.id,
+        "p",
+        [{"action": "deny", "src": "10.0.0.1"}, {"action": "allow"}],
+    )
+    session.expunge_all()
+
+    assert update_firewall(session, fw.id, name, "after").description == "after"
+    assert get_firewall(session, fw.id).policies[0].id == policy.id
+    assert len(list_rules(session, policy.id)) == 2
+    assert delete_rule(session, policy.rules[0].id)
+    replace_rules(session, policy.id, [{"action": "deny", "dst": "10.0.0.2"}])
+    assert [r.dst for r in list_rules(session, policy.id)] == ["10.0.0.2"]
+    assert len(compiled_firewall(session, fw.id).segments) == 1
+
+    assert delete_policy(session, policy.id)
+    assert delete_firewall(session, fw.id)
+    assert get_firewall(session, fw.id) is None
+    assert _count_on(session, 2, Firewall) == 0
+
+
+def test_lookups_touch_only_owning_shard(session):
+    """Reads and writes by firewall, policy or rule ID run on one shard."""
+    fw = create_firewall(session, _names_by_shard("touch")[1][0])
+    policy = add_policy(session, fw.id, "p", [{"action": "allow"}])
+    session.expunge_all()
+    statements = Counter()
+    for shard, engine in session.info["shards"].items():
+        event.listen(
+            engine,
+            "before_cursor_execute",
+            lambda *args, shard=shard: statements.update([shard]),
+        )
+    get_firewall(session, fw.id)
+    list_rules(session, policy.id)
+    delete_rule(session, list_rules(session, policy.id)[0].id)
+    assert set(statements) == {1}
+
+
+def test_list_firewalls_merges_shards(session):
+    """Listing fans out to every shard and merges pages in sort order."""
+    names = [n for ns in _names_by_shard("list", per_shard=3).values() for n in ns]
+    ids = [create_firewall(session, name).id for name in names]
+
+    assert [fw.id for fw in list_firewalls(session)] == sorted(ids)
+    assert [fw.id for fw in list_firewalls(session, sort="-id")] == sorted(ids)[::-1]
+    by_name = [fw.name for fw in list_firewalls(session, sort="name", limit=4)]
+    assert by_name == sorted(names)[:4]
+
+    seen, cursor = [], None
+    while page := list_firewalls(session, sort="-name", limit=4, cursor=cursor):
+        seen += [fw.name for fw in page]
+        cursor = encode_cursor(page[-1], "-name")
+    assert seen == sorted(names, reverse=True)
+
+
+def test_names_unique_across_shards(session):
+    """A name held on one shard cannot be reused on another."""
+    names = _names_by_shard("uniq")
+    first = create_firewall(session, names[0][0])
+    second = create_firewall(session, names[1][0])
+    with pytest.raises(ValueError):
+        update_firewall(session, second.id, names[0][0])
+
+    # Renamed rows stay on their shard and are upserted there
+    update_firewall(session, first.id, names[1][0] + "_renamed")
+    with pytest.raises(ValueError):
+        create_firewall(session, names[1][0] + "_renamed")
+    results = upsert_firewalls(
+        session,
+        [{"name": names[1][0] + "_renamed", "description": "d"}, {"name": "new"}],
+    )
+    assert results[0]["status"] == "updated"
+    assert results[0]["id"] == first.id
+    assert results[1]["status"] == "created"
+    assert shard_of(results[1]["id"]) == shard_for_name("new", SHARDS)
+
+
+def test_templates_replicated_to_shards(session):
+    """Templates are readable by policies on every shard and kept in sync."""
+    fws = [create_firewall(session, ns[0]) for ns in _names_by_shard("tpl").values()]
+    template = create_template(session, "tpl", [{"action": "deny"}])
+    for shard in range(SHARDS):
+        assert _count_on(session, shard, PolicyTemplate) == 1
+
+    policies = [attach_template(session, fw.id, template.id) for fw in fws]
+    update_template_rules(session, template.id, [{"action": "allow"}])
+    session.expunge_all()
+    for fw in fws:
+        rules = get_firewall(session, fw.id).policies[0].rules
+        assert [r.action for r in rules] == ["allow"]
+
+    with pytest.raises(ValueError):
+        delete_template(session, template.id)
+    for policy in policies:
+        delete_policy(session, policy.id)
+    assert delete_template(session, template.id)
+    for shard in range(SHARDS):
+        assert _count_on(session, shard, PolicyTemplate) == 0
+
+
+def test_flush_hits_per_shard(session):
+    """Hit counters are written in one batch per shard."""
+    policy_ids = []
+    for names in _names_by_shard("hits").values():
+        fw = create_firewall(session, names[0])
+        policy_ids.append(add_policy(session, fw.id, "p", [{"action": "allow"}]).id)
+    rule_ids = [list_rules(session, policy_id)[0].id for policy_id in policy_ids]
+    counter = HitCounter()
+    counter.record({rule_id: 2 for rule_id in rule_ids} | {rule_ids[-1] + 1: 1})
+    assert flush_hits(session, counter) == SHARDS
+    for policy_id in policy_ids:
+        assert list_rules_with_stats(session, policy_id, counter)[0].hits == 2
+
+
+def test_firewall_stats_per_shard(session):
+    """Summary counts live on their firewall's shard and are read from all."""
+    fws = [create_firewall(session, ns[0]) for ns in _names_by_shard("stats").values()]
+    template = create_template(session, "tpl_stats", [{"action": "deny"}])
+    for fw in fws:
+        add_policy(session, fw.id, "p", [{"action": "allow", "protocol": "tcp"}])
+        attach_template(session, fw.id, template.id)
+    update_template_rules(
+        session, template.id, [{"action": "deny"}, {"action": "allow"}]
+    )
+    for shard in range(SHARDS):
+        assert _count_on(session, shard, FirewallStat) == 1
+
+    stats = list_firewall_stats(session)
+    assert [s["firewall_id"] for s in stats] == sorted(fw.id for fw in fws)
+    assert {s["rules"] for s in stats} == {3}
+    rebuild_firewall_stats(session)
+    assert list_firewall_stats(session) == stats
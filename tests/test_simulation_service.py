@@ -0,0 +1,214 @@
+import random
+
+import pytest
+
+from app.models.firewall import Firewall
+from app.services.evaluation import FirewallRuleset, compile_rules, parse_flow_address
+from app.services.policy import add_policy
+from app.services.rule import add_rule
+from app.services.simulation import RulesetOverlay, compiled_firewall, simulate
+from app.services.template import attach_template, create_template
+
+
+@pytest.fixture
+def firewall(db_session, request):
+    """A firewall with a deny policy followed by an allow policy."""
+    fw = Firewall(name=f"fw_{request.node.name}")
+    db_session.add(fw)
+    db_session.commit()
+    db_session.refresh(fw)
+    deny = add_policy(
+        db_session, fw.id, "deny", [{"action": "deny", "src": "10.0.0.0/8"}]
+    )
+    allow = add_policy(
+        db_session, fw.id, "allow", [{"action": "allow", "protocol": "tcp"}]
+    )
+    return fw.id, deny, allow
+
+
+def test_compiled_firewall_cached_per_version(db_session, firewall):
+    """The compiled ruleset is reused until the firewall changes."""
+    fw_id, deny, _ = firewall
+    first = compiled_firewall(db_session, fw_id)
+    assert compiled_firewall(db_session, fw_id) is first
+    assert len(first) == 2
+
+    add_rule(db_session, deny.id, "deny", src="192.168.0.0/16")
+    second = compiled_firewall(db_session, fw_id)
+    assert second is not first
+    assert len(second) == 3
+
+
+def test_compiled_firewall_shares_template_ruleset(db_session, firewall):
+    """Firewalls attached to a template share its compiled rules."""
+    fw_id, _, _ = firewall
+    template = create_template(
+        db_session, f"sim_{fw_id}", [{"action": "deny", "dst": "1.1.1.1"}]
+    )
+    other = Firewall(name=f"other_{fw_id}")
+    db_session.add(other)
+    db_session.commit()
+    first = attach_template(db_session, fw_id, template.id)
+    second = attach_template(db_session, other.id, template.id)
+    segment = dict(compiled_firewall(db_session, fw_id).segments)[first.id]
+    assert dict(compiled_firewall(db_session, other.id).segments)[second.id] is segment
+
+
+def test_simulate_reports_deltas(db_session, firewall):
+    """Removing the deny rule flips matching TCP flows to allow."""
+    fw_id, deny, allow = firewall
+    flows = [
+        {"src": "10.1.1.1", "dst": "8.8.8.8", "protocol": "tcp"},
+        {"src": "10.1.1.1", "dst": "8.8.8.8", "protocol": "TCP"},
+        {"src": "10.1.1.1", "dst": "8.8.8.8", "protocol": "udp"},
+        {"src": "172.16.0.1", "dst": "8.8.8.8", "protocol": "tcp"},
+    ]
+    result = simulate(
+        db_session, fw_id, [{"policy_id": deny.id, "remove": [deny.rules[0].id]}], flows
+    )
+    assert result["flows"] == 4
+    assert result["unique_flows"] == 3
+    # Only flows matching the removed rule are evaluated
+    assert result["evaluated"] == 2
+    assert result["changed"] == 2
+    assert result["transitions"] == {"deny->allow": 2}
+    [delta] = result["deltas"]
+    assert delta["count"] == 2
+    assert delta["before"]["rule_id"] == deny.rules[0].id
+    assert delta["after"] == {
+        "action": "allow",
+        "policy_id": allow.id,
+        "rule_id": allow.rules[0].id,
+    }
+
+
+def test_simulate_additions_and_new_policy(db_session, firewall):
+    """Added rules go after their policy's rules; new policies go last."""
+    fw_id, deny, allow = firewall
+    flows = [
+        {"src": "10.1.1.1", "dst": "8.8.8.8", "protocol": "udp"},
+        {"src": "172.16.0.1", "dst": "8.8.8.8", "protocol": "tcp"},
+        {"src": "172.16.0.1", "dst": "1.1.1.1", "protocol": "udp"},
+    ]
+    changes = [
+        # Shadowed by the existing allow-tcp rule: no delta
+        {"policy_id": allow.id, "add": [{"action": "deny", "protocol": "tcp"}]},
+        {"add": [{"action": "allow", "dst": "1.1.1.1"}]},
+    ]
+    result = simulate(db_session, fw_id, changes, flows)
+    assert result["changed"] == 1
+    [delta] = result["deltas"]
+    assert delta["dst"] == "1.1.1.1"
+    assert delta["after"]["policy_id"] is None
+    # The current ruleset is untouched by the overlay
+    assert len(compiled_firewall(db_session, fw_id)) == 2
+
+
+def test_simulate_validates_changes(db_session, firewall):
+    """Unknown policies and rules are rejected."""
+    fw_id, deny, _ = firewall
+    with pytest.raises(ValueError):
+        simulate(db_session, fw_id, [{"policy_id": -1, "add": []}], [])
+    with pytest.raises(ValueError):
+        simulate(db_session, fw_id, [{"policy_id": deny.id, "remove": [-1]}], [])
+    with pytest.raises(ValueError):
+        simulate(db_session, fw_id, [{"policy_id": deny.id, "add": [{}]}], [])
+
+
+def test_simulate_matches_full_evaluation(db_session, firewall):
+    """Skipping flows that miss every changed rule never hides a delta."""
+    fw_id, deny, allow = firewall
+    rng = random.Random(7)
+    changes = [
+        {"policy_id": deny.id, "remove": [deny.rules[0].id]},
+        {"policy_id": allow.id, "add": [{"action": "deny", "dst": "10.2.0.0/16"}]},
+    ]
+    flows = [
+        {
+            "src": f"10.{rng.randrange(4)}.0.1",
+            "dst": f"10.{rng.randrange(4)}.{rng.randrange(4)}.1",
+            "protocol": rng.choice(["tcp", "udp"]),
+        }
+        for _ in range(200)
+    ]
+    result = simulate(db_session, fw_id, changes, flows)
+    # Every flow is denied by the removed rule today; without it TCP flows
+    # are allowed and everything else still falls through to deny
+    assert result["changed"] == sum(f["protocol"] == "tcp" for f in flows)
+    base = compiled_firewall(db_session, fw_id)
+    for delta in result["deltas"]:
+        match = base.evaluate(
+            parse_flow_address(delta["src"]),
+            parse_flow_address(delta["dst"]),
+            delta["protocol"],
+        )
+        assert match[1].action == delta["before"]["action"]
+
+
+def test_overlay_compare_matches_evaluate():
+    """The single-scan comparison agrees with evaluating both rulesets."""
+    rng = random.Random(11)
+
+    def random_rules(n, start):
+        return [
+            {
+                "id": start + i,
+                "action": rng.choice(["allow", "deny"]),
+                "src": rng.choice([None, "10.0.0.0/8", "10.1.0.0/16", "10.1.1.0/24"]),
+                "dst": rng.choice([None, "8.8.8.8", "8.8.0.0/16"]),
+                "protocol": rng.choice([None, "tcp", "udp"]),
+            }
+            for i in range(n)
+        ]
+
+    for _ in range(50):
+        segments = [(p, compile_rules(random_rules(5, p * 10))) for p in range(4)]
+        base = FirewallRuleset(segments)
+        removed = {p: {p * 10 + rng.randrange(5)} for p in rng.sample(range(4), 2)}
+        added = {
+            key: [compile_rules(random_rules(2, 100))]
+            for key in rng.sample([0, 1, 2, 3, None], 2)
+        }
+        overlay = RulesetOverlay(base, removed, added)
+        for _ in range(50):
+            flow = (
+                parse_flow_address(f"10.{rng.randrange(3)}.1.1"),
+                parse_flow_address(rng.choice(["8.8.8.8", "8.8.4.4", "1.1.1.1"])),
+                rng.choice(["tcp", "udp", "icmp"]),
+            )
+            assert overlay.compare(*flow) == (
+                base.evaluate(*flow),
+                overlay.evaluate(*flow),
+            )
+
+
+def test_simulate_endpoint(app, firewall):
+    """The endpoint validates flows and 404s on unknown firewalls."""
+    fw_id, _, _ = firewall
+    client = app.test_client()
+    flows = [{"src": "10.0.0.1", "protocol": "tcp"}]
+    resp = client.post(f"/api/firewalls/{fw_id}/simulate", json={"flows": flows})
+    assert resp.status_code == 200
+    assert resp.get_json()["changed"] == 0
+    resp = client.post(f"/api/firewalls/{fw_id}/simulate", json={"flows": "x"})
+    assert resp.status_code == 400
+    resp = client.post("/api/firewalls/999999/simulate", json={"flows": []})
+    assert resp.status_code == 404
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"changes": [1], "flows": []},
+        {"changes": [{"add": [{"action": "allow", "src": 5}]}], "flows": []},
+        {"changes": [{"add": [{"src": "10.0.0.1"}]}], "flows": []},
+        {"changes": [{"policy_id": "abc"}], "flows": []},
+        {"flows": [{"src": "10.0.0.1", "protocol": 6}]},
+        {"flows": [1]},
+        [],
+    ],
+)
+def test_simulate_endpoint_rejects_malformed_body(app, firewall, body):
+    fw_id, _, _ = firewall
+    resp = app.test_client().post(f"/api/firewalls/{fw_id}/simulate", json=body)
+    assert resp.status_code == 400
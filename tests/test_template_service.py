@@ -0,0 +1,251 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import func, inspect, select
+
+from app import create_app
+from app.db import db
+from app.models.firewall import Firewall
+from app.models.policy import FilteringPolicy
+from app.models.rule import Rule
+from app.models.template import PolicyTemplate
+from app.services.canonical import DuplicateRuleError
+from app.services.evaluation import parse_flow_address, ruleset_cache
+from app.services.policy import add_policy, list_policies
+from app.services.rule import (
+    add_rule,
+    delete_rule,
+    delete_rules,
+    list_rules,
+    replace_rules,
+)
+from app.services.rule_stats import HitCounter, ingest_hits
+from app.services.template import (
+    attach_template,
+    compiled_template,
+    create_template,
+    delete_template,
+    get_template,
+    update_template_rules,
+)
+
+# Schema of a database created before templates
+PRE_TEMPLATE_SCHEMA = """
+CREATE TABLE firewalls (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(128) NOT NULL UNIQUE,
+    description TEXT
+);
+CREATE TABLE policies (
+    id INTEGER NOT NULL PRIMARY KEY,
+    name VARCHAR(128) NOT NULL,
+    firewall_id INTEGER REFERENCES firewalls (id) ON DELETE CASCADE
+);
+CREATE TABLE rules (
+    id INTEGER NOT NULL PRIMARY KEY,
+    action VARCHAR(16) NOT NULL,
+    src VARCHAR(64),
+    dst VARCHAR(64),
+    protocol VARCHAR(16),
+    policy_id INTEGER REFERENCES policies (id) ON DELETE CASCADE
+);
+INSERT INTO firewalls VALUES (1, 'fw_old', 'before templates');
+INSERT INTO policies VALUES (1, 'p1', 1);
+INSERT INTO rules VALUES (1, 'allow', '10.0.0.1', NULL, 'tcp', 1);
+"""
+
+BASELINE = [
+    {"action": "deny", "src": "10.0.0.0/8", "protocol": "tcp"},
+    {"action": "allow", "dst": "8.8.8.8", "protocol": "udp"},
+]
+
+
+@pytest.fixture
+def firewalls(db_session, request):
+    """Two firewalls unique to the test."""
+    fws = [Firewall(name=f"fw_{request.node.name}_{i}") for i in range(2)]
+    db_session.add_all(fws)
+    db_session.commit()
+    return [fw.id for fw in fws]
+
+
+def _own_rule_count(db_session, policy_id):
+    return db_session.scalar(
+        select(func.count()).select_from(Rule).where(Rule.policy_id == policy_id)
+    )
+
+
+def test_create_template(db_session):
+    """Templates start at version 1 with canonical rules."""
+    template = create_template(db_session, "tpl_create", BASELINE)
+    assert template.version == 1
+    assert [r.src for r in template.rules] == ["10.0.0.0/8", None]
+
+
+def test_create_template_duplicate_name(db_session):
+    """Template names are unique."""
+    create_template(db_session, "tpl_unique", [])
+    with pytest.raises(ValueError):
+        create_template(db_session, "tpl_unique", [])
+
+
+@pytest.mark.parametrize(
+    "rules", [[{"action": "bogus"}], [{"src": "10.0.0.1"}], [{"action": 5}], {}]
+)
+def test_create_template_endpoint_rejects_invalid_rules(app, db_session, rules):
+    """Invalid rules are rejected before the template is written."""
+    client = app.test_client()
+    response = client.post("/api/templates/", json={"name": "tpl_bad", "rules": rules})
+    assert response.status_code == 400
+    assert (
+        db_session.scalar(select(func.count()).where(PolicyTemplate.name == "tpl_bad"))
+        == 0
+    )
+    assert client.get("/api/templates/").status_code == 200
+
+
+def test_attach_template_shares_rules(db_session, firewalls):
+    """Attached policies expose the template's rules without copying them."""
+    template = create_template(db_session, "tpl_attach", BASELINE)
+    policies = [attach_template(db_session, fw_id, template.id) for fw_id in firewalls]
+
+    for fw_id, policy in zip(firewalls, policies):
+        assert policy.template_id == template.id
+        assert policy.name == "tpl_attach"
+        assert [r.action for r in list_rules(db_session, policy.id)] == [
+            "deny",
+            "allow",
+        ]
+        assert [p.rules for p in list_policies(db_session, fw_id)] == [policy.rules]
+        assert _own_rule_count(db_session, policy.id) == 0
+
+
+def test_update_template_propagates(db_session, firewalls):
+    """Updating a template bumps its version and every attached policy sees it."""
+    template = create_template(db_session, "tpl_update", BASELINE)
+    policy = attach_template(db_session, firewalls[0], template.id)
+    updated = update_template_rules(db_session, template.id, [{"action": "deny"}])
+    assert updated.version == 2
+    assert [r.action for r in list_rules(db_session, policy.id)] == ["deny"]
+
+
+def test_add_rule_copies_on_write(db_session, firewalls):
+    """Customizing an attached policy detaches it with its own rule copy."""
+    template = create_template(db_session, "tpl_cow_add", BASELINE)
+    policy = attach_template(db_session, firewalls[0], template.id)
+    other = attach_template(db_session, firewalls[1], template.id)
+
+    add_rule(db_session, policy.id, "allow", "192.168.0.1")
+    rules = list_rules(db_session, policy.id)
+    assert [r.src for r in rules] == ["10.0.0.0/8", None, "192.168.0.1"]
+    assert _own_rule_count(db_session, policy.id) == 3
+    assert list_policies(db_session, firewalls[0])[0].template_id is None
+    # The template and the other firewall are untouched
+    assert len(get_template(db_session, template.id).rules) == 2
+    assert list_policies(db_session, firewalls[1])[0].template_id == template.id
+    assert len(list_rules(db_session, other.id)) == 2
+
+
+def test_delete_rules_copies_on_write(db_session, firewalls):
+    """Deleting template rules from a policy copies only the remaining ones."""
+    template = create_template(db_session, "tpl_cow_delete", BASELINE)
+    policy = attach_template(db_session, firewalls[0], template.id)
+    first = template.rules[0].id
+    assert delete_rules(db_session, policy.id, [first]) == 1
+    assert [r.action for r in list_rules(db_session, policy.id)] == ["allow"]
+    assert len(get_template(db_session, template.id).rules) == 2
+
+
+def test_replace_rules_detaches(db_session, firewalls):
+    """Replacing the rules of an attached policy drops the template reference."""
+    template = create_template(db_session, "tpl_cow_replace", BASELINE)
+    policy = attach_template(db_session, firewalls[0], template.id)
+    result = replace_rules(db_session, policy.id, [{"action": "allow"}])
+    assert result == {"deleted": 2, "created": 1, "duplicates": 0}
+    assert list_policies(db_session, firewalls[0])[0].template_id is None
+
+
+def test_delete_attached_template(db_session, firewalls):
+    """Templates cannot be deleted while policies reference them."""
+    template = create_template(db_session, "tpl_delete", BASELINE)
+    attach_template(db_session, firewalls[0], template.id)
+    with pytest.raises(ValueError):
+        delete_template(db_session, template.id)
+    unused = create_template(db_session, "tpl_delete_unused", [])
+    assert delete_template(db_session, unused.id) is True
+    assert delete_template(db_session, unused.id) is False
+
+
+def test_add_duplicate_of_template_rule(app, db_session, firewalls):
+    """A rule duplicating a template rule is rejected without copy-on-write."""
+    template = create_template(
+        db_session, "tpl_add_dup", [{"action": "allow", "src": "10.0.0.1"}]
+    )
+    policy = attach_template(db_session, firewalls[0], template.id)
+    with pytest.raises(DuplicateRuleError) as exc:
+        add_rule(db_session, policy.id, "allow", "10.0.0.1/32")
+    assert exc.value.rule.id == template.rules[0].id
+    assert list_policies(db_session, firewalls[0])[0].template_id == template.id
+
+    response = app.test_client().post(
+        f"/api/rules/policy/{policy.id}?on_duplicate=report",
+        json={"action": "allow", "src": "10.0.0.1/32"},
+    )
+    assert response.status_code == 200
+    assert response.get_json()["rule"]["id"] == template.rules[0].id
+
+
+def test_template_rule_ids_are_distinct(app, db_session, firewalls):
+    """Template rule IDs never match a rule ID, so they cannot act on rules."""
+    fw_a, fw_b = firewalls
+    own = add_policy(db_session, fw_a, "own", [{"action": "allow"}])
+    template = create_template(db_session, "tpl_ids", [{"action": "deny"}])
+    policy = attach_template(db_session, fw_b, template.id)
+    (shared,) = list_rules(db_session, policy.id)
+    assert shared.id == template.rules[0].id
+    assert db_session.get(Rule, shared.id) is None
+
+    with pytest.raises(ValueError):
+        delete_rule(db_session, shared.id)
+    with pytest.raises(ValueError):
+        ingest_hits(db_session, {shared.id: 1}, HitCounter())
+    client = app.test_client()
+    assert client.delete(f"/api/rules/{shared.id}").status_code == 400
+    response = client.post("/api/rules/hits", json={"hits": {str(shared.id): 1}})
+    assert response.status_code == 400
+    assert [r.id for r in list_rules(db_session, own.id)] == [own.rules[0].id]
+    assert [r.id for r in list_rules(db_session, policy.id)] == [shared.id]
+
+
+def test_template_column_on_upgrade(tmp_path):
+    """Policies of a database created before templates get template_id."""
+    path = tmp_path / "old.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(PRE_TEMPLATE_SCHEMA)
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"})
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=["schema", "upgrade"])
+        assert "policies.template_id" in result.output
+        inspector = inspect(db.engine)
+        assert "template_id" in {c["name"] for c in inspector.get_columns("policies")}
+        assert "ix_policies_template_id" in {
+            ix["name"] for ix in inspector.get_indexes("policies")
+        }
+        assert db.session.scalar(select(FilteringPolicy.template_id)) is None
+        db.session.remove()
+
+
+def test_compiled_template_cached_per_version(db_session):
+    """One compile serves every lookup until the template version changes."""
+    template = create_template(db_session, "tpl_compile", BASELINE)
+    first = compiled_template(db_session, template.id)
+    assert compiled_template(db_session, template.id) is first
+
+    flow = (parse_flow_address("10.1.2.3"), parse_flow_address("1.1.1.1"), "tcp")
+    assert first.evaluate(*flow).action == "deny"
+
+    update_template_rules(db_session, template.id, [{"action": "allow"}])
+    second = compiled_template(db_session, template.id)
+    assert second is not first
+    assert second.evaluate(*flow).action == "allow"
+    assert ("template", template.id, 2) in ruleset_cache._entries
@@ -0,0 +1,118 @@
+import pytest
+
+from app.models.firewall import Firewall
+from app.services.policy import add_policy
+from app.services.rule import add_rule
+from app.services.rule_stats import HitCounter
+from app.services.template import (
+    attach_template,
+    create_template,
+    update_template_rules,
+)
+from app.services.verdict import VerdictCache, evaluate_flows
+
+FLOWS = [
+    {"src": "10.1.2.3", "dst": "8.8.8.8", "protocol": "TCP"},
+    {"src": "192.168.1.1", "dst": "8.8.8.8", "protocol": "udp"},
+    {"src": "192.168.1.1", "dst": "8.8.8.8", "protocol": "tcp"},
+]
+
+
+@pytest.fixture
+def firewall(db_session, request):
+    """A firewall denying 10/8, then allowing TCP."""
+    fw = Firewall(name=f"fw_{request.node.name}")
+    db_session.add(fw)
+    db_session.commit()
+    deny = add_policy(
+        db_session, fw.id, "deny", [{"action": "deny", "src": "10.0.0.0/8"}]
+    )
+    add_policy(db_session, fw.id, "allow", [{"action": "allow", "protocol": "tcp"}])
+    return fw.id, deny
+
+
+def test_evaluate_flows_cached(db_session, firewall):
+    """Repeated flows are answered from the cache with the same verdicts."""
+    fw_id, deny = firewall
+    cache = VerdictCache()
+    verdicts = evaluate_flows(db_session, fw_id, FLOWS, cache)
+    assert [v["action"] for v in verdicts] == ["deny", "deny", "allow"]
+    assert verdicts[0]["policy_id"] == deny.id
+    assert verdicts[0]["rule_id"] == deny.rules[0].id
+    assert verdicts[1]["rule_id"] is None
+    assert verdicts[0]["protocol"] == "tcp"
+
+    assert evaluate_flows(db_session, fw_id, FLOWS, cache) == verdicts
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (3, 3, 3)
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_rule_change_never_served_stale(db_session, firewall):
+    """Verdicts cached before a rule change are not served after it."""
+    fw_id, deny = firewall
+    cache = VerdictCache()
+    evaluate_flows(db_session, fw_id, FLOWS, cache)
+    add_rule(db_session, deny.id, "deny", src="192.168.0.0/16")
+    verdicts = evaluate_flows(db_session, fw_id, FLOWS, cache)
+    assert [v["action"] for v in verdicts] == ["deny", "deny", "deny"]
+    assert cache.stats()["hits"] == 0
+
+
+def test_evaluate_flows_counts_hits(db_session, firewall):
+    """Matched rules get a hit per flow, cached or not; template rules none."""
+    fw_id, deny = firewall
+    template = create_template(
+        db_session, f"tpl_hits_{fw_id}", [{"action": "allow", "protocol": "udp"}]
+    )
+    attach_template(db_session, fw_id, template.id)
+    cache, counter = VerdictCache(), HitCounter()
+    evaluate_flows(db_session, fw_id, FLOWS, cache, counter)
+    evaluate_flows(db_session, fw_id, FLOWS[:1], cache, counter)
+    assert counter.pending(deny.rules[0].id) == 2
+    assert len(counter) == 2
+
+
+def test_template_change_never_served_stale(db_session, firewall):
+    """Template updates invalidate verdicts of firewalls attached to it."""
+    fw_id, _ = firewall
+    template = create_template(db_session, f"tpl_verdict_{fw_id}", [])
+    attach_template(db_session, fw_id, template.id)
+    cache = VerdictCache()
+    flow = [{"src": "172.16.0.1", "dst": "1.1.1.1", "protocol": "udp"}]
+    assert evaluate_flows(db_session, fw_id, flow, cache)[0]["action"] == "deny"
+    update_template_rules(db_session, template.id, [{"action": "allow"}])
+    assert evaluate_flows(db_session, fw_id, flow, cache)[0]["action"] == "allow"
+
+
+def test_lru_and_ttl_eviction():
+    """The least recently used entry is evicted; expired entries miss."""
+    cache = VerdictCache(max_size=2, ttl=10)
+    cache.put("a", ("allow", 1, 1), now=0)
+    cache.put("b", ("deny", 1, 2), now=0)
+    assert cache.get("a", now=1) == ("allow", 1, 1)
+    cache.put("c", ("deny", None, None), now=1)
+    assert cache.get("b", now=1) is None
+    assert cache.get("a", now=10) is None
+    assert cache.get("c", now=5) == ("deny", None, None)
+    stats = cache.stats()
+    assert (stats["evictions"], stats["expirations"], stats["size"]) == (1, 1, 1)
+
+
+def test_evaluate_endpoint(app, db_session, firewall):
+    """The endpoint returns one verdict per flow and validates its input."""
+    fw_id, _ = firewall
+    client = app.test_client()
+    response = client.post(f"/api/firewalls/{fw_id}/evaluate", json={"flows": FLOWS})
+    assert response.status_code == 200
+    assert [v["action"] for v in response.json] == ["deny", "deny", "allow"]
+    for flows in ([1], [{"protocol": 6}], [{"src": ["10.0.0.1"]}], None):
+        bad = client.post(f"/api/firewalls/{fw_id}/evaluate", json={"flows": flows})
+        assert bad.status_code == 400
+    bad = client.post(f"/api/firewalls/{fw_id}/evaluate", json=[])
+    assert bad.status_code == 400
+    missing = client.post("/api/firewalls/999999/evaluate", json={"flows": FLOWS})
+    assert missing.status_code == 404
+    stats = client.get("/api/firewalls/verdict-cache").json
+    assert stats["size"] >= 3
+    assert 0 <= stats["hit_ratio"] <= 1